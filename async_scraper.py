@@ -0,0 +1,332 @@
+import asyncio
+from time import perf_counter
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+    URL = None
+
+from scraper import *
+from cloudscraper_object import create_cloudscraper, is_challenge_page
+
+# Requests kept in flight at once by an AsyncHltvClient
+MAX_CONCURRENCY = 100
+
+# Seconds before a request is abandoned and retried
+REQUEST_TIMEOUT = 60
+
+# Page a cloudscraper session visits to get the Cloudflare clearance cookies
+CLEARANCE_URL = "https://www.hltv.org/"
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for the async client.  Install it with 'pip install aiohttp'.")
+
+
+class AsyncResponse:
+    """
+    Finished aiohttp response, with the attributes cloudscraper_object.classify_response reads.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class AsyncHltvClient:
+    """
+    asyncio client for HLTV pages.  One aiohttp session with a connection pool, and at most max_concurrency requests in flight.
+    Requests share the global rate limiter, adaptive rate control, html cache and run metrics with the threaded get_page_text.
+    The user agent and Cloudflare clearance cookies come from a cloudscraper session, solved again when a challenge is served.  clearance_url=None skips this.
+    Use as 'async with AsyncHltvClient() as client:', or call close() when done.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, use_cache=True, max_retries=MAX_RETRIES, clearance_url=CLEARANCE_URL, timeout=REQUEST_TIMEOUT):
+        _require_aiohttp()
+        self.max_concurrency = max_concurrency
+        self.use_cache = use_cache
+        self.max_retries = max_retries
+        self.clearance_url = clearance_url
+        self.timeout = timeout
+        self.headers = {}
+        self._session = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._clearance_lock = asyncio.Lock()
+        self._clearance_generation = 0
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        if self.clearance_url is not None:
+            await self.refresh_clearance()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _solve_clearance(self):
+        session = create_cloudscraper()
+        try:
+            session.get(self.clearance_url)
+            return session.headers.get('User-Agent'), {cookie.name: cookie.value for cookie in session.cookies}
+        finally:
+            session.close()
+
+    async def refresh_clearance(self, generation=None):
+        """
+        Gets a new user agent and clearance cookies from a cloudscraper session, run in a thread.
+        Requests that saw the same challenge (same generation) trigger a single refresh.
+        """
+        async with self._clearance_lock:
+            if generation is not None and generation != self._clearance_generation:
+                return
+            try:
+                user_agent, cookies = await asyncio.to_thread(self._solve_clearance)
+            except Exception as error:
+                print(f"WARNING: Cloudflare clearance not refreshed! {error!r}")
+                return
+            if user_agent:
+                self.headers['User-Agent'] = user_agent
+            self._session.cookie_jar.update_cookies(cookies, URL(self.clearance_url))
+            self._clearance_generation += 1
+
+    async def get_text(self, url, sleep_time=0):
+        """
+        Async get_page_text.  Same caching, rate limiting, retries and FetchError.
+        """
+        await self.open()
+        cache = get_html_cache() if self.use_cache else None
+        url_class = classify_url(url)
+
+        html = await asyncio.to_thread(get_cached_page, cache, url, url_class)
+        if html is not None:
+            return html
+
+        for attempt in range(self.max_retries + 1):
+            if sleep_time:
+                await asyncio.sleep(sleep_time)
+            await rate_limiter.acquire_async()
+
+            response = None
+            error = None
+            generation = self._clearance_generation
+            async with self._semaphore:
+                request_start = perf_counter()
+                try:
+                    async with self._session.get(url, headers=self.headers) as raw_response:
+                        response = AsyncResponse(raw_response.status, raw_response.headers, await raw_response.read())
+                except (aiohttp.ClientError, asyncio.TimeoutError) as request_error:
+                    error = request_error
+                elapsed = perf_counter() - request_start
+
+            outcome, delay = record_fetch_outcome(url, url_class, attempt, self.max_retries, elapsed, response, error)
+            if outcome == 'ok':
+                return await asyncio.to_thread(cache_page, cache, url, url_class, response.text)
+
+            if outcome == 'throttled' and response is not None and is_challenge_page(response) and self.clearance_url is not None:
+                await self.refresh_clearance(generation)
+            await asyncio.sleep(delay)
+
+    async def get_html(self, url, sleep_time=0, full_page=False):
+        """
+        Async get_page_html.  Parsing runs in a worker thread so it does not hold up the event loop.
+        """
+        html = await self.get_text(url, sleep_time)
+        page_type = None if full_page else get_page_type(url)
+
+        def parse():
+            with metrics.timer('parse', page_type or 'full'):
+                return make_soup(html, page_type=page_type)
+
+        return await asyncio.to_thread(parse)
+
+
+async def _with_client(client, coroutine_fn):
+    """
+    Runs coroutine_fn(client), opening a client of its own if none is given.
+    """
+    if client is not None:
+        return await coroutine_fn(client)
+    async with AsyncHltvClient() as own_client:
+        return await coroutine_fn(own_client)
+
+
+async def crawl_results_pages_async(client, start_date, end_date, sleep_time=0, known_ids=None):
+    """
+    Async crawl_results_pages.  Pages of one range follow each other through the pagination links, so they are fetched in turn.
+    """
+    results_url = f"https://www.hltv.org/results?startDate={start_date}&endDate={end_date}"
+
+    match_list = []
+    while results_url is not None:
+        results_page_html = await client.get_html(results_url, sleep_time)
+        page_matches, results_url = await asyncio.to_thread(parse_results_page, results_page_html, results_url)
+
+        if known_ids is not None:
+            for i, match in enumerate(page_matches):
+                if match[0] in known_ids:
+                    match_list.extend(page_matches[:i])
+                    return match_list
+
+        match_list.extend(page_matches)
+
+    return match_list
+
+
+async def scrape_match_list_async(start_date, end_date, sleep_time=0, update_csv=True, shard_days=None, client=None):
+    """
+    Async scrape_match_list, returning the same list.  With shard_days set, every shard is crawled at once.
+    """
+    check_date_range(start_date, end_date)
+    warn_rating_change(start_date, end_date)
+
+    async def crawl(client):
+        if shard_days is None:
+            return await crawl_results_pages_async(client, start_date, end_date, sleep_time)
+        shards = split_date_range(start_date, end_date, shard_days)
+        print(f"Crawling {len(shards)} date shards of up to {shard_days} days.")
+        shard_match_lists = await asyncio.gather(*[crawl_results_pages_async(client, shard_start, shard_end, sleep_time) for shard_start, shard_end in shards])
+        return merge_match_lists(shard_match_lists)
+
+    match_list = await _with_client(client, crawl)
+
+    if update_csv:
+        await asyncio.to_thread(update_csv_file, MATCH_LIST_CSV, match_list, ['id', 'date', 'title', 'url', 'teams', 'winner', 'score'])
+
+    return match_list
+
+
+async def fetch_player_stats_block_async(client, stats_url, sleep_time=0):
+    try:
+        player_stats_html = await client.get_html(stats_url, sleep_time)
+    except FetchError as error:
+        print(f"ERROR: Player stats page not fetched! {error}")
+        return STATS_NOT_FETCHED
+    return await asyncio.to_thread(get_player_stats_block, player_stats_html)
+
+
+async def fetch_player_stats_requests_async(client, requests, sleep_time=0, memo=player_stats_memo):
+    """
+    Async fetch_player_stats_requests.  Every page not in memo is requested at once, the client bounds how many are in flight.
+    """
+    stats_by_key, keys_to_fetch = split_memoized_requests(requests, memo)
+    stats_blocks = await asyncio.gather(*[fetch_player_stats_block_async(client, requests[key], sleep_time) for key in keys_to_fetch])
+    return memoize_fetched_stats(stats_by_key, keys_to_fetch, stats_blocks, memo)
+
+
+async def get_player_stats_prior_to_match_async(client, match_html, player_stat_range, sleep_time=0):
+    """
+    Async get_player_stats_prior_to_match, returning the same nested dict of team_id -> {player_id: stats}.
+    Takes an open AsyncHltvClient, so calls for many matches share its connection pool and clearance.
+    """
+    requests, match_keys = await asyncio.to_thread(plan_player_stats_requests, [(None, match_html)], player_stat_range)
+    stats_by_key = await fetch_player_stats_requests_async(client, requests, sleep_time)
+    player_stats = assemble_player_stats(match_keys, stats_by_key)[None]
+    if has_unfetched_stats(player_stats):
+        raise FetchError("Player stats pages not fetched.")
+    return player_stats
+
+
+async def scrape_player_stats_for_matches_async(client, matches, player_stat_range, sleep_time=0, update_players_csv=False, update_teams_csv=False):
+    """
+    Async scrape_player_stats_for_matches.  All match pages are fetched at once, then all of their player stats pages.
+    Parsing, planning and registry updates run in worker threads so they do not hold up the event loop.
+    """
+    async def fetch_match(match):
+        print("-Processing: " + match[3])
+        try:
+            return match[0], await client.get_html(match[3], sleep_time)
+        except FetchError as error:
+            print(f"ERROR: Match page not fetched, skipping! {error}")
+            return None
+
+    match_pages = [page for page in await asyncio.gather(*[fetch_match(match) for match in matches]) if page is not None]
+
+    def register_entities():
+        for match_id, match_html in match_pages:
+            register_match_entities(parse_match_page(match_html), players=update_players_csv, teams=update_teams_csv)
+
+    if update_players_csv or update_teams_csv:
+        await asyncio.to_thread(register_entities)
+
+    requests, match_keys = await asyncio.to_thread(plan_player_stats_requests, match_pages, player_stat_range)
+    print(f"Fetching {len(requests)} unique player stats pages for {sum(len(player_keys) for team_keys in match_keys.values() for player_keys in team_keys.values())} player entries.")
+    stats_by_key = await fetch_player_stats_requests_async(client, requests, sleep_time)
+
+    return drop_unfetched_matches([[match_id, player_stats] for match_id, player_stats in assemble_player_stats(match_keys, stats_by_key).items()])
+
+
+async def scrape_stat_range_async(match_list, player_stat_range, return_output=False, sleep_time=0, update_stats_csv=True, update_players_csv=True, update_teams_csv=True, chunk_size=100, stream=False, parquet_output=False, metrics_report=None, client=None):
+    """
+    Async scrape_stat_range.  Same files and return value.
+    match_list can be any iterable of match list rows, e.g. iter_matches(start_date, end_date).  It is read lazily in a worker thread, chunk_size matches at a time.
+    Each chunk has all of its requests in flight at once (bounded by the client's max_concurrency and the global rate limit), then is committed.
+    stream=True also commits each chunk to the journal first, as in scrape_stat_range.
+    File IO and parsing run in worker threads, so the event loop is never blocked by them.
+    """
+    start_timer()
+    metrics.reset()
+    print(f"Getting player stats for {player_stat_range} days prior to each match.")
+    print()
+
+    stats_csv = get_stats_csv_filename(player_stat_range)
+
+    journal = MatchJournal(stats_csv + '.journal') if stream else None
+    matches_ids_from_file = await asyncio.to_thread(load_saved_match_ids, stats_csv, journal, update_stats_csv)
+
+    # Lists are counted up front.  Any other iterable (e.g. iter_matches) is read lazily, chunk_size matches at a time.
+    total_new = count_new_matches(match_list, matches_ids_from_file, stats_csv)
+    match_dates = {}
+    chunks = iter_chunks(select_new_matches(match_list, matches_ids_from_file, match_dates), chunk_size)
+
+    match_player_data = []
+    parquet_writer = PlayerStatsParquetWriter() if parquet_output else None
+    commit = make_commit(stats_csv, player_stat_range, journal=journal, update_stats_csv=update_stats_csv, parquet_writer=parquet_writer, match_dates=match_dates, output=match_player_data if return_output else None)
+
+    async def scrape(client):
+        committed = 0
+        while True:
+            # Reading the next chunk may fetch results pages, e.g. with iter_matches
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            chunk_data = await scrape_player_stats_for_matches_async(client, chunk, player_stat_range, sleep_time, update_players_csv, update_teams_csv)
+            await asyncio.to_thread(commit, chunk_data)
+            await asyncio.to_thread(flush_registries)
+            committed += len(chunk)
+            print(f"Committed {committed} of {total_new if total_new is not None else 'unknown'} matches.")
+
+    try:
+        await _with_client(client, scrape)
+    finally:
+        if parquet_writer is not None:
+            with metrics.timer('write', 'parquet'):
+                await asyncio.to_thread(parquet_writer.flush)
+    await asyncio.to_thread(flush_registries, quiet=False)
+
+    if metrics_report is not None:
+        await asyncio.to_thread(write_run_report, metrics_report)
+
+    print()
+    end_timer()
+
+    if return_output:
+        return match_player_data
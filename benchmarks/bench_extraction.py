@@ -0,0 +1,190 @@
+"""
+Compares the precompiled extraction specs (extraction.py) with the find() based extractors they replaced.
+
+Usage:
+    python benchmarks/bench_extraction.py [--fixtures DIR] [--pages N] [--full-page]
+
+Each corpus page is parsed once, then both versions of its extractor are run until N pages were extracted.
+Outputs of both versions are compared before timing.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import datetime as dt
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsing import make_soup, set_partial_parsing
+from extraction import MATCH_PAGE_SPEC
+from match_stats import get_map_scoreboard, _parse_count_cell, _parse_float_cell
+from scraper import parse_results_page
+from match_parser import get_match_id_title
+from player_stats import get_player_stats_block
+from corpus import FIXTURES_DIR, load_corpus
+
+
+# Previous extractors, kept here as the baseline
+
+def legacy_player_stats_block(player_stats_html):
+    stat_types_1 = []
+    stat_values_str = []
+    summaryBreakdownContainer = player_stats_html.find('div', {'class': 'summaryBreakdownContainer'})
+    for stat_html in summaryBreakdownContainer.find_all('div', {'class': re.compile(r"summaryStatBreakdown (.*)")}):
+        stat_types_1.append(stat_html.find('div', {'class':'summaryStatBreakdownSubHeader'}).find('b').text)
+        stat_values_str.append(stat_html.find('div', {'class':'summaryStatBreakdownDataValue'}).text)
+
+    stat_block_html = player_stats_html.find('div', {'class': 'statistics'})
+    stat_types_2 = [row.find('span').text for row in stat_block_html.find_all('div', {'class':'stats-row'})]
+    for stat_type in stat_types_2:
+        stat_values_str.append(stat_block_html.find('span', string=stat_type).find_next_sibling('span').text)
+
+    modified_list = [item.lower().replace(' / ', '_per_').replace('/','').replace(' ', '_').replace('%', 'percent').replace('.0','') for item in stat_types_1 + stat_types_2]
+    stat_values = [float(item[:-1])/100 if item[-1] == '%' else float(item) for item in stat_values_str]
+    return dict(zip(modified_list, stat_values))
+
+
+def legacy_map_scoreboard(map_stats_html):
+    info_box = map_stats_html.find('div', {'class': 'match-info-box'})
+    date_html = info_box.find('span', attrs={'data-unix': True})
+    date = dt.datetime.fromtimestamp(int(date_html['data-unix'])/1000).strftime('%Y-%m-%d')
+    rounds = 0
+    for side in ('team-left', 'team-right'):
+        rounds += int(info_box.find('div', {'class': side}).find('div', {'class': 'bold'}).text)
+
+    players = OrderedDict()
+    for table in map_stats_html.find_all('table', {'class': 'totalstats'}):
+        for row in table.find('tbody').find_all('tr'):
+            player_id = row.find('td', {'class': 'st-player'}).find('a')['href'].split('/')[3]
+            kills, headshots = _parse_count_cell(row.find('td', {'class': 'st-kills'}).text)
+            assists, _ = _parse_count_cell(row.find('td', {'class': 'st-assists'}).text)
+            deaths, _ = _parse_count_cell(row.find('td', {'class': 'st-deaths'}).text)
+            players[player_id] = {
+                'kills': kills, 'headshots': headshots, 'assists': assists, 'deaths': deaths,
+                'adr': _parse_float_cell(row.find('td', {'class': 'st-adr'}).text),
+                'kast': _parse_float_cell(row.find('td', {'class': 'st-kdratio'}).text),
+                'rating': _parse_float_cell(row.find('td', {'class': 'st-rating'}).text),
+            }
+    return {'date': date, 'rounds': rounds, 'players': players}
+
+
+def legacy_results_page(results_page_html, results_url):
+    match_list = []
+    results_holder = results_page_html.find('div', {'class':'results-holder allres'})
+    for match in results_holder.find_all('div', {'class':'result-con'}):
+        match_url = "https://www.hltv.org" + match.find('a', {'class':'a-reset'})['href']
+        match_id, match_title = get_match_id_title(match_url)
+        match_date = dt.datetime.fromtimestamp(int(match['data-zonedgrouping-entry-unix'])/1000).strftime('%Y-%m-%d')
+        scores = match.find_all('span', {'class': ['score-lost', 'score-won', 'score-tie']})
+        try:
+            score = (int(scores[0].text), int(scores[1].text))
+        except:
+            score = (None, None)
+        teams_html = match.find_all('div', {'class': 'team'})
+        teams = (teams_html[0].text.strip(), teams_html[1].text.strip())
+        if score[0] > score[1]:
+            winner = 'team1'
+        elif score[1] > score[0]:
+            winner = 'team2'
+        else:
+            winner = 'tie'
+        match_list.append([match_id, match_date, match_title, match_url, teams, winner, score])
+    try:
+        next_page_url = "https://www.hltv.org" + results_page_html.find('a', {'class':'pagination-next'})['href']
+    except:
+        next_page_url = None
+    return match_list, next_page_url
+
+
+def legacy_match_regions(match_html):
+    """
+    The hand written single walk the match page spec replaced.
+    """
+    regions = {'results_played': [], 'results_left': [], 'results_right': [], 'lineups': []}
+    for tag in match_html.descendants:
+        if not hasattr(tag, 'attrs'):
+            continue
+        if tag.name == 'link':
+            if 'canonical' not in regions and 'canonical' in (tag.get('rel') or []):
+                regions['canonical'] = tag
+            continue
+        classes = tag.get('class')
+        if classes is None:
+            continue
+        class_string = classes if isinstance(classes, str) else ' '.join(classes)
+        class_tokens = class_string.split()
+        if tag.name == 'span':
+            if 'results-right' in class_tokens:
+                regions['results_right'].append(tag)
+            continue
+        if tag.name != 'div':
+            continue
+        if 'results-left' in class_tokens:
+            regions['results_left'].append(tag)
+        elif class_string == 'results played':
+            regions['results_played'].append(tag)
+        elif class_string == 'lineup standard-box':
+            regions['lineups'].append(tag)
+        else:
+            for name, token in (('team1', 'team1-gradient'), ('team2', 'team2-gradient'), ('time_and_event', 'timeAndEvent'), ('maps', 'flexbox-column')):
+                if name not in regions and token in class_tokens:
+                    regions[name] = tag
+                    break
+            else:
+                if 'veto_box' not in regions and class_string == 'standard-box veto-box':
+                    regions['veto_box'] = tag
+    return regions
+
+
+# page type -> (name, legacy extractor, spec extractor, comparable output)
+EXTRACTORS = {
+    'player': ('get_player_stats_block', legacy_player_stats_block, get_player_stats_block.__wrapped__, None),
+    'map_stats': ('get_map_scoreboard', legacy_map_scoreboard, get_map_scoreboard.__wrapped__, None),
+    'results': ('parse_results_page', lambda soup: legacy_results_page(soup, ''), lambda soup: parse_results_page.__wrapped__(soup, ''), None),
+    'match': ('match page regions', legacy_match_regions, MATCH_PAGE_SPEC.scan,
+              lambda regions: sorted((name, len(value) if isinstance(value, list) else value is not None) for name, value in regions.items() if value)),
+}
+
+
+def time_extractor(extractor, soups, pages):
+    start = time.perf_counter()
+    for i in range(pages):
+        extractor(soups[i % len(soups)])
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    arg_parser.add_argument('--pages', type=int, default=5000, help="Pages extracted per extractor and version")
+    arg_parser.add_argument('--full-page', action='store_true', help="Build the whole tree instead of only the regions read by the extractors")
+    args = arg_parser.parse_args()
+
+    set_partial_parsing(not args.full_page)
+    corpus = load_corpus(args.fixtures)
+    if not corpus:
+        print(f"No pages found in {args.fixtures}, record some with benchmarks/corpus.py first.")
+        return
+
+    print(f"{args.pages} pages per extractor\n")
+    print(f"{'extractor':<26}{'before us/page':>16}{'after us/page':>15}{'speedup':>10}")
+    for page_type, (name, legacy, spec, comparable) in EXTRACTORS.items():
+        soups = [make_soup(html, page_type=page_type) for corpus_type, url, html in corpus if corpus_type == page_type]
+        if not soups:
+            continue
+
+        comparable = comparable or (lambda output: output)
+        for soup in soups:
+            if comparable(legacy(soup)) != comparable(spec(soup)):
+                print(f"WARNING: {name} outputs differ on a {page_type} page.")
+                break
+
+        legacy_time = time_extractor(legacy, soups, args.pages)
+        spec_time = time_extractor(spec, soups, args.pages)
+        print(f"{name:<26}{1e6*legacy_time/args.pages:>16.1f}{1e6*spec_time/args.pages:>15.1f}{legacy_time/spec_time:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
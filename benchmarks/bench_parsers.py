@@ -0,0 +1,99 @@
+"""
+Compares parser backends on saved pages.
+
+Usage:
+    python benchmarks/bench_parsers.py [--fixtures DIR] [--from-cache] [--repeat N]
+
+Pages are read from .html / .html.gz files in the fixtures directory, or from the html cache with --from-cache.
+Each page is parsed with every installed backend and run through the extractor for its page type.
+Pages are parsed partially (see parsing.PAGE_REGIONS) unless --full-page is given.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsing import PARSER_BACKENDS, parser_backend_available, make_soup
+from html_cache import HtmlCache, CACHE_DIR, classify_url
+from match_parser import parse_match_page
+from player_stats import get_player_stats_block
+from corpus import FIXTURES_DIR, load_corpus
+
+
+def load_fixtures(fixtures_dir):
+    """
+    Returns list of (page_type, html) for every saved page in fixtures_dir, see corpus.load_corpus.
+    """
+    return [(page_type, html) for page_type, url, html in load_corpus(fixtures_dir)]
+
+
+def load_cached_pages(cache_dir, limit=None):
+    pages = []
+    for url, html in HtmlCache(cache_dir).iter_entries():
+        page_type = classify_url(url)
+        if page_type.startswith('player_stats'):
+            page_type = 'player'
+        pages.append((page_type, html))
+        if limit is not None and len(pages) >= limit:
+            break
+    return pages
+
+
+def extract(page_type, page_html):
+    if page_type == 'match':
+        parse_match_page(page_html)
+    elif page_type == 'player':
+        get_player_stats_block(page_html)
+    elif page_type == 'results':
+        page_html.find('div', {'class': 'results-holder allres'}).find_all('div', {'class': 'result-con'})
+
+
+def bench_backend(backend, pages, repeat, full_page=False):
+    parse_time = 0.0
+    extract_time = 0.0
+    for _ in range(repeat):
+        for page_type, html in pages:
+            start = time.perf_counter()
+            page_html = make_soup(html, backend, page_type=None if full_page else page_type)
+            parsed = time.perf_counter()
+            extract(page_type, page_html)
+            parse_time += parsed - start
+            extract_time += time.perf_counter() - parsed
+    total_pages = len(pages) * repeat
+    return total_pages, parse_time, extract_time
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    arg_parser.add_argument('--from-cache', action='store_true')
+    arg_parser.add_argument('--cache-dir', default=CACHE_DIR)
+    arg_parser.add_argument('--limit', type=int, default=500)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--full-page', action='store_true', help="Build the whole tree instead of only the regions read by the extractors")
+    args = arg_parser.parse_args()
+
+    if args.from_cache:
+        pages = load_cached_pages(args.cache_dir, args.limit)
+    else:
+        pages = load_fixtures(args.fixtures)
+
+    if not pages:
+        print("No pages found.")
+        return
+
+    print(f"{len(pages)} pages, {args.repeat} repeats\n")
+    print(f"{'backend':<12}{'pages/sec':>12}{'parse ms/page':>16}{'extract ms/page':>18}")
+    for backend in PARSER_BACKENDS:
+        if not parser_backend_available(backend):
+            print(f"{backend:<12}{'not installed':>12}")
+            continue
+        total_pages, parse_time, extract_time = bench_backend(backend, pages, args.repeat, args.full_page)
+        pages_per_sec = total_pages / (parse_time + extract_time)
+        print(f"{backend:<12}{pages_per_sec:>12.1f}{1000*parse_time/total_pages:>16.2f}{1000*extract_time/total_pages:>18.2f}")
+
+
+if __name__ == '__main__':
+    main()
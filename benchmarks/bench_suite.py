@@ -0,0 +1,338 @@
+"""
+Offline throughput benchmarks against the recorded corpus and the local mock server.
+
+Usage:
+    python benchmarks/bench_suite.py [--fixtures DIR] [--only NAME ...] [--latency S] [--error-rate P] [--workers N] [--matches N] [--compare FILE] [--no-save]
+
+Benchmarks:
+    get_page_html           fetch through the mock server and parse, per page type
+    extract.<function>      each match_parser extractor on a freshly parsed match page
+    get_player_stats_block  player stats extraction on parsed player pages
+    scrape_match_list       results pagination through the mock server
+    scrape_stat_range       full player stats scrape of --matches matches through the mock server
+
+Each benchmark runs in its own process, so the peak RSS reported is that benchmark's alone.
+Results are saved to benchmarks/results/ and compared with the previous saved run.
+"""
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import contextlib
+import multiprocessing
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+# Urls for corpus pages recorded without one
+SYNTHETIC_URLS = {
+    'match': "https://www.hltv.org/matches/{n}/bench",
+    'player': "https://www.hltv.org/stats/players/{n}/bench?startDate=2023-01-01&endDate=2023-01-31",
+    'results': "https://www.hltv.org/results?offset=0",
+    'map_stats': "https://www.hltv.org/stats/matches/mapstatsid/{n}/bench",
+}
+
+MATCH_EXTRACTORS = [
+    'get_match_datetime', 'get_match_type', 'get_match_teams', 'get_match_score', 'get_match_map_names',
+    'get_match_map_winners', 'get_match_winner', 'get_match_map_scores', 'get_match_rosters',
+]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(latencies, seconds, pages=None):
+    """
+    Result entry for a benchmark from per page latencies (seconds) and total wall time.
+    """
+    pages = len(latencies) if pages is None else pages
+    return {
+        'pages': pages,
+        'seconds': round(seconds, 4),
+        'pages_per_sec': round(pages / seconds, 2) if seconds else None,
+        'p50_ms': round(1000 * percentile(latencies, 0.5), 3) if latencies else None,
+        'p99_ms': round(1000 * percentile(latencies, 0.99), 3) if latencies else None,
+    }
+
+
+def summarize_metrics(seconds, url_classes=None):
+    """
+    Result entry from the run metrics (see metrics.py), for benchmarks timing whole scrapes.
+    """
+    from metrics import metrics
+
+    fetch = metrics.report()['fetch']
+    pages = 0
+    p50 = p99 = None
+    for url_class, section in fetch.items():
+        if url_classes is not None and url_class not in url_classes:
+            continue
+        pages += section.get('requests', 0)
+        latency = section.get('latency')
+        if latency is not None and latency['count']:
+            p50 = max(p50 or 0, latency['p50'])
+            p99 = max(p99 or 0, latency['p99'])
+    retries = sum(value for section in fetch.values() for name, value in section.items() if name.startswith('retries_'))
+    return {
+        'pages': pages,
+        'seconds': round(seconds, 4),
+        'pages_per_sec': round(pages / seconds, 2) if seconds else None,
+        'p50_ms': round(1000 * p50, 3) if p50 is not None else None,
+        'p99_ms': round(1000 * p99, 3) if p99 is not None else None,
+        'retries': retries,
+    }
+
+
+def _corpus_with_urls(fixtures_dir):
+    from corpus import load_corpus
+    pages = []
+    for n, (page_type, url, html) in enumerate(load_corpus(fixtures_dir)):
+        if url is None and page_type in SYNTHETIC_URLS:
+            url = SYNTHETIC_URLS[page_type].format(n=n)
+        pages.append((page_type, url, html))
+    return pages
+
+
+# Benchmarks.  Each runs in a worker process and returns a dict of entry name -> result.
+
+def bench_get_page_html(options):
+    from match_parser import get_page_html, map_concurrently
+
+    urls = [url for page_type, url, html in _corpus_with_urls(options['fixtures']) if url is not None] * options['repeat']
+    latencies_by_type = {}
+
+    def fetch(url):
+        start = time.perf_counter()
+        get_page_html(url)
+        return url, time.perf_counter() - start
+
+    start = time.perf_counter()
+    timings = map_concurrently(fetch, urls, max_workers=options['workers'])
+    seconds = time.perf_counter() - start
+
+    from parsing import get_page_type
+    for url, latency in timings:
+        latencies_by_type.setdefault(get_page_type(url), []).append(latency)
+
+    results = {'get_page_html': summarize([latency for _, latency in timings], seconds)}
+    for page_type, latencies in latencies_by_type.items():
+        results[f'get_page_html.{page_type}'] = summarize(latencies, sum(latencies))
+    return results
+
+
+def bench_extractors(options):
+    import match_parser
+    from parsing import make_soup
+
+    pages = [html for page_type, url, html in _corpus_with_urls(options['fixtures']) if page_type == 'match'] * options['repeat']
+    results = {}
+    for name in MATCH_EXTRACTORS:
+        extractor = getattr(match_parser, name)
+        # Fresh soups, so every call pays for the single pass parse of its page
+        soups = [make_soup(html, page_type='match') for html in pages]
+        latencies = []
+        for soup in soups:
+            start = time.perf_counter()
+            try:
+                extractor(soup)
+            except ValueError:
+                pass
+            latencies.append(time.perf_counter() - start)
+        results[f'extract.{name}'] = summarize(latencies, sum(latencies))
+    return results
+
+
+def bench_player_stats_block(options):
+    from parsing import make_soup
+    from player_stats import get_player_stats_block
+
+    pages = [html for page_type, url, html in _corpus_with_urls(options['fixtures']) if page_type == 'player'] * options['repeat']
+    soups = [make_soup(html, page_type='player') for html in pages]
+    latencies = []
+    for soup in soups:
+        start = time.perf_counter()
+        get_player_stats_block(soup)
+        latencies.append(time.perf_counter() - start)
+    return {'get_player_stats_block': summarize(latencies, sum(latencies))}
+
+
+def bench_scrape_match_list(options):
+    from metrics import metrics
+    from scraper import scrape_match_list
+
+    metrics.reset()
+    start = time.perf_counter()
+    match_list = scrape_match_list('2023-01-01', '2023-01-31', sleep_time=0, update_csv=False)
+    seconds = time.perf_counter() - start
+    result = summarize_metrics(seconds, ['results'])
+    result['matches'] = len(match_list)
+    return {'scrape_match_list': result}
+
+
+def bench_scrape_stat_range(options):
+    from metrics import metrics
+    from scraper import scrape_stat_range
+
+    match_list = [[str(n), '2023-01-01', 'bench', f"https://www.hltv.org/matches/{n}/bench", '', '', ''] for n in range(options['matches'])]
+
+    # Output files go to a scratch directory
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        os.makedirs(os.path.join(scratch_dir, 'data'))
+        previous_dir = os.getcwd()
+        os.chdir(scratch_dir)
+        try:
+            metrics.reset()
+            start = time.perf_counter()
+            scrape_stat_range(match_list, 30, sleep_time=0, max_workers=options['workers'], update_players_csv=False, update_teams_csv=False)
+            seconds = time.perf_counter() - start
+        finally:
+            os.chdir(previous_dir)
+
+    result = summarize_metrics(seconds)
+    result['matches'] = len(match_list)
+    result['matches_per_sec'] = round(len(match_list) / seconds, 2) if seconds else None
+    return {'scrape_stat_range': result}
+
+
+BENCHMARKS = {
+    'get_page_html': bench_get_page_html,
+    'extractors': bench_extractors,
+    'get_player_stats_block': bench_player_stats_block,
+    'scrape_match_list': bench_scrape_match_list,
+    'scrape_stat_range': bench_scrape_stat_range,
+}
+
+
+def run_benchmark(name, base_url, options):
+    """
+    Runs one benchmark with all requests sent to base_url.  Runs in a fresh worker process.
+    """
+    from parsing import set_parser_backend
+    from rate_limiter import set_rate_limit
+    from mock_server import routed_to
+
+    if options['backend'] is not None:
+        set_parser_backend(options['backend'])
+    set_rate_limit(options['rate'], max(1, int(options['rate'])))
+
+    with routed_to(base_url, pool_size=options['workers']), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = BENCHMARKS[name](options)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    for result in results.values():
+        result['peak_rss_mb'] = round(peak_rss_mb, 1)
+    return results
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=BENCHMARKS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def latest_results_file(results_dir=RESULTS_DIR):
+    files = sorted(glob.glob(os.path.join(results_dir, '*.json')))
+    return files[-1] if files else None
+
+
+def print_results(results, previous=None):
+    print(f"{'benchmark':<34}{'pages/sec':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}{'vs previous':>13}")
+    for name, result in results.items():
+        change = ''
+        if previous is not None and name in previous and previous[name].get('pages_per_sec') and result.get('pages_per_sec'):
+            change = f"{100 * (result['pages_per_sec'] / previous[name]['pages_per_sec'] - 1):+.1f}%"
+        values = [result.get(key) for key in ('pages_per_sec', 'p50_ms', 'p99_ms', 'peak_rss_mb')]
+        print(f"{name:<34}" + ''.join(f"{'-' if value is None else value:>{width}}" for value, width in zip(values, (11, 10, 10, 13))) + f"{change:>13}")
+
+
+def main():
+    from corpus import FIXTURES_DIR
+    from mock_server import MockHltvServer
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    arg_parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS))
+    arg_parser.add_argument('--repeat', type=int, default=3, help="Passes over the corpus for the per page benchmarks")
+    arg_parser.add_argument('--workers', type=int, default=4, help="Concurrent requests")
+    arg_parser.add_argument('--matches', type=int, default=50, help="Matches in the scrape_stat_range benchmark")
+    arg_parser.add_argument('--rate', type=float, default=1000.0, help="Request rate limit during the benchmarks")
+    arg_parser.add_argument('--backend', default=None, help="Parser backend, see parsing.PARSER_BACKENDS")
+    arg_parser.add_argument('--latency', type=float, default=0.0, help="Mock server latency in seconds")
+    arg_parser.add_argument('--jitter', type=float, default=0.0)
+    arg_parser.add_argument('--error-rate', type=float, default=0.0)
+    arg_parser.add_argument('--throttle-rate', type=float, default=0.0)
+    arg_parser.add_argument('--results-pages', type=int, default=5)
+    arg_parser.add_argument('--compare', default=None, help="Results file to compare with, default the latest saved run")
+    arg_parser.add_argument('--no-save', action='store_true')
+    args = arg_parser.parse_args()
+
+    pages = _corpus_with_urls(args.fixtures)
+    if not pages:
+        print(f"No pages found in {args.fixtures}, record some with benchmarks/corpus.py first.")
+        return
+
+    options = {
+        'fixtures': args.fixtures, 'repeat': args.repeat, 'workers': args.workers, 'matches': args.matches,
+        'rate': args.rate, 'backend': args.backend,
+    }
+    server_options = {
+        'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate, 'results_pages': args.results_pages,
+    }
+
+    server = MockHltvServer(pages, seed=0, **server_options).start()
+    results = {}
+    try:
+        for name in args.only or BENCHMARKS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results.update(executor.submit(run_benchmark, name, server.base_url, options).result())
+    finally:
+        server.stop()
+
+    previous_file = args.compare or latest_results_file()
+    previous = None
+    if previous_file is not None:
+        with open(previous_file, 'r', encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        print(f"Comparing with {previous_file}\n")
+
+    print_results(results, previous)
+
+    if not args.no_save:
+        version = git_version()
+        run = {
+            'version': version,
+            'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus_pages': len(pages),
+            'options': dict(options, **server_options),
+            'server': server.counts,
+            'results': results,
+        }
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        filename = os.path.join(RESULTS_DIR, f"{dt.datetime.now().strftime('%Y%m%d-%H%M%S')}-{version}.json")
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump(run, file, indent=2)
+        print(f"\nSaved {filename}")
+
+
+if __name__ == '__main__':
+    main()
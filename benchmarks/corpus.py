@@ -0,0 +1,159 @@
+"""
+Records and loads the benchmark corpus of saved HLTV pages.
+
+Usage:
+    python benchmarks/corpus.py [--fixtures DIR] --from-cache [--cache-dir DIR] [--per-type N]
+    python benchmarks/corpus.py [--fixtures DIR] URL [URL ...]
+
+Pages are stored gzipped in the fixtures directory with an index.json mapping each file to its url and page type.
+--from-cache copies up to --per-type pages of each page type from the html cache.  URLs given on the command line are fetched live.
+
+benchmarks/fixtures ships a small sanitized corpus (match, player stats, results and map stats pages with made up teams and players) so the benchmarks run offline from a fresh checkout.
+It follows HLTV's markup for the regions the extractors read, with the rest of each page reduced to generic layout.  Record real pages into it for numbers closer to live scraping.
+"""
+import os
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_cache import HtmlCache, CACHE_DIR
+from parsing import PAGE_REGIONS, get_page_type
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+INDEX_FILE = 'index.json'
+
+
+def load_index(fixtures_dir=FIXTURES_DIR):
+    """
+    Returns dict of file name -> {'url': url, 'page_type': page_type}.  Empty if the corpus has no index.
+    """
+    path = os.path.join(fixtures_dir, INDEX_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def read_page(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            return file.read()
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def _name_page_type(name):
+    """
+    Page type from a fixture file name prefix, e.g. map_stats_1.html -> map_stats.
+    """
+    for page_type in sorted(PAGE_REGIONS, key=len, reverse=True):
+        if name.startswith(page_type + '_'):
+            return page_type
+    return name.split('_')[0]
+
+
+def load_corpus(fixtures_dir=FIXTURES_DIR):
+    """
+    Returns list of (page_type, url, html) for every page in the corpus.
+    Files missing from the index (e.g. hand saved pages) take their page type from the file name prefix and have no url.
+    """
+    if not os.path.isdir(fixtures_dir):
+        return []
+    index = load_index(fixtures_dir)
+    pages = []
+    for name in sorted(os.listdir(fixtures_dir)):
+        if not (name.endswith('.html') or name.endswith('.html.gz')):
+            continue
+        entry = index.get(name)
+        if entry is not None:
+            page_type, url = entry['page_type'], entry['url']
+        else:
+            page_type, url = _name_page_type(name), None
+        pages.append((page_type, url, read_page(os.path.join(fixtures_dir, name))))
+    return pages
+
+
+def save_page(fixtures_dir, index, url, html):
+    """
+    Adds one page to the corpus.  Returns its file name, or None if the url has no page type.
+    """
+    page_type = get_page_type(url)
+    if page_type is None:
+        return None
+    name = f"{page_type}_{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}.html.gz"
+    with gzip.open(os.path.join(fixtures_dir, name), 'wt', encoding='utf-8') as file:
+        file.write(html)
+    index[name] = {'url': url, 'page_type': page_type}
+    return name
+
+
+def write_index(fixtures_dir, index):
+    with open(os.path.join(fixtures_dir, INDEX_FILE), 'w', encoding='utf-8') as file:
+        json.dump(index, file, indent=1, sort_keys=True)
+
+
+def record_from_cache(fixtures_dir=FIXTURES_DIR, cache_dir=CACHE_DIR, per_type=50):
+    """
+    Copies up to per_type cached pages of each page type into the corpus.  Returns the number of pages added.
+    """
+    os.makedirs(fixtures_dir, exist_ok=True)
+    index = load_index(fixtures_dir)
+    counts = {}
+    for entry in index.values():
+        counts[entry['page_type']] = counts.get(entry['page_type'], 0) + 1
+
+    added = 0
+    for url, html in HtmlCache(cache_dir).iter_entries():
+        page_type = get_page_type(url)
+        if page_type is None or counts.get(page_type, 0) >= per_type:
+            continue
+        if save_page(fixtures_dir, index, url, html) is not None:
+            counts[page_type] = counts.get(page_type, 0) + 1
+            added += 1
+
+    write_index(fixtures_dir, index)
+    return added
+
+
+def record_urls(urls, fixtures_dir=FIXTURES_DIR, sleep_time=0.05):
+    """
+    Fetches urls from HLTV and adds them to the corpus.  Returns the number of pages added.
+    """
+    from match_parser import get_page_text
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    index = load_index(fixtures_dir)
+    added = 0
+    for url in urls:
+        if get_page_type(url) is None:
+            print(f"Skipping {url}, unknown page type.")
+            continue
+        save_page(fixtures_dir, index, url, get_page_text(url, sleep_time))
+        added += 1
+    write_index(fixtures_dir, index)
+    return added
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('urls', nargs='*')
+    arg_parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    arg_parser.add_argument('--from-cache', action='store_true')
+    arg_parser.add_argument('--cache-dir', default=CACHE_DIR)
+    arg_parser.add_argument('--per-type', type=int, default=50)
+    args = arg_parser.parse_args()
+
+    added = 0
+    if args.from_cache:
+        added += record_from_cache(args.fixtures, args.cache_dir, args.per_type)
+    if args.urls:
+        added += record_urls(args.urls, args.fixtures)
+    print(f"Added {added} pages to {args.fixtures}.")
+
+
+if __name__ == '__main__':
+    main()
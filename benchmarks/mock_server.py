@@ -0,0 +1,212 @@
+"""
+Local stand-in for hltv.org serving the benchmark corpus, with injected latency and errors.
+
+Usage:
+    python benchmarks/mock_server.py [--fixtures DIR] [--port N] [--latency S] [--jitter S] [--error-rate P] [--throttle-rate P]
+
+Pages recorded with their url are served at that path.  Any other url is answered with a corpus page of the same page type, so player stats pages for any date range exist.
+Results pages link to the next page until --results-pages pages were served.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import html_cache
+import match_parser
+from cloudscraper_object import ScraperPool, POOL_SIZE
+from parsing import get_page_type
+from corpus import FIXTURES_DIR, load_corpus
+
+HLTV_ORIGIN = 'https://www.hltv.org'
+PAGINATION_NEXT_PATTERN = re.compile(r'<a\b[^>]*\bpagination-next\b[^>]*>.*?</a>', re.DOTALL)
+
+
+def _path_key(url):
+    parts = urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+
+class MockHltvServer:
+    """
+    Threaded HTTP server answering HLTV urls from corpus pages (list of (page_type, url, html)).
+    latency +- jitter seconds are added to every response.  error_rate of requests get a 500, throttle_rate a 429 with Retry-After: 0.
+    """
+
+    def __init__(self, pages, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, results_pages=3, seed=None, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.results_pages = results_pages
+        self.random = random.Random(seed)
+        self.counts = {'requests': 0, 'errors': 0, 'throttled': 0, 'not_found': 0}
+
+        self.exact = {}
+        self.by_type = {}
+        for page_type, url, html in pages:
+            body = html.encode('utf-8')
+            if url is not None:
+                self.exact[_path_key(url)] = body
+            self.by_type.setdefault(page_type, []).append(body)
+        self._next_by_type = {page_type: 0 for page_type in self.by_type}
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, headers, body = server.respond(self.path)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _pick(self, path):
+        body = self.exact.get(path)
+        if body is not None:
+            return body
+        page_type = get_page_type(HLTV_ORIGIN + path)
+        bodies = self.by_type.get(page_type)
+        if not bodies:
+            return None
+        with self._lock:
+            index = self._next_by_type[page_type]
+            self._next_by_type[page_type] = (index + 1) % len(bodies)
+        body = bodies[index]
+
+        # Results pages link to the next offset until results_pages pages were served
+        if page_type == 'results':
+            offset = int(dict(parse_qsl(urlsplit(path).query)).get('offset', 0))
+            if offset >= (self.results_pages - 1) * 100:
+                next_link = ''
+            else:
+                next_link = f'<a href="/results?offset={offset + 100}" class="pagination-next">Next</a>'
+            body = PAGINATION_NEXT_PATTERN.sub(lambda match: next_link, body.decode('utf-8')).encode('utf-8')
+        return body
+
+    def respond(self, path):
+        """
+        Returns (status, headers, body) for a request path.
+        """
+        with self._lock:
+            self.counts['requests'] += 1
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+        if delay:
+            time.sleep(delay)
+
+        if roll < self.error_rate:
+            with self._lock:
+                self.counts['errors'] += 1
+            return 500, {}, b'Internal Server Error'
+        if roll < self.error_rate + self.throttle_rate:
+            with self._lock:
+                self.counts['throttled'] += 1
+            return 429, {'Retry-After': '0'}, b'Too Many Requests'
+
+        body = self._pick(path)
+        if body is None:
+            with self._lock:
+                self.counts['not_found'] += 1
+            return 404, {}, b'Not Found'
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalScraperPool(ScraperPool):
+    """
+    ScraperPool sending hltv.org requests to base_url instead.
+    """
+
+    def __init__(self, base_url, size=POOL_SIZE):
+        super().__init__(size)
+        self.base_url = base_url
+
+    def get(self, url, retries=0, **kwargs):
+        if url.startswith(HLTV_ORIGIN):
+            url = self.base_url + url[len(HLTV_ORIGIN):]
+        return super().get(url, retries, **kwargs)
+
+
+@contextmanager
+def routed_to(base_url, pool_size=POOL_SIZE, use_cache=False):
+    """
+    Sends every get_page_text request to base_url (e.g. MockHltvServer.base_url) while active.  The html cache is turned off unless use_cache is set.
+    """
+    previous_pool = match_parser.scraper_pool
+    previous_cache = html_cache.html_cache
+    pool = LocalScraperPool(base_url, pool_size)
+    match_parser.scraper_pool = pool
+    if not use_cache:
+        html_cache.html_cache = None
+    try:
+        yield pool
+    finally:
+        pool.clear()
+        match_parser.scraper_pool = previous_pool
+        html_cache.html_cache = previous_cache
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    arg_parser.add_argument('--port', type=int, default=8800)
+    arg_parser.add_argument('--latency', type=float, default=0.0)
+    arg_parser.add_argument('--jitter', type=float, default=0.0)
+    arg_parser.add_argument('--error-rate', type=float, default=0.0)
+    arg_parser.add_argument('--throttle-rate', type=float, default=0.0)
+    arg_parser.add_argument('--results-pages', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    pages = load_corpus(args.fixtures)
+    if not pages:
+        print(f"No pages found in {args.fixtures}, record some with benchmarks/corpus.py first.")
+        return
+
+    server = MockHltvServer(pages, args.latency, args.jitter, args.error_rate, args.throttle_rate, args.results_pages, port=args.port)
+    print(f"Serving {len(pages)} pages at {server.base_url}")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
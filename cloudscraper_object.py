@@ -1,9 +1,161 @@
-# Currently unused
+import threading
+from queue import LifoQueue, Empty
 
 import cloudscraper
+from cloudscraper.exceptions import CloudflareException
 
-cscraper = cloudscraper.create_scraper()
+# Number of warm sessions kept open at once
+POOL_SIZE = 4
+
+# Status codes Cloudflare answers with when a challenge was not passed
+CHALLENGE_STATUS_CODES = (403, 503)
+
+# Status codes meaning we are sending requests too fast
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Markers of a challenge page served with a success status
+CHALLENGE_PAGE_MARKERS = ('<title>Just a moment...</title>', 'challenge-platform', 'cf-chl-')
+
+
+def create_cloudscraper():
+    """
+    Creates a new cloudscraper session.  Sessions keep their connections alive and hold the Cloudflare clearance cookies.
+    """
+    return cloudscraper.create_scraper()
+
+
+def is_challenge_response(response):
+    """
+    Checks if a response is an unsolved Cloudflare challenge page rather than the requested page.
+    """
+    if response.status_code not in CHALLENGE_STATUS_CODES:
+        return False
+    return response.headers.get('Server', '').lower().startswith('cloudflare')
+
+
+def is_challenge_page(response):
+    """
+    Checks if a response is any Cloudflare challenge, either an unsolved challenge status or a challenge page served with a success status.
+    """
+    if is_challenge_response(response):
+        return True
+    head = response.text[:5000]
+    return any(marker in head for marker in CHALLENGE_PAGE_MARKERS)
+
+
+class FetchError(Exception):
+    """
+    Raised when a page could not be fetched after all retries.
+    """
+
+
+def classify_response(response):
+    """
+    Classifies a response as 'ok', 'throttled' (rate limited or challenged), 'retry' (transient server error) or 'error' (will not succeed on retry).
+    """
+    status = response.status_code
+    if status == 200:
+        head = response.text[:5000]
+        if any(marker in head for marker in CHALLENGE_PAGE_MARKERS):
+            return 'throttled'
+        return 'ok'
+    if status in THROTTLE_STATUS_CODES or is_challenge_response(response):
+        return 'throttled'
+    if status >= 500:
+        return 'retry'
+    return 'error'
+
+
+def get_retry_after(response):
+    """
+    Seconds from a Retry-After header, or None.
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ScraperPool:
+    """
+    Pool of warm cloudscraper sessions shared by every fetch.
+    Sessions are reused between requests so the TLS handshake and Cloudflare challenge are only paid once per session.
+    A session that is served a challenge is closed and replaced by a fresh one.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """
+        Takes a session from the pool, creating one if no warm session is idle.  Blocks while all sessions are in use.
+        """
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            try:
+                return create_cloudscraper()
+            except:
+                self._slots.release()
+                raise
+
+    def release(self, session, discard=False):
+        """
+        Returns a session to the pool.  Discarded sessions are closed and will be replaced on the next acquire.
+        """
+        if discard:
+            session.close()
+        else:
+            self._idle.put(session)
+        self._slots.release()
+
+    def get(self, url, retries=0, **kwargs):
+        """
+        GET request on a pooled session.  Recycles the session whenever a Cloudflare challenge is served, and retries up to retries times.
+        get_page_text leaves retries at 0 and retries itself, so every request goes through the rate limiter and metrics.
+        """
+        for attempt in range(retries + 1):
+            session = self.acquire()
+            try:
+                response = session.get(url, **kwargs)
+            except CloudflareException:
+                self.release(session, discard=True)
+                if attempt == retries:
+                    raise
+                continue
+            except:
+                self.release(session)
+                raise
+
+            if is_challenge_page(response):
+                self.release(session, discard=True)
+                if attempt < retries:
+                    continue
+                return response
+
+            self.release(session)
+            return response
+
+    def clear(self):
+        """
+        Closes all idle sessions.  Sessions currently in use are returned to the pool as normal.
+        """
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except Empty:
+                break
+            session.close()
+
+
+scraper_pool = ScraperPool()
 
 def reset_cloudscraper():
-    global cscraper
-    cscraper = cloudscraper.create_scraper()
+    """
+    Drops all warm sessions so the next requests start with fresh ones.
+    """
+    scraper_pool.clear()
@@ -0,0 +1,206 @@
+import os
+import ast
+import csv
+import uuid
+import threading
+import datetime as dt
+from collections import OrderedDict
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+PARQUET_DIR = os.path.join('data', 'player_stats_parquet')
+
+# Rows a PlayerStatsParquetWriter buffers before writing them out
+PARQUET_FLUSH_ROWS = 10000
+
+# Columns every row has before the stat columns
+KEY_COLUMNS = ['match_id', 'date', 'month', 'stat_range', 'maps', 'team', 'team_id', 'player_id']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for parquet output.  Install it with 'pip install pyarrow'.")
+
+
+def flatten_match_player_stats(match_player_data, match_dates, player_stat_range, on_maps=None):
+    """
+    Flattens [match_id, player_stats] entries from scrape_stat_range into one row per (match, team, player).
+    match_dates maps match_id to 'yyyy-mm-dd'.  Each stat key from get_player_stats_block becomes its own float column.
+    on_maps is the map filter the stats were scraped with, stored comma separated in the maps column (null for all maps).
+    Players whose stats were not found get a row with no stat values.
+    """
+    if on_maps is None:
+        maps = None
+    else:
+        maps = on_maps if type(on_maps) == str else ','.join(sorted(on_maps))
+
+    rows = []
+    for match_id, player_stats in match_player_data:
+        date = match_dates[match_id]
+        for team_slot, (team_id, team_player_stats) in enumerate(player_stats.items(), start=1):
+            for player_id, stats in team_player_stats.items():
+                row = OrderedDict([
+                    ('match_id', str(match_id)),
+                    ('date', date),
+                    ('month', date[:7]),
+                    ('stat_range', int(player_stat_range)),
+                    ('maps', maps),
+                    ('team', f'team{team_slot}'),
+                    ('team_id', str(team_id)),
+                    ('player_id', str(player_id)),
+                ])
+                if stats is not None:
+                    for stat_name, value in stats.items():
+                        row[stat_name] = float(value)
+                rows.append(row)
+    return rows
+
+
+def _rows_to_table(rows):
+    stat_columns = []
+    seen = set(KEY_COLUMNS)
+    for row in rows:
+        for column in row:
+            if column not in seen:
+                seen.add(column)
+                stat_columns.append(column)
+
+    arrays = [
+        pa.array([row['match_id'] for row in rows], pa.string()),
+        pa.array([dt.datetime.strptime(row['date'], '%Y-%m-%d').date() for row in rows], pa.date32()),
+        pa.array([row['month'] for row in rows], pa.string()),
+        pa.array([row['stat_range'] for row in rows], pa.int32()),
+        pa.array([row.get('maps') for row in rows], pa.string()),
+        pa.array([row['team'] for row in rows], pa.string()),
+        pa.array([row['team_id'] for row in rows], pa.string()),
+        pa.array([row['player_id'] for row in rows], pa.string()),
+    ]
+    for column in stat_columns:
+        arrays.append(pa.array([row.get(column) for row in rows], pa.float64()))
+
+    return pa.Table.from_arrays(arrays, names=KEY_COLUMNS + stat_columns)
+
+
+def write_player_stats_parquet(rows, root_dir=PARQUET_DIR):
+    """
+    Appends flattened rows to a parquet dataset partitioned by stat_range and month (hive style, e.g. stat_range=30/month=2023-01).
+    Each call writes new files, so repeated calls never rewrite earlier data.  Use PlayerStatsParquetWriter to write many small batches.
+    """
+    _require_pyarrow()
+    if not rows:
+        return
+
+    table = _rows_to_table(rows)
+    ds.write_dataset(
+        table,
+        root_dir,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([('stat_range', pa.int32()), ('month', pa.string())]), flavor='hive'),
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+class PlayerStatsParquetWriter:
+    """
+    Buffers flattened rows across commits and writes them with write_player_stats_parquet once flush_rows rows are held, so each partition gets a few large files instead of one per chunk.
+    Call flush() at the end of the run, or use as 'with PlayerStatsParquetWriter() as writer:'.
+    Rows still buffered if the process is killed are not written.  The stats csv stays the record of done matches, and convert_stats_csv_to_parquet can rebuild the dataset from it.
+    """
+
+    def __init__(self, root_dir=PARQUET_DIR, flush_rows=PARQUET_FLUSH_ROWS):
+        _require_pyarrow()
+        self.root_dir = root_dir
+        self.flush_rows = flush_rows
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def write(self, rows):
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) >= self.flush_rows:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        rows, self._rows = self._rows, []
+        write_player_stats_parquet(rows, self.root_dir)
+
+
+def read_player_stats_parquet(root_dir=PARQUET_DIR, start_date=None, end_date=None, team_ids=None, player_stat_range=None, columns=None, on_maps=None):
+    """
+    Reads the player stats dataset as a pyarrow Table.  Date, team and stat range filters are pushed down to the partitions and row groups.
+    Dates are 'yyyy-mm-dd' strings.  on_maps selects rows scraped with that map filter.  Use .to_pandas() on the result for a DataFrame.
+    """
+    _require_pyarrow()
+
+    dataset = ds.dataset(root_dir, format='parquet', partitioning='hive')
+
+    # Files written at different times can have different stat columns, missing columns are read as nulls
+    schema = pa.unify_schemas([dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()])
+    dataset = ds.dataset(root_dir, schema=schema, format='parquet', partitioning='hive')
+
+    filters = []
+    if start_date is not None:
+        filters.append(ds.field('month') >= start_date[:7])
+        filters.append(ds.field('date') >= dt.datetime.strptime(start_date, '%Y-%m-%d').date())
+    if end_date is not None:
+        filters.append(ds.field('month') <= end_date[:7])
+        filters.append(ds.field('date') <= dt.datetime.strptime(end_date, '%Y-%m-%d').date())
+    if team_ids is not None:
+        filters.append(ds.field('team_id').isin([str(team_id) for team_id in team_ids]))
+    if player_stat_range is not None:
+        filters.append(ds.field('stat_range') == int(player_stat_range))
+    if on_maps is not None:
+        filters.append(ds.field('maps') == (on_maps if type(on_maps) == str else ','.join(sorted(on_maps))))
+
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def parse_stats_cell(stats_text):
+    """
+    Parses a STATS cell written by scrape_stat_range ("OrderedDict([...])") without eval.
+    """
+    prefix = 'OrderedDict('
+    if stats_text.startswith(prefix):
+        return OrderedDict(ast.literal_eval(stats_text[len(prefix):-1]))
+    return OrderedDict(ast.literal_eval(stats_text))
+
+
+def convert_stats_csv_to_parquet(stats_csv, match_list_csv, player_stat_range, root_dir=PARQUET_DIR):
+    """
+    Converts an existing match_player_stats_prev_N.csv to the parquet dataset.  Match dates are taken from match_list_csv.
+    """
+    _require_pyarrow()
+
+    with open(match_list_csv, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)
+        match_dates = {row[0]: row[1] for row in reader}
+
+    with open(stats_csv, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)
+        match_player_data = [[row[0], parse_stats_cell(row[1])] for row in reader if row[0] in match_dates]
+
+    rows = flatten_match_player_stats(match_player_data, match_dates, player_stat_range)
+    write_player_stats_parquet(rows, root_dir)
+    return len(rows)
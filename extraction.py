@@ -0,0 +1,147 @@
+import re
+from bs4 import Tag
+
+
+class Select:
+    """
+    Selector for one field of an ExtractionSpec.  Matches tags named tag that:
+        token - have this class among their classes, or any of several given as a tuple
+        exact - have exactly this class string, e.g. 'standard-box veto-box'
+        pattern - have a class string matching this regex (compiled once here)
+        attr - (name, value), have value among the values of attribute name, e.g. ('rel', 'canonical')
+    many collects every match in document order, otherwise only the first match is kept.
+    """
+    __slots__ = ('tag', 'token', 'exact', 'pattern', 'attr', 'many')
+
+    def __init__(self, tag, token=None, exact=None, pattern=None, attr=None, many=False):
+        if sum(criterion is not None for criterion in (token, exact, pattern, attr)) != 1:
+            raise ValueError("Select needs exactly one of token, exact, pattern or attr.")
+        self.tag = tag
+        self.token = frozenset((token,) if isinstance(token, str) else token) if token is not None else None
+        self.exact = exact
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.attr = attr
+        self.many = many
+
+    def matches(self, tag, tag_class_string, tag_class_tokens):
+        if self.attr is not None:
+            name, value = self.attr
+            values = tag.get(name) or ()
+            if isinstance(values, str):
+                values = values.split()
+            return value in values
+        if tag_class_string is None:
+            return False
+        if self.token is not None:
+            return not self.token.isdisjoint(tag_class_tokens)
+        if self.exact is not None:
+            return tag_class_string == self.exact
+        return self.pattern.search(tag_class_string) is not None
+
+
+class ExtractionSpec:
+    """
+    Named Selects for one block of a page, compiled into a lookup by tag name so scan reads the block in a single walk.
+    A tag is assigned to the first field in spec order that it matches and that still takes tags, like an if/elif chain.
+    """
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self._by_tag = {}
+        for name, select in self.fields.items():
+            self._by_tag.setdefault(select.tag, []).append((name, select))
+        self._all_single = not any(select.many for select in self.fields.values())
+
+    def scan(self, block):
+        """
+        Walks block once.  Returns dict of field -> first matching tag (or None), or list of matching tags for many fields.
+        Stops early once every field is found if the spec has no many fields.
+        """
+        found = {name: [] if select.many else None for name, select in self.fields.items()}
+        by_tag = self._by_tag
+        all_single = self._all_single
+        remaining = len(found)
+
+        for tag in block.descendants:
+            selects = by_tag.get(tag.name)
+            if selects is None or not isinstance(tag, Tag):
+                continue
+
+            classes = tag.attrs.get('class')
+            if classes is None or isinstance(classes, str):
+                tag_class_string = classes
+            else:
+                tag_class_string = ' '.join(classes)
+            tag_class_tokens = classes if isinstance(classes, list) else (tag_class_string.split() if tag_class_string is not None else ())
+
+            for name, select in selects:
+                if select.many:
+                    if select.matches(tag, tag_class_string, tag_class_tokens):
+                        found[name].append(tag)
+                        break
+                elif found[name] is None and select.matches(tag, tag_class_string, tag_class_tokens):
+                    found[name] = tag
+                    remaining -= 1
+                    break
+
+            if all_single and remaining == 0:
+                break
+
+        return found
+
+
+# Match page regions read by parse_match_page
+MATCH_PAGE_SPEC = ExtractionSpec({
+    'canonical': Select('link', attr=('rel', 'canonical')),
+    'results_right': Select('span', token='results-right', many=True),
+    'results_left': Select('div', token='results-left', many=True),
+    'results_played': Select('div', exact='results played', many=True),
+    'lineups': Select('div', exact='lineup standard-box', many=True),
+    'team1': Select('div', token='team1-gradient'),
+    'team2': Select('div', token='team2-gradient'),
+    'time_and_event': Select('div', token='timeAndEvent'),
+    'veto_box': Select('div', exact='standard-box veto-box'),
+    'maps': Select('div', token='flexbox-column'),
+})
+
+# Player stats page
+PLAYER_PAGE_SPEC = ExtractionSpec({
+    'summary': Select('div', token='summaryBreakdownContainer'),
+    'statistics': Select('div', token='statistics'),
+})
+PLAYER_SUMMARY_SPEC = ExtractionSpec({
+    'breakdowns': Select('div', pattern=r"summaryStatBreakdown (.*)", many=True),
+})
+PLAYER_BREAKDOWN_SPEC = ExtractionSpec({
+    'label': Select('div', token='summaryStatBreakdownSubHeader'),
+    'value': Select('div', token='summaryStatBreakdownDataValue'),
+})
+PLAYER_STATISTICS_SPEC = ExtractionSpec({
+    'rows': Select('div', token='stats-row', many=True),
+})
+
+# Map stats scoreboard row cells
+SCOREBOARD_ROW_SPEC = ExtractionSpec({
+    'player': Select('td', token='st-player'),
+    'kills': Select('td', token='st-kills'),
+    'assists': Select('td', token='st-assists'),
+    'deaths': Select('td', token='st-deaths'),
+    'adr': Select('td', token='st-adr'),
+    # HLTV labels the KAST column st-kdratio
+    'kast': Select('td', token='st-kdratio'),
+    'rating': Select('td', token='st-rating'),
+})
+
+# Results page
+RESULTS_PAGE_SPEC = ExtractionSpec({
+    'results_holder': Select('div', exact='results-holder allres'),
+    'next_page': Select('a', token='pagination-next'),
+})
+RESULTS_HOLDER_SPEC = ExtractionSpec({
+    'results': Select('div', token='result-con', many=True),
+})
+RESULT_SPEC = ExtractionSpec({
+    'link': Select('a', token='a-reset'),
+    'scores': Select('span', token=('score-lost', 'score-won', 'score-tie'), many=True),
+    'teams': Select('div', token='team', many=True),
+})
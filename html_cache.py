@@ -0,0 +1,259 @@
+import os
+import gzip
+import time
+import hashlib
+import threading
+import datetime as dt
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CACHE_DIR = os.path.join('data', 'html_cache')
+
+# Cache size limit before least recently used pages are evicted
+MAX_CACHE_BYTES = 2 * 1024**3
+
+# Fraction of max_bytes the cache is evicted down to, so a full cache does not evict on every put
+EVICT_TO_FRACTION = 0.9
+
+# Seconds a cached page stays valid per URL class.  None means never expires.
+# Match pages only get the never expiring 'match' class once they are final, see match_parser.get_cache_class.
+TTL_POLICY = {
+    'match': None,
+    'match_pending': 15 * 60,
+    'map_stats': None,
+    'player_stats_historical': None,
+    'player_stats': 24 * 3600,
+    'results': 15 * 60,
+    'other': 24 * 3600,
+}
+
+
+def normalize_url(url):
+    """
+    Normalizes a URL so equivalent URLs share one cache entry.  Lowercases scheme and host, sorts query parameters and drops fragments.
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+
+def classify_url(url):
+    """
+    Returns the URL class used for the TTL policy: 'match', 'map_stats', 'results', 'player_stats', 'player_stats_historical' or 'other'.
+    Player stats pages are historical when their endDate is before today, so their contents can no longer change.
+    """
+    parts = urlsplit(url)
+    path = parts.path
+
+    if path.startswith('/matches/'):
+        return 'match'
+    if path.startswith('/results'):
+        return 'results'
+    if path.startswith('/stats/matches/mapstatsid/'):
+        return 'map_stats'
+    if path.startswith('/stats/players/'):
+        query = dict(parse_qsl(parts.query))
+        end_date = query.get('endDate')
+        if end_date is not None:
+            try:
+                end_date_dt = dt.datetime.strptime(end_date, '%Y-%m-%d').date()
+            except ValueError:
+                return 'player_stats'
+            if end_date_dt < dt.date.today():
+                return 'player_stats_historical'
+        return 'player_stats'
+    return 'other'
+
+
+def _split_header(line):
+    # First line of an entry is the normalized URL, followed by a tab and the cache class if it was overridden
+    url, _, url_class = line.rstrip('\n').partition('\t')
+    return url, url_class or None
+
+
+def read_cache_entry(path):
+    """
+    Reads one cache file.  Returns (url, html).
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        url, _ = _split_header(file.readline())
+        html = file.read()
+    return url, html
+
+
+class HtmlCache:
+    """
+    Persistent gzip-compressed page cache keyed by the hash of the normalized URL.
+    Entries expire according to TTL_POLICY and the least recently used entries are evicted once the cache exceeds max_bytes, down to EVICT_TO_FRACTION of it.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, ttl_policy=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_policy = dict(TTL_POLICY)
+        if ttl_policy is not None:
+            self.ttl_policy.update(ttl_policy)
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._total_bytes = 0
+
+    def _path(self, url):
+        key = hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.gz')
+
+    def _load_index(self):
+        # Index of path -> [size, last access time], built once from the files on disk
+        self._index = {}
+        self._total_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.gz'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                self._index[path] = [stat.st_size, stat.st_atime]
+                self._total_bytes += stat.st_size
+
+    def _is_fresh(self, url_class, stored_time):
+        ttl = self.ttl_policy.get(url_class)
+        if ttl is None:
+            return True
+        return time.time() - stored_time < ttl
+
+    def get(self, url):
+        """
+        Returns cached html for url, or None if the page is not cached or has expired.
+        """
+        path = self._path(url)
+        try:
+            stat = os.stat(path)
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                _, url_class = _split_header(file.readline())
+                fresh = self._is_fresh(url_class or classify_url(url), stat.st_mtime)
+                html = file.read() if fresh else None
+        except (OSError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if not fresh:
+            with self._lock:
+                self.misses += 1
+                self.expired += 1
+            return None
+
+        # Access time drives LRU eviction, modification time is when the page was fetched
+        now = time.time()
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+            if self._index is not None and path in self._index:
+                self._index[path][1] = now
+        return html
+
+    def put(self, url, html, url_class=None):
+        """
+        Stores html for url.  The normalized URL is kept on the first line of the entry so the cache can be replayed offline.
+        url_class overrides classify_url(url) for the TTL of this entry, e.g. 'match_pending' for a match page that can still change.
+        """
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            header = normalize_url(url) if url_class is None else f"{normalize_url(url)}\t{url_class}"
+            file.write(header + '\n')
+            file.write(html)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            else:
+                old = self._index.get(path)
+                if old is not None:
+                    self._total_bytes -= old[0]
+                self._index[path] = [size, time.time()]
+                self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        target_bytes = self.max_bytes * EVICT_TO_FRACTION
+        by_last_access = sorted(self._index.items(), key=lambda item: item[1][1])
+        for path, (size, _) in by_last_access:
+            if self._total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self._index[path]
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def iter_entry_paths(self):
+        """
+        Yields the file path of every cached page.  Use read_cache_entry to load one.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in sorted(files):
+                if name.endswith('.gz'):
+                    yield os.path.join(root, name)
+
+    def iter_entries(self):
+        """
+        Yields (url, html) for every cached page, regardless of expiry.
+        """
+        for path in self.iter_entry_paths():
+            try:
+                yield read_cache_entry(path)
+            except (OSError, EOFError):
+                continue
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+html_cache = HtmlCache()
+
+def set_html_cache(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, ttl_policy=None, enabled=True):
+    """
+    Replaces the global page cache used by get_page_html.  enabled=False turns caching off.
+    """
+    global html_cache
+    html_cache = HtmlCache(cache_dir, max_bytes, ttl_policy) if enabled else None
+    return html_cache
+
+def get_html_cache():
+    """
+    Returns the global page cache, or None if caching is turned off.
+    """
+    return html_cache
@@ -0,0 +1,69 @@
+import os
+import json
+import threading
+
+
+class MatchJournal:
+    """
+    Append-only journal of finished matches, one JSON record per line.
+    Every append is flushed and synced to disk before returning, so a crash loses at most the match being written.
+    A partially written last line is ignored when the journal is read back.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._tail_checked = False
+
+    def iter_records(self):
+        """
+        Yields (match_id, data) for every complete record in the journal.
+        data is plain dicts in the order they were written.  Wrap it in OrderedDict to get the same stats cell as scrape_stat_range.
+        """
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                yield record['id'], record['data']
+
+    def completed_ids(self):
+        """
+        Returns the set of match IDs already committed to the journal.
+        """
+        return {match_id for match_id, _ in self.iter_records()}
+
+    def _truncate_partial_line(self):
+        # Drop a torn last line left by a crash so the next record starts on its own line
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, 'rb+') as file:
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+            if size == 0:
+                return
+            file.seek(size - 1)
+            if file.read(1) == b'\n':
+                return
+            file.seek(0)
+            content = file.read()
+            file.truncate(content.rfind(b'\n') + 1)
+
+    def append(self, match_id, data):
+        """
+        Commits one finished match to the journal.
+        """
+        line = json.dumps({'id': match_id, 'data': data}) + '\n'
+        with self._lock:
+            if not self._tail_checked:
+                self._truncate_partial_line()
+                self._tail_checked = True
+            with open(self.filename, 'a', encoding='utf-8') as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
@@ -1,34 +1,325 @@
 import re
 from datetime import datetime
-from bs4 import BeautifulSoup
-from time import sleep
+from bs4 import BeautifulSoup, Tag
+from time import sleep, perf_counter
 import requests
 import pytz
 from collections import OrderedDict
-
-import cloudscraper
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 from utilities import *
+from cloudscraper_object import scraper_pool, classify_response, get_retry_after, FetchError
+from cloudscraper.exceptions import CloudflareException
+from rate_limiter import rate_limiter, rate_controller, backoff_delay
+from html_cache import get_html_cache, classify_url
+from parsing import make_soup, get_page_type
+from extraction import MATCH_PAGE_SPEC
+from registry import player_registry, team_registry
+from metrics import metrics
+
+# Retries after throttling or transient errors before get_page_text gives up
+MAX_RETRIES = 5
+
+WON_LOST_PATTERN = re.compile("won|lost")
+MAP_LEFT_WON_PATTERN = re.compile('results-left won.*')
+BEST_OF_PATTERN = re.compile(r"Best of (\d+)")
+EVENT_TYPE_PATTERN = re.compile(r"\((.*?)\)")
+MATCH_URL_PATTERN = re.compile(r"/matches/(\d+)/(.+)$")
+
+
+def get_cached_page(cache, url, url_class):
+    """
+    Cached html for url, or None.  The lookup is counted in the run metrics.  cache=None always misses without counting.
+    """
+    if cache is None:
+        return None
+    html = cache.get(url)
+    metrics.record_cache(url_class, html is not None)
+    return html
+
+def cache_page(cache, url, url_class, html):
+    """
+    Stores a fetched page in cache (if not None) under its cache class, see get_cache_class.  Returns html.
+    """
+    if cache is not None:
+        cache.put(url, html, get_cache_class(url_class, html))
+    return html
+
+def record_fetch_outcome(url, url_class, attempt, max_retries, elapsed, response=None, error=None):
+    """
+    Records one request of a fetch in the run metrics and the adaptive rate control, given its response or the error it raised.
+    Returns (outcome, delay): outcome 'ok' means response holds the page, otherwise wait delay seconds and try again.
+    Raises FetchError if the page will not succeed on retry, or this was the last of max_retries retries.
+    """
+    retry_after = None
+    if response is None:
+        metrics.record_request(url_class, elapsed)
+        outcome = 'throttled' if isinstance(error, CloudflareException) else 'retry'
+        reason = repr(error)
+    else:
+        metrics.record_request(url_class, elapsed, response.status_code, len(response.content))
+        outcome = classify_response(response)
+        reason = f"status {response.status_code}"
+        retry_after = get_retry_after(response)
+
+    if outcome == 'ok':
+        rate_controller.on_success()
+        return outcome, None
+
+    if outcome == 'error':
+        metrics.record_fetch_failure(url_class)
+        raise FetchError(f"{url}: {reason}")
+
+    if outcome == 'throttled':
+        rate_controller.on_throttle(retry_after)
+
+    if attempt >= max_retries:
+        metrics.record_fetch_failure(url_class)
+        raise FetchError(f"{url}: {reason} after {max_retries} retries")
+
+    metrics.record_retry(url_class, outcome)
+    return outcome, backoff_delay(attempt, retry_after)
+
+def get_page_text(url, sleep_time=0, use_cache=True, max_retries=MAX_RETRIES):
+    """
+    Gets the raw html text of a page. Optional sleep timer for rate limiting.
+    Pages are served from the on-disk html cache when possible.  Otherwise requests go through the shared pool of warm cloudscraper sessions and the global rate limiter.
+    Throttling responses (429, 503, Cloudflare challenges) lower the global rate and are retried with jittered backoff, as are transient server and connection errors.
+    Raises FetchError if the page still fails after max_retries retries.
+    """
+    cache = get_html_cache() if use_cache else None
+    url_class = classify_url(url)
+
+    html = get_cached_page(cache, url, url_class)
+    if html is not None:
+        return html
+
+    for attempt in range(max_retries + 1):
+        sleep(sleep_time)
+        rate_limiter.acquire()
 
+        response = None
+        error = None
+        request_start = perf_counter()
+        try:
+            response = scraper_pool.get(url, retries=0)
+        except (CloudflareException, requests.RequestException) as request_error:
+            error = request_error
+
+        outcome, delay = record_fetch_outcome(url, url_class, attempt, max_retries, perf_counter() - request_start, response, error)
+        if outcome == 'ok':
+            return cache_page(cache, url, url_class, response.text)
+        sleep(delay)
+
+def get_cache_class(url_class, html):
+    """
+    Cache class override for a fetched page, or None to keep its URL class.
+    Match pages are 'match_pending' until they are final, so live and upcoming matches and matches without map stats yet are fetched again.
+    """
+    if url_class == 'match' and not is_final_match_page(make_soup(html, page_type='match')):
+        return 'match_pending'
+    return None
 
-def get_page_html(url, sleep_time=0):
+def get_page_html(url, sleep_time=0, use_cache=True, full_page=False):
     """
     Gets full html for a page. Optional sleep timer for rate limiting.
+    Pages are fetched with get_page_text and parsed with the backend chosen by parsing.set_parser_backend.
+    Match, player stats and results pages only get the regions the extractors read, unless full_page is set.
     """
-    sleep(sleep_time)
-    cscraper = cloudscraper.create_scraper()
-    response = cscraper.get(url)
-    html = response.text
-    match_html = BeautifulSoup(html, 'html.parser')
+    html = get_page_text(url, sleep_time, use_cache)
+
+    page_type = None if full_page else get_page_type(url)
+    with metrics.timer('parse', page_type or 'full'):
+        match_html = make_soup(html, page_type=page_type)
     return match_html
 
+def map_concurrently(func, items, max_workers=1):
+    """
+    Applies func to each item on up to max_workers threads.  Returns results in the same order as items.
+    """
+    if max_workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
+
+def map_pages(func, urls, sleep_time=0, max_workers=1):
+    """
+    Fetches each page and applies func to its html, keeping up to max_workers requests in flight.  Returns results in the same order as urls.
+    Parsing inside the workers means only max_workers pages are held in memory at once.
+    All workers share the global rate limiter, so raising max_workers never exceeds the configured request rate.
+    """
+    return map_concurrently(lambda url: func(get_page_html(url, sleep_time)), urls, max_workers=max_workers)
+
+def get_pages_html(urls, sleep_time=0, max_workers=1):
+    """
+    Gets full html for a list of pages, keeping up to max_workers requests in flight.  Returns pages in the same order as urls.
+    """
+    return map_pages(lambda page_html: page_html, urls, sleep_time, max_workers=max_workers)
+
+# Single pass match page parsing
+
+@dataclass
+class MatchRecord:
+    """
+    Everything the match extractors read from a match page.  Fields are None when that part of the page is missing.
+    Teams, scores and map results are ordered team1 first.
+    """
+    match_url: str = None
+    match_date_time: datetime = None
+    best_of: int = None
+    event_type: str = None
+    teams: OrderedDict = None
+    team_scores: list = None
+    winner: str = None
+    maps_played: list = None
+    maps_not_played: list = None
+    map_winners: list = None
+    map_scores: list = None
+    map_stats_links: list = None
+    rosters: OrderedDict = None
+
+
+def _parse_team(team_html):
+    id_text = team_html.find('a')
+    team_id = id_text['href'].split('/')[2]
+    team_name = team_html.find('div', {'class': 'teamName'}).text
+    score_html = team_html.find('div', {'class': WON_LOST_PATTERN})
+    return team_id, team_name, score_html
+
+
+def _parse_roster(lineup_html):
+    roster = []
+    for player in lineup_html.select('td.player:not(.player-image)'):
+        try:
+            player_div = player.find('div', class_='text-ellipsis')
+            player_nickname = player_div.text
+            player_id = player_div.parent['data-player-id']
+        except:
+            print("ERROR: Player name or ID not found!")
+            player_nickname = "???"
+            player_id = "???"
+        roster.append((player_id, player_nickname))
+    return roster
+
+
+@metrics.timed('extract', 'match')
+def parse_match_page(match_html):
+    """
+    Parses a full match page in a single walk of the document and returns a MatchRecord.
+    The record is stored on the page object so the get_match_* views can share it.
+    """
+    record = match_html.__dict__.get('_match_record')
+    if record is not None:
+        return record
+
+    regions = MATCH_PAGE_SPEC.scan(match_html)
+    record = MatchRecord()
+
+    if regions['canonical'] is not None:
+        record.match_url = regions['canonical']['href']
+
+    # Date & time
+    if regions['time_and_event'] is not None:
+        date = regions['time_and_event'].find('div', {'class': 'date'})
+        if date is not None:
+            record.match_date_time = datetime.fromtimestamp(int(date['data-unix'])/1000)
+
+    # Match type
+    if regions['veto_box'] is not None:
+        type_html = regions['veto_box'].find('div', {'class': "padding preformatted-text"})
+        if type_html is not None:
+            type_text = type_html.text
+            best_of = BEST_OF_PATTERN.findall(type_text)
+            event_type = EVENT_TYPE_PATTERN.search(type_text)
+            if best_of:
+                record.best_of = int(best_of[0])
+            if event_type:
+                record.event_type = event_type[0].strip("()")
+
+    # Teams & score
+    if regions['team1'] is not None and regions['team2'] is not None:
+        team1_id, team1_name, score1_html = _parse_team(regions['team1'])
+        team2_id, team2_name, score2_html = _parse_team(regions['team2'])
+
+        record.teams = OrderedDict()
+        record.teams[team1_id] = team1_name
+        record.teams[team2_id] = team2_name
+
+        if score1_html is not None and score2_html is not None:
+            record.team_scores = [score1_html.text, score2_html.text]
+            if score2_html['class'][0] == 'won':
+                record.winner = 'team2'
+            if score1_html['class'][0] == 'won':
+                record.winner = 'team1'
+
+    # Maps
+    if regions['maps'] is not None:
+        maps_picked_html = regions['maps'].find_all('div', {'class': 'mapholder'})
+
+        # Map is played if it has class="played", not played if class="optional"
+        record.maps_played = [map_picked.find('div', {'class': 'mapname'}).text for map_picked in maps_picked_html if map_picked.find('div', {'class': 'played'}) is not None]
+        record.maps_not_played = [map_picked.find('div', {'class': 'mapname'}).text for map_picked in maps_picked_html if map_picked.find('div', {'class': 'optional'}) is not None]
+
+        # Played maps link to their stats page, e.g. /stats/matches/mapstatsid/164185/natus-vincere-vs-faze
+        record.map_stats_links = []
+        for map_picked in maps_picked_html:
+            stats_link = map_picked.find('a', {'class': 'results-stats'})
+            if stats_link is not None:
+                record.map_stats_links.append((map_picked.find('div', {'class': 'mapname'}).text, stats_link['href']))
+
+    # Map winners, checking left results only
+    record.map_winners = []
+    for results_html in regions['results_played']:
+        if results_html.find('div', {'class': MAP_LEFT_WON_PATTERN}) is not None:
+            record.map_winners.append('team1')
+        else:
+            record.map_winners.append('team2')
+
+    # Map scores
+    record.map_scores = []
+    for result_left, result_right in zip(regions['results_left'], regions['results_right']):
+        try:
+            team1_score = int(result_left.find('div', {'class': 'results-team-score'}).text)
+            team2_score = int(result_right.find('div', {'class': 'results-team-score'}).text)
+            record.map_scores.append([team1_score, team2_score])
+        except:
+            continue
+
+    # Rosters, uses lineups instead of stats table
+    if record.teams is not None and len(regions['lineups']) >= 2:
+        team_ids = list(record.teams.keys())
+        record.rosters = OrderedDict()
+        record.rosters[team_ids[0]] = _parse_roster(regions['lineups'][0])
+        record.rosters[team_ids[1]] = _parse_roster(regions['lineups'][1])
+
+    match_html.__dict__['_match_record'] = record
+    return record
+
+
+def is_final_match_page(match_html):
+    """
+    Checks if a match page can no longer change: it has a winner and every played map links to its stats page.
+    """
+    record = parse_match_page(match_html)
+    if record.winner is None or not record.maps_played:
+        return False
+    return len(record.map_stats_links) >= len(record.maps_played)
+
+
+def _require(value, name):
+    if value is None:
+        raise ValueError(f"Match page has no {name}.")
+    return value
+
+
 # Get match id and title
 def get_match_id_title(match_url, from_html=False):
     if from_html:
-        match_html = match_url
-        match_url = match_html.find('head').find('link', {'rel':'canonical'})['href']
+        match_url = _require(parse_match_page(match_url).match_url, 'canonical link')
 
-    match = re.search(r"/matches/(\d+)/(.+)$", match_url)
+    match = MATCH_URL_PATTERN.search(match_url)
 
     if match:
         match_id = match.group(1)
@@ -42,12 +333,7 @@ def get_match_datetime(match_html):
     """
     Get match date & time in unix format. Takes full match page html as argument.
     """
-
-    date = match_html.find('div', {'class': 'timeAndEvent'}).find('div', {'class': 'date'})
-    unix_time = date['data-unix']
-    ts = int(unix_time)
-    match_date_time = datetime.fromtimestamp(ts/1000)
-    return match_date_time
+    return _require(parse_match_page(match_html).match_date_time, 'date')
 
 # Get match type
 def get_match_type(match_html):
@@ -55,14 +341,8 @@ def get_match_type(match_html):
     Get match type.
     Returns: (best_of, event_type)
     """
-    type_html = match_html.find('div', {'class': 'standard-box veto-box'}).find('div', {'class': "padding preformatted-text"})
-    type_text = type_html.text
-
-    best_of = re.findall(r"Best of (\d+)" ,type_text)[0]
-
-    event_type = re.search(r"\((.*?)\)", type_text)[0].strip("()")
-
-    return int(best_of), event_type
+    record = parse_match_page(match_html)
+    return _require(record.best_of, 'match type'), _require(record.event_type, 'event type')
 
 
 # Get teams
@@ -70,31 +350,11 @@ def get_match_teams(match_html, update_csv=False, quiet=True):
     """
     Get teams and team ids from full match page html
     """
-    teams = OrderedDict()
-
-    html1_text = match_html.find('div', {'class': 'team1-gradient'})
-    id_text = html1_text.find('a')
-    lst = id_text['href'].split('/')
-    team1_id = lst[2]
-
-    name_text = html1_text.find('div', {'class': 'teamName'})
-    team1_name = name_text.text
-    teams[team1_id] = team1_name
+    record = parse_match_page(match_html)
+    teams = OrderedDict(_require(record.teams, 'teams'))
 
-
-    html2_text = match_html.find('div', {'class': 'team2-gradient'})
-    id_text = html2_text.find('a')
-    lst = id_text['href'].split('/')
-    team2_id = lst[2]
-
-    name_text = html2_text.find('div', {'class': 'teamName'})
-    team2_name = name_text.text
-    teams[team2_id] = team2_name
-
-    teams_ids_names = [[tid, name] for tid, name in teams.items()]
     if update_csv:
-        teams_csv = "data/teams.csv"
-        update_csv_file(teams_csv, teams_ids_names, ['id', 'name'], quiet=quiet)
+        team_registry.observe_many(teams.items(), quiet=quiet, seen=record.match_date_time)
 
     return teams
 
@@ -104,26 +364,14 @@ def get_match_score(match_html, team1 = 'team1', team2 = 'team2'):
     """
     Gets match score and winner.  Returns dict {'team1 score': score, 'team2 score': score, winner: team1 or team2}
     """
-    score = {}
-
-    score1_html = match_html.find('div', {'class': 'standard-box teamsBox'}).find('div', {'class': "team1-gradient"})
-    score1_text_html = score1_html.find('div', {'class': re.compile("won|lost")})
-    team1_score = score1_text_html.text
-
-    score2_html = match_html.find('div', {'class': 'standard-box teamsBox'}).find('div', {'class': "team2-gradient"})
-    score2_text_html = score2_html.find('div', {'class': re.compile("won|lost")})
-    team2_score = score2_text_html.text
+    record = parse_match_page(match_html)
+    team1_score, team2_score = _require(record.team_scores, 'score')
+    labels = {'team1': team1, 'team2': team2}
 
+    score = {}
     score[team1] = team1_score
     score[team2] = team2_score
-
-    team1_winner = score1_text_html['class'][0] == 'won'
-    if team1_winner: winner = team1
-
-    team2_winner = score2_text_html['class'][0] == 'won'
-    if team2_winner: winner = team2
-
-    score['winner'] = winner
+    score['winner'] = labels[_require(record.winner, 'winner')]
 
     return score
 
@@ -133,19 +381,12 @@ def get_match_map_names(match_html, exclude_not_played = True):
     """
     Returns list of maps played in play order.  Optionally can include list of maps not played as second list.
     """
-
-    maps_picked_html = match_html.find('div', {'class': 'flexbox-column'}).find_all('div', {'class':'mapholder'})
-
-    # Includes map html snippet only if it has class="played"
-    maps_played_html = [map_picked for map_picked in maps_picked_html if len(map_picked.find_all('div', {'class': 'played'})) != 0]
-    maps_played = [map_played.find('div', {'class': 'mapname'}).text for map_played in maps_played_html]
+    record = parse_match_page(match_html)
+    maps_played = list(_require(record.maps_played, 'maps'))
 
     if exclude_not_played: return maps_played
 
-
-    # Same except class must be "optional"
-    maps_not_played_html = [map_picked for map_picked in maps_picked_html if len(map_picked.find_all('div', {'class': 'optional'})) != 0]
-    maps_not_played = [map_played.find('div', {'class': 'mapname'}).text for map_played in maps_not_played_html]
+    maps_not_played = list(record.maps_not_played)
     if len(maps_not_played) == 0:
         maps_not_played = None
 
@@ -156,20 +397,8 @@ def get_match_map_winners(match_html, team1 = 'team1', team2 = 'team2'):
     """
     Returns ordered list of which team won each map.
     """
-    results_played_html = match_html.find_all('div', {'class':'results played'})
-
-    # Check left results only
-
-    map_winners = []
-
-    for i in range(len(results_played_html)):
-        left_winner = results_played_html[i].find_all('div', {'class':re.compile('results-left won.*')})
-        if left_winner:
-            map_winners.append(team1)
-        else:
-            map_winners.append(team2)
-
-    return map_winners
+    labels = {'team1': team1, 'team2': team2}
+    return [labels[winner] for winner in parse_match_page(match_html).map_winners]
 
 
 
@@ -178,9 +407,7 @@ def get_match_winner(match_html, team1 = 'team1', team2 = 'team2'):
     """
     Only returns the match winner.
     """
-    result = match_html.find('div', {'class':'team1-gradient'}).find('div', {'class':'won'})
-
-    if result != None:
+    if parse_match_page(match_html).winner == 'team1':
         return team1
     else:
         return team2
@@ -189,25 +416,9 @@ def get_match_winner(match_html, team1 = 'team1', team2 = 'team2'):
 
 def get_match_map_scores(match_html, team1 = 'team1', team2 = 'team2', map_names = None):
 
-    result_left_list = match_html.find_all('div', {'class':'results-left'})
-    result_right_list = match_html.find_all('span', {'class':'results-right'})
-
-    scores = []
-    for i in range(len(result_left_list)):
-        team1_score = result_left_list[i].find('div', {'class': 'results-team-score'}).text
-        team2_score = result_right_list[i].find('div', {'class': 'results-team-score'}).text
-        try:
-            team1_score = int(team1_score)
-            team2_score = int(team2_score)
-            scores.append([team1_score, team2_score])
-        except:
-            next
-
-    return scores
+    return [list(map_score) for map_score in parse_match_page(match_html).map_scores]
 
 
-# Get match rosters - Uses lineups instead of stats table
-
 # Get match rosters - Uses lineups instead of stats table
 
 def get_match_rosters(match_html, include_nicknames=False, update_csv=False, quiet=True):
@@ -216,62 +427,33 @@ def get_match_rosters(match_html, include_nicknames=False, update_csv=False, qui
     Optionally can set values as tuples (player_id, nickname).
     Update csv will always save player id and nickname regardless of include_nicknames.
     """
+    record = parse_match_page(match_html)
+    rosters_with_nicknames = _require(record.rosters, 'lineups')
 
-    lineups_html = match_html.find_all('div', {'class':'lineup standard-box'})
-
-    teams_od = get_match_teams(match_html, update_csv=update_csv)
-    team_ids = list(teams_od.keys())
-
-    team1_players_html = lineups_html[0].select('td.player:not(.player-image)')
-    team2_players_html = lineups_html[1].select('td.player:not(.player-image)')
-
-    team1_roster_ids =[]
-    team1_roster_names =[]
-
-    for player in team1_players_html:
-        try:
-            player_div = player.find('div', class_='text-ellipsis')
-            player_nickname = player_div.text
-            player_id = player_div.parent['data-player-id']
-        except:
-            print("ERROR: Player name or ID not found!")
-            player_nickname = "???"
-            player_id = "???"
-        team1_roster_ids.append(player_id)
-        team1_roster_names.append(player_nickname)
-
-
-    team2_roster_ids =[]
-    team2_roster_names =[]
-
-    for player in team2_players_html:
-        try:
-            player_div = player.find('div', class_='text-ellipsis')
-            player_nickname = player_div.text
-            player_id = player_div.parent['data-player-id']
-        except:
-            print("ERROR: Player name or ID not found!")
-            player_nickname = "???"
-            player_id = "???"
-        team2_roster_ids.append(player_id)
-        team2_roster_names.append(player_nickname)
+    if update_csv:
+        get_match_teams(match_html, update_csv=True)
 
     rosters = OrderedDict()
 
     if include_nicknames:
-        rosters[team_ids[0]] = [(pid, nick) for pid, nick in zip(team1_roster_ids, team1_roster_names)]
-        rosters[team_ids[1]] = [(pid, nick) for pid, nick in zip(team2_roster_ids, team2_roster_names)]
+        for team_id, roster in rosters_with_nicknames.items():
+            rosters[team_id] = list(roster)
 
     else:
-        rosters[team_ids[0]] = team1_roster_ids
-        rosters[team_ids[1]] = team2_roster_ids
+        for team_id, roster in rosters_with_nicknames.items():
+            rosters[team_id] = [pid for pid, nick in roster]
 
     if update_csv:
-        all_player_ids_from_match = team1_roster_ids + team2_roster_ids
-        all_player_names_from_match = team1_roster_names + team2_roster_names
-        all_ids_names = [[pid, name] for pid, name in zip(all_player_ids_from_match, all_player_names_from_match)]
-
-        players_csv = "data/players.csv"
-        update_csv_file(players_csv, all_ids_names, ['id', 'nickname'], quiet=quiet)
+        player_registry.observe_many([(pid, nick) for roster in rosters_with_nicknames.values() for pid, nick in roster], quiet=quiet, seen=record.match_date_time)
 
     return rosters
+
+
+def register_match_entities(record, players=True, teams=True):
+    """
+    Adds the teams and players of a parsed match (MatchRecord) to the registries, dated by the match.  They are written to csv on the registries' next flush.
+    """
+    if teams and record.teams is not None:
+        team_registry.observe_many(record.teams.items(), seen=record.match_date_time)
+    if players and record.rosters is not None:
+        player_registry.observe_many([player for roster in record.rosters.values() for player in roster], seen=record.match_date_time)
@@ -1,9 +1,259 @@
 import re
+import csv
+import os
 import datetime as dt
+from typing import NamedTuple
 from bs4 import BeautifulSoup
 from dateutil.relativedelta import relativedelta
 
 from match_parser import *
 from player_stats import *
+from extraction import SCOREBOARD_ROW_SPEC
 
-#Work in progress
+MAP_STATS_CSV = os.path.join('data', 'map_player_stats.csv')
+
+# Matches found to have no map stats pages (e.g. forfeits), so they are not fetched again
+NO_MAP_STATS_CSV = os.path.join('data', 'map_stats_no_maps.csv')
+
+MAP_STATS_ID_PATTERN = re.compile(r"/mapstatsid/(\d+)")
+COUNT_CELL_PATTERN = re.compile(r"(-?\d+)(?:\s*\((\d+)\))?")
+
+
+class MapPlayerStats(NamedTuple):
+    """
+    One player's scoreboard line on one map.  id is 'mapstatsid_playerid'.
+    Field names after team_id follow stat_aggregator.MAP_STAT_COLUMNS, so rows can be added to a StatAggregator directly.
+    """
+    id: str
+    match_id: str
+    mapstatsid: str
+    team_id: str
+    player_id: str
+    date: str
+    map: str
+    rounds: int
+    kills: int
+    headshots: int
+    assists: int
+    deaths: int
+    adr: float
+    kast: float
+    rating: float
+
+
+MAP_STATS_HEADER = list(MapPlayerStats._fields)
+
+
+def get_map_stats_id(map_stats_url):
+    """
+    Gets the mapstatsid from a map stats url.
+    """
+    return MAP_STATS_ID_PATTERN.search(map_stats_url).group(1)
+
+
+def get_map_code(map_name):
+    """
+    Map name as used in stats url filters, e.g. 'Dust2' -> 'de_dust2'.
+    """
+    return 'de_' + map_name.lower().replace(' ', '')
+
+
+def get_match_map_stats_urls(match_html):
+    """
+    Gets (map_name, map_stats_url) for each played map with a stats page.
+    """
+    record = parse_match_page(match_html)
+    if record.map_stats_links is None:
+        raise ValueError("Match page has no maps.")
+    return [(map_name, "https://www.hltv.org" + href) for map_name, href in record.map_stats_links]
+
+
+def _parse_count_cell(text):
+    """
+    Parses cells like '22 (9)' into (22, 9).  The bracketed number is None if missing.
+    """
+    match = COUNT_CELL_PATTERN.search(text)
+    if match is None:
+        return None, None
+    bracketed = match.group(2)
+    return int(match.group(1)), int(bracketed) if bracketed is not None else None
+
+def _parse_float_cell(text):
+    text = text.strip()
+    if text in ('', '-'):
+        return None
+    if text.endswith('%'):
+        return float(text[:-1])/100
+    return float(text)
+
+
+@metrics.timed('extract', 'map_stats')
+def get_map_scoreboard(map_stats_html):
+    """
+    Gets the scoreboard of a map stats page.
+    Returns dict with 'date' ('yyyy-mm-dd'), 'rounds' (rounds played on the map) and 'players', an OrderedDict of player_id -> stats dict.
+    KAST is a fraction, e.g. 0.725.
+    """
+    info_box = map_stats_html.find('div', {'class': 'match-info-box'})
+
+    date_html = info_box.find('span', attrs={'data-unix': True})
+    date = dt.datetime.fromtimestamp(int(date_html['data-unix'])/1000).strftime('%Y-%m-%d')
+
+    rounds = 0
+    for side in ('team-left', 'team-right'):
+        rounds += int(info_box.find('div', {'class': side}).find('div', {'class': 'bold'}).text)
+
+    players = OrderedDict()
+    for table in map_stats_html.find_all('table', {'class': 'totalstats'}):
+        for row in table.find('tbody').find_all('tr'):
+            cells = SCOREBOARD_ROW_SPEC.scan(row)
+            player_id = cells['player'].find('a')['href'].split('/')[3]
+            kills, headshots = _parse_count_cell(cells['kills'].text)
+            assists, _ = _parse_count_cell(cells['assists'].text)
+            deaths, _ = _parse_count_cell(cells['deaths'].text)
+            players[player_id] = {
+                'kills': kills,
+                'headshots': headshots,
+                'assists': assists,
+                'deaths': deaths,
+                'adr': _parse_float_cell(cells['adr'].text),
+                'kast': _parse_float_cell(cells['kast'].text),
+                'rating': _parse_float_cell(cells['rating'].text),
+            }
+
+    return {'date': date, 'rounds': rounds, 'players': players}
+
+
+def get_map_player_stats_rows(match_id, map_name, map_stats_url, scoreboard, player_teams):
+    """
+    Turns a map scoreboard into MapPlayerStats rows.  player_teams maps player_id to team_id, from get_match_rosters.
+    """
+    mapstatsid = get_map_stats_id(map_stats_url)
+    rows = []
+    for player_id, stats in scoreboard['players'].items():
+        rows.append(MapPlayerStats(
+            id=f"{mapstatsid}_{player_id}",
+            match_id=str(match_id),
+            mapstatsid=mapstatsid,
+            team_id=player_teams.get(player_id),
+            player_id=player_id,
+            date=scoreboard['date'],
+            map=get_map_code(map_name),
+            rounds=scoreboard['rounds'],
+            **stats,
+        ))
+    return rows
+
+
+def get_match_map_player_stats(match_id, match_html, sleep_time=0.05, max_workers=1):
+    """
+    Scrapes every map scoreboard of one match.  Returns list of MapPlayerStats.
+    """
+    player_teams = {pid: team_id for team_id, roster in get_match_rosters(match_html).items() for pid in roster}
+    map_urls = get_match_map_stats_urls(match_html)
+    scoreboards = map_pages(get_map_scoreboard, [url for _, url in map_urls], sleep_time, max_workers=max_workers)
+
+    rows = []
+    for (map_name, url), scoreboard in zip(map_urls, scoreboards):
+        rows.extend(get_map_player_stats_rows(match_id, map_name, url, scoreboard, player_teams))
+    return rows
+
+
+def get_saved_map_stats_match_ids(map_stats_csv=MAP_STATS_CSV):
+    """
+    Set of match IDs with rows in the map stats csv.
+    """
+    if not os.path.isfile(map_stats_csv):
+        return set()
+    with open(map_stats_csv, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return set()
+        match_id_column = header.index('MATCH_ID')
+        return {row[match_id_column] for row in reader if row}
+
+
+def scrape_map_stats(match_list, sleep_time=0.05, max_workers=4, update_csv=True, chunk_size=20, map_stats_csv=MAP_STATS_CSV, return_output=False, no_map_stats_csv=NO_MAP_STATS_CSV):
+    """
+    Scrapes map scoreboards for every match in match_list (rows of the match list csv) that is not in map_stats_csv yet.
+    Match pages of a chunk are fetched concurrently, then all maps of those matches, up to max_workers requests at a time under the global rate limit.
+    Each chunk is appended to map_stats_csv as one row per (map, player), keyed 'mapstatsid_playerid'.
+    Matches played before today without any map stats pages are recorded in no_map_stats_csv and skipped on later runs.  Delete it to check them again.
+    """
+    start_timer()
+
+    saved_match_ids = get_saved_map_stats_match_ids(map_stats_csv)
+    if os.path.isfile(no_map_stats_csv):
+        saved_match_ids |= get_csv_store(no_map_stats_csv, ['id', 'date']).ids()
+    new_matches = [match for match in match_list if match[0] not in saved_match_ids]
+    print(f"Input match list contains {len(match_list)} matches, {len(match_list) - len(new_matches)} already saved in {map_stats_csv} or without map stats.")
+    print(f"Processing {len(new_matches)} new matches.")
+
+    def parse_match(match):
+        try:
+            match_html = get_page_html(match[3], sleep_time)
+            return get_match_map_stats_urls(match_html), get_match_rosters(match_html)
+        except Exception as error:
+            print(f"ERROR: Match {match[0]} skipped! {error}")
+            return None
+
+    def scrape_map(map_task):
+        match_id, map_name, url, player_teams = map_task
+        try:
+            scoreboard = get_map_scoreboard(get_page_html(url, sleep_time))
+        except Exception as error:
+            print(f"ERROR: Map stats {url} skipped! {error}")
+            return None
+        return get_map_player_stats_rows(match_id, map_name, url, scoreboard, player_teams)
+
+    output = []
+    failed_match_ids = []
+    today = dt.datetime.now().strftime('%Y-%m-%d')
+
+    for i in range(0, len(new_matches), chunk_size):
+        chunk = new_matches[i:i+chunk_size]
+        parsed_matches = map_concurrently(parse_match, chunk, max_workers=max_workers)
+
+        map_tasks = []
+        task_match_ids = []
+        no_map_matches = []
+        for match, parsed in zip(chunk, parsed_matches):
+            if parsed is None:
+                failed_match_ids.append(match[0])
+                continue
+            map_urls, rosters = parsed
+            if not map_urls:
+                # Stats pages of today's matches may not be up yet, so those are checked again next run
+                print(f"Match {match[0]} has no map stats pages.")
+                if match[1] < today:
+                    no_map_matches.append([match[0], match[1]])
+                continue
+            player_teams = {pid: team_id for team_id, roster in rosters.items() for pid in roster}
+            for map_name, url in map_urls:
+                map_tasks.append((match[0], map_name, url, player_teams))
+                task_match_ids.append(match[0])
+
+        # A match is only saved if all of its maps were scraped, so a failed match is retried on the next run
+        map_rows = map_concurrently(scrape_map, map_tasks, max_workers=max_workers)
+        incomplete = {match_id for match_id, rows in zip(task_match_ids, map_rows) if rows is None}
+        failed_match_ids.extend(sorted(incomplete))
+        chunk_rows = [row for match_id, rows in zip(task_match_ids, map_rows) if rows is not None and match_id not in incomplete for row in rows]
+
+        if update_csv:
+            with metrics.timer('write', 'csv', len(chunk_rows)):
+                update_csv_file(map_stats_csv, [list(row) for row in chunk_rows], MAP_STATS_HEADER)
+            if no_map_matches:
+                update_csv_file(no_map_stats_csv, no_map_matches, ['id', 'date'], quiet=True)
+        if return_output:
+            output.extend(chunk_rows)
+        print(f"Committed {min(i + chunk_size, len(new_matches))} of {len(new_matches)} matches.")
+
+    if failed_match_ids:
+        print(f"{len(failed_match_ids)} matches failed: {failed_match_ids}")
+
+    print()
+    end_timer()
+
+    if return_output:
+        return output
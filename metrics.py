@@ -0,0 +1,263 @@
+import json
+import time
+import threading
+import functools
+import datetime as dt
+from contextlib import contextmanager
+
+from html_cache import get_html_cache
+from rate_limiter import rate_limiter, rate_controller
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PARSE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+WRITE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    """
+    Fixed bucket histogram.  Quantiles are interpolated within buckets, the same way Prometheus estimates them.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return round(min(self.max, lower + (upper - lower) * (rank - seen) / bucket_count), 6)
+            seen += bucket_count
+        return round(self.max, 6)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 6),
+        }
+
+
+class RunMetrics:
+    """
+    Thread safe metrics for one scraping run:
+        fetch - request latency histograms, bytes, status codes, retries and html cache hits per URL class
+        parse - time to build the soup, per page type
+        extract - time spent in each extractor, per page type
+        write - time spent writing csv, journal and parquet output
+        queues - last and peak depth of each pipeline queue
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.histograms = {}
+            self.counters = {}
+            self.queue_depths = {}
+
+    def _histogram(self, kind, label, buckets):
+        histogram = self.histograms.get((kind, label))
+        if histogram is None:
+            histogram = self.histograms[(kind, label)] = Histogram(buckets)
+        return histogram
+
+    def _count(self, kind, name, label, amount=1):
+        key = (kind, name, label)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record_request(self, url_class, seconds, status=None, size=0):
+        """
+        One HTTP request.  status is the response status code, or None if no response arrived.
+        """
+        with self._lock:
+            self._histogram('fetch', url_class, LATENCY_BUCKETS).observe(seconds)
+            self._count('fetch', 'requests', url_class)
+            self._count('fetch', 'bytes', url_class, size)
+            self._count('fetch', f'status_{status if status is not None else "none"}', url_class)
+
+    def record_retry(self, url_class, reason):
+        """
+        A request that will be retried.  reason is 'throttled' or 'retry'.
+        """
+        with self._lock:
+            self._count('fetch', f'retries_{reason}', url_class)
+
+    def record_fetch_failure(self, url_class):
+        with self._lock:
+            self._count('fetch', 'failures', url_class)
+
+    def record_cache(self, url_class, hit):
+        with self._lock:
+            self._count('fetch', 'cache_hits' if hit else 'cache_misses', url_class)
+
+    def record_parse(self, page_type, seconds):
+        with self._lock:
+            self._histogram('parse', page_type or 'other', PARSE_BUCKETS).observe(seconds)
+
+    def record_extract(self, page_type, seconds):
+        with self._lock:
+            self._histogram('extract', page_type, PARSE_BUCKETS).observe(seconds)
+
+    def record_write(self, target, seconds, rows=0):
+        with self._lock:
+            self._histogram('write', target, WRITE_BUCKETS).observe(seconds)
+            self._count('write', 'rows', target, rows)
+
+    def record_queue_depths(self, depths):
+        """
+        Samples the depth of named queues, e.g. StatPipeline.queue_depths().
+        """
+        with self._lock:
+            for name, depth in depths.items():
+                last, peak = self.queue_depths.get(name, (0, 0))
+                self.queue_depths[name] = (depth, max(peak, depth))
+
+    @contextmanager
+    def timer(self, kind, label, rows=0):
+        """
+        Times a block as 'parse', 'extract' or 'write' for label.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if kind == 'parse':
+                self.record_parse(label, seconds)
+            elif kind == 'extract':
+                self.record_extract(label, seconds)
+            else:
+                self.record_write(label, seconds, rows)
+
+    def timed(self, kind, label):
+        """
+        Decorator version of timer.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(kind, label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self):
+        """
+        Run report as a JSON serializable dict.
+        """
+        with self._lock:
+            elapsed = time.time() - self.started
+            report = {
+                'started': dt.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'elapsed_seconds': round(elapsed, 3),
+                'fetch': {}, 'parse': {}, 'extract': {}, 'write': {},
+                'queues': {name: {'last': last, 'peak': peak} for name, (last, peak) in self.queue_depths.items()},
+            }
+            for (kind, label), histogram in self.histograms.items():
+                report[kind][label] = {'latency': histogram.summary()} if kind == 'fetch' else histogram.summary()
+
+            for (kind, name, label), value in self.counters.items():
+                report[kind].setdefault(label, {})[name] = value
+
+        for label, section in report['fetch'].items():
+            lookups = section.get('cache_hits', 0) + section.get('cache_misses', 0)
+            if lookups:
+                section['cache_hit_rate'] = round(section.get('cache_hits', 0) / lookups, 4)
+            if elapsed > 0 and section.get('requests'):
+                section['requests_per_sec'] = round(section['requests'] / elapsed, 3)
+
+        cache = get_html_cache()
+        report['html_cache'] = cache.stats() if cache is not None else None
+        report['rate_limit'] = {'requests_per_second': rate_limiter.rate, 'max_requests_per_second': rate_controller.max_rate, 'throttled': rate_controller.throttled}
+        return report
+
+    def write_json_report(self, filename):
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def prometheus_text(self, prefix='hltv_scraper'):
+        """
+        Metrics in the Prometheus text exposition format, e.g. for the node exporter textfile collector.
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            queue_depths = sorted(self.queue_depths.items())
+
+        label_names = {'fetch': 'url_class', 'parse': 'page_type', 'extract': 'page_type', 'write': 'target'}
+        seconds_names = {'fetch': 'request', 'parse': 'parse', 'extract': 'extract', 'write': 'write'}
+        declared = set()
+        for (kind, label), histogram in histograms:
+            name = f"{prefix}_{seconds_names[kind]}_seconds"
+            if name not in declared:
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            label_text = f'{label_names[kind]}="{label}"'
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label_text}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{label_text}}} {histogram.count}')
+
+        for (kind, counter, label), value in counters:
+            name = f"{prefix}_{kind}_{counter}_total"
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f'{name}{{{label_names[kind]}="{label}"}} {value}')
+
+        if queue_depths:
+            lines.append(f"# TYPE {prefix}_queue_depth gauge")
+            for queue_name, (last, peak) in queue_depths:
+                lines.append(f'{prefix}_queue_depth{{queue="{queue_name}"}} {last}')
+            lines.append(f"# TYPE {prefix}_queue_depth_peak gauge")
+            for queue_name, (last, peak) in queue_depths:
+                lines.append(f'{prefix}_queue_depth_peak{{queue="{queue_name}"}} {peak}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus_text())
+
+
+metrics = RunMetrics()
+
+def write_run_report(filename, prometheus_filename=None):
+    """
+    Writes the JSON run report, and the Prometheus text version if prometheus_filename is given.
+    """
+    metrics.write_json_report(filename)
+    if prometheus_filename is not None:
+        metrics.write_prometheus(prometheus_filename)
@@ -0,0 +1,110 @@
+import re
+from bs4 import BeautifulSoup, SoupStrainer, FeatureNotFound
+
+from html_cache import classify_url
+
+# BeautifulSoup tree builders the extractors are written against
+PARSER_BACKENDS = ('lxml', 'html.parser', 'html5lib')
+
+# Backends that can build a tree for only part of a page
+PARTIAL_PARSING_BACKENDS = ('lxml', 'html.parser')
+
+# Classes of the page regions read by the extractors for each page type.  Elements with any of these classes are kept with their whole subtree.
+PAGE_REGIONS = {
+    'match': ('teamsBox', 'team1-gradient', 'team2-gradient', 'timeAndEvent', 'veto-box', 'flexbox-column', 'mapholder', 'lineup'),
+    'player': ('summaryBreakdownContainer', 'statistics'),
+    'results': ('results-holder', 'pagination-next'),
+    'map_stats': ('match-info-box-con', 'totalstats'),
+}
+
+CANONICAL_LINK_PATTERN = re.compile(r'<link\b[^>]*\brel=["\']canonical["\'][^>]*>', re.IGNORECASE)
+HREF_PATTERN = re.compile(r'\bhref=["\']([^"\']*)["\']', re.IGNORECASE)
+
+
+def parser_backend_available(backend):
+    """
+    Checks if a parser backend is installed.
+    """
+    try:
+        BeautifulSoup('<html></html>', backend)
+    except FeatureNotFound:
+        return False
+    return True
+
+
+def _default_parser_backend():
+    if parser_backend_available('lxml'):
+        return 'lxml'
+    return 'html.parser'
+
+parser_backend = _default_parser_backend()
+partial_parsing = True
+
+
+def set_parser_backend(backend):
+    """
+    Sets the parser backend used for every page.  'lxml' is the fastest, 'html.parser' needs no extra packages.
+    """
+    global parser_backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Parser backend must be one of {PARSER_BACKENDS}")
+    if not parser_backend_available(backend):
+        raise ValueError(f"Parser backend '{backend}' is not installed.")
+    parser_backend = backend
+
+def get_parser_backend():
+    return parser_backend
+
+
+def set_partial_parsing(enabled):
+    """
+    Turns partial parsing of known page types on or off.
+    """
+    global partial_parsing
+    partial_parsing = enabled
+
+
+def get_page_type(url):
+    """
+    Returns the page type of an HLTV url: 'match', 'player', 'results', 'map_stats' or None for pages without a partial parsing spec.
+    """
+    url_class = classify_url(url)
+    if url_class.startswith('player_stats'):
+        return 'player'
+    if url_class in PAGE_REGIONS:
+        return url_class
+    return None
+
+
+def _region_strainer(region_classes):
+    region_classes = set(region_classes)
+
+    def keep(class_string):
+        return class_string is not None and not region_classes.isdisjoint(class_string.split())
+
+    return SoupStrainer(class_=keep)
+
+PAGE_STRAINERS = {page_type: _region_strainer(region_classes) for page_type, region_classes in PAGE_REGIONS.items()}
+
+
+def make_soup(html, backend=None, page_type=None):
+    """
+    Parses page html with the selected parser backend.
+    If page_type is given, only the regions listed in PAGE_REGIONS are built into the tree.
+    Match pages also keep their canonical link so get_match_id_title(from_html=True) still works.
+    """
+    if backend is None:
+        backend = parser_backend
+
+    if not partial_parsing or page_type not in PAGE_STRAINERS or backend not in PARTIAL_PARSING_BACKENDS:
+        return BeautifulSoup(html, backend)
+
+    page_html = BeautifulSoup(html, backend, parse_only=PAGE_STRAINERS[page_type])
+
+    if page_type == 'match':
+        canonical_link = CANONICAL_LINK_PATTERN.search(html)
+        href = HREF_PATTERN.search(canonical_link.group(0)) if canonical_link else None
+        if href:
+            page_html.insert(0, page_html.new_tag('link', attrs={'rel': ['canonical'], 'href': href.group(1)}))
+
+    return page_html
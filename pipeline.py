@@ -0,0 +1,271 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from parsing import make_soup
+from match_parser import get_page_text, parse_match_page
+from metrics import metrics
+from player_stats import get_player_stats_block, get_player_stats_key, get_player_stats_page_url, get_stats_date_range, player_stats_memo, has_unfetched_stats, STATS_NOT_FETCHED
+
+# Fetch priorities.  Player pages of matches already started go before new match pages.
+PLAYER_PRIORITY = 0
+MATCH_PRIORITY = 1
+STOP_PRIORITY = 2
+
+
+# Parse functions run in the process pool, so they take and return plain picklable data
+
+def parse_match_text(html):
+    return parse_match_page(make_soup(html, page_type='match'))
+
+def parse_player_stats_text(html):
+    return get_player_stats_block(make_soup(html, page_type='player'))
+
+PAGE_PARSERS = {'match': parse_match_text, 'player': parse_player_stats_text}
+
+def _parse_page(kind, html):
+    # Timed here because metrics recorded in the worker process are not seen by the parent
+    start = time.perf_counter()
+    result = PAGE_PARSERS[kind](html)
+    return result, time.perf_counter() - start
+
+
+class StatPipeline:
+    """
+    Staged producer/consumer version of scrape_stat_range:
+        fetch stage - fetch_workers threads running get_page_text under the global rate limit
+        parse stage - parse_workers processes parsing match and player stats pages
+        write stage - one thread passing batches of finished [match_id, player_stats] to write_fn
+    Stages are joined by bounded queues, so a slow stage holds back the ones feeding it instead of letting pages pile up in memory.
+    At most max_matches_in_flight matches are started but not yet handed to the writer.
+    Player stats requests are deduplicated across matches in flight and against memo.
+    A match with a page that could not be fetched is not written and is returned by run() as failed.
+    record_fn, if given, is called with each parsed MatchRecord in the coordinating thread.
+    """
+
+    def __init__(self, player_stat_range, write_fn, fetch_workers=4, parse_workers=None, max_matches_in_flight=20,
+                 parse_queue_size=32, write_queue_size=32, write_batch_size=10, sleep_time=0.05, memo=player_stats_memo, on_maps=None, record_fn=None):
+        self.player_stat_range = player_stat_range
+        self.write_fn = write_fn
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.max_matches_in_flight = max_matches_in_flight
+        self.parse_queue_size = parse_queue_size
+        self.write_queue_size = write_queue_size
+        self.write_batch_size = write_batch_size
+        self.sleep_time = sleep_time
+        self.memo = memo
+        self.on_maps = on_maps
+        self.record_fn = record_fn
+
+    def queue_depths(self):
+        """
+        Current number of items waiting in each stage's queue.
+        """
+        return {
+            'fetch': self._fetch_queue.qsize(),
+            'parse': self._parse_queue.qsize(),
+            'write': self._write_queue.qsize(),
+        }
+
+    # Stages
+
+    def _feed(self, matches):
+        # feeder_done is always posted, with the error if matches raised, so run() never waits on a dead feeder
+        error = None
+        try:
+            for match in matches:
+                self._in_flight.acquire()
+                if self._write_error is not None:
+                    self._in_flight.release()
+                    break
+                with self._lock:
+                    self._injected += 1
+                self._fetch_queue.put((MATCH_PRIORITY, next(self._seq), 'match', match[0], match[3]))
+        except Exception as feed_error:
+            error = feed_error
+        finally:
+            self._results_queue.put(('feeder_done', None, None, error))
+
+    def _fetch(self):
+        while True:
+            _, _, kind, context, url = self._fetch_queue.get()
+            if kind == 'stop':
+                return
+            try:
+                html = get_page_text(url, self.sleep_time)
+            except Exception as error:
+                self._results_queue.put((kind, context, None, error))
+                continue
+            self._parse_queue.put((kind, context, html))
+
+    def _dispatch_parsing(self, executor):
+        # Bounds the pages handed to the process pool but not yet parsed
+        slots = threading.BoundedSemaphore(self.parse_workers * 2)
+
+        def parsed(future, kind, context):
+            slots.release()
+            error = future.exception()
+            result = None
+            if error is None:
+                result, seconds = future.result()
+                metrics.record_parse(kind, seconds)
+            self._results_queue.put((kind, context, result, error))
+
+        while True:
+            item = self._parse_queue.get()
+            if item is None:
+                return
+            kind, context, html = item
+            slots.acquire()
+            future = executor.submit(_parse_page, kind, html)
+            future.add_done_callback(lambda future, kind=kind, context=context: parsed(future, kind, context))
+
+    def _write(self):
+        batch = []
+        while True:
+            item = self._write_queue.get()
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) >= self.write_batch_size or self._write_queue.empty()):
+                if self._write_error is None:
+                    try:
+                        self.write_fn(batch)
+                    except Exception as error:
+                        self._write_error = error
+                self._written += len(batch)
+                batch = []
+            if item is None:
+                return
+
+    # Coordination
+
+    def _finish_match(self, match_id, player_stats=None):
+        self._matches.pop(match_id, None)
+        if player_stats is not None and not has_unfetched_stats(player_stats):
+            self._write_queue.put([match_id, player_stats])
+        else:
+            self._failed.append(match_id)
+        self._finished += 1
+        self._in_flight.release()
+
+    def _handle_match(self, match_id, record, error):
+        if error is not None or record is None or record.rosters is None or record.match_date_time is None:
+            print(f"ERROR: Match {match_id} could not be parsed: {error}")
+            self._finish_match(match_id)
+            return
+
+        if self.record_fn is not None:
+            self.record_fn(record)
+
+        start_date, end_date = get_stats_date_range(record.match_date_time, self.player_stat_range)
+        player_stats = OrderedDict()
+        pending = 0
+
+        for team_id, roster in record.rosters.items():
+            player_stats[team_id] = {}
+            for pid, nick in roster:
+                player_stats[team_id][pid] = None
+                key = get_player_stats_key(pid, start_date, end_date, self.on_maps)
+
+                memo_stats = self.memo.get(key) if self.memo is not None else None
+                if memo_stats is not None:
+                    player_stats[team_id][pid] = memo_stats
+                    continue
+
+                pending += 1
+                if key in self._waiting:
+                    self._waiting[key].append((match_id, team_id, pid))
+                    continue
+
+                self._waiting[key] = [(match_id, team_id, pid)]
+                maps = list(key[3]) if key[3] is not None else None
+                url = get_player_stats_page_url(nick, pid, start_date, end_date, maps)
+                self._fetch_queue.put((PLAYER_PRIORITY, next(self._seq), 'player', key, url))
+
+        self._matches[match_id] = {'stats': player_stats, 'pending': pending}
+        if pending == 0:
+            self._finish_match(match_id, player_stats)
+
+    def _handle_player(self, key, stats, error):
+        if error is not None:
+            # The match is not written, so it is scraped again on the next run
+            print(f"ERROR: Player stats for {key[0]} could not be fetched: {error}")
+            stats = STATS_NOT_FETCHED
+        elif stats is not None and self.memo is not None:
+            self.memo[key] = stats
+
+        for match_id, team_id, pid in self._waiting.pop(key, []):
+            state = self._matches[match_id]
+            state['stats'][team_id][pid] = stats
+            state['pending'] -= 1
+            if state['pending'] == 0:
+                self._finish_match(match_id, state['stats'])
+
+    def run(self, matches):
+        """
+        Runs every match in matches (match list rows) through the pipeline.  Returns the list of match IDs that failed.
+        If reading matches or write_fn raises, no new matches are started, the ones in flight are finished and the error is raised here.
+        """
+        self._fetch_queue = queue.PriorityQueue()
+        self._parse_queue = queue.Queue(self.parse_queue_size)
+        self._results_queue = queue.Queue()
+        self._write_queue = queue.Queue(self.write_queue_size)
+        self._in_flight = threading.BoundedSemaphore(self.max_matches_in_flight)
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+        self._matches = {}
+        self._waiting = {}
+        self._failed = []
+        self._injected = 0
+        self._finished = 0
+        self._written = 0
+        self._write_error = None
+
+        executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        feeder = threading.Thread(target=self._feed, args=(matches,), daemon=True)
+        fetchers = [threading.Thread(target=self._fetch, daemon=True) for _ in range(self.fetch_workers)]
+        dispatcher = threading.Thread(target=self._dispatch_parsing, args=(executor,), daemon=True)
+        writer = threading.Thread(target=self._write, daemon=True)
+
+        for thread in [feeder, dispatcher, writer] + fetchers:
+            thread.start()
+
+        feed_error = None
+        try:
+            feeder_done = False
+            while True:
+                with self._lock:
+                    if feeder_done and self._finished == self._injected:
+                        break
+                kind, context, result, error = self._results_queue.get()
+                metrics.record_queue_depths(self.queue_depths())
+                if kind == 'feeder_done':
+                    feeder_done = True
+                    feed_error = error
+                elif kind == 'match':
+                    self._handle_match(context, result, error)
+                elif kind == 'player':
+                    self._handle_player(context, result, error)
+        finally:
+            for _ in fetchers:
+                self._fetch_queue.put((STOP_PRIORITY, next(self._seq), 'stop', None, None))
+            for thread in fetchers:
+                thread.join()
+            self._parse_queue.put(None)
+            dispatcher.join()
+            executor.shutdown(wait=True)
+            self._write_queue.put(None)
+            writer.join()
+
+        if self._write_error is not None:
+            raise self._write_error
+        if feed_error is not None:
+            raise feed_error
+
+        return self._failed
@@ -1,10 +1,12 @@
 import re
+import threading
 import datetime as dt
 from bs4 import BeautifulSoup
 from dateutil.relativedelta import relativedelta
 from collections import OrderedDict
 
 from match_parser import *
+from extraction import PLAYER_PAGE_SPEC, PLAYER_SUMMARY_SPEC, PLAYER_BREAKDOWN_SPEC, PLAYER_STATISTICS_SPEC
 
 # Get player stats page url
 def get_player_stats_page_url(player_nick, player_id, start_date = None, end_date = None, on_maps = None):
@@ -55,45 +57,44 @@ def get_player_stats_page_url(player_nick, player_id, start_date = None, end_dat
 
 
 
+# Stat labels seen on player stats pages -> stats dict keys
+_stat_field_names = {}
+
+def get_stat_field_name(stat_type):
+    """
+    Stats dict key for a stat label, e.g. 'Damage / Round' -> 'damage_per_round'.
+    """
+    field_name = _stat_field_names.get(stat_type)
+    if field_name is None:
+        field_name = stat_type.lower().replace(' / ', '_per_').replace('/','').replace(' ', '_').replace('%', 'percent').replace('.0','')
+        _stat_field_names[stat_type] = field_name
+    return field_name
+
+
+@metrics.timed('extract', 'player')
 def get_player_stats_block(player_stats_html):
     """
     Gets both basic stats blocks on player stats page.
     IMPORTANT: This function does not know dates or maps.  Those must be tracked separate from this function.
     """
-    stat_types_1 = []
-    modified_list = []
+    stat_types = []
     stat_values_str = []
     stat_values = []
 
-    # First summary stat block
     try:
-        summaryBreakdownContainer = player_stats_html.find('div', {'class': 'summaryBreakdownContainer'})
-        summaryStatBreakdownRow = summaryBreakdownContainer.find_all('div', {'class':'summaryStatBreakdownRow'})
-        summaryStatBreakdown = summaryBreakdownContainer.find_all('div', {'class': re.compile(r"summaryStatBreakdown (.*)")})
-
-        for stat_html in summaryStatBreakdown:
-            stat_types_1.append(stat_html.find('div', {'class':'summaryStatBreakdownSubHeader'}).find('b').text)
-            stat_values_str.append(stat_html.find('div', {'class':'summaryStatBreakdownDataValue'}).text)
-
-
-        # Second stat block
-        stat_block_html = player_stats_html.find('div', {'class': 'statistics'})
-        stats_rows = stat_block_html.find_all('div', {'class':'stats-row'})
-
-        stat_types_2 = []
-
-        for row in stats_rows:
-            stat_types_2.append(row.find('span').text)
-
-        for stat_type in stat_types_2:
-            stat_values_str.append(stat_block_html.find('span', string=stat_type).find_next_sibling('span').text)
-
-        stat_types = stat_types_1 + stat_types_2
+        regions = PLAYER_PAGE_SPEC.scan(player_stats_html)
 
-        for item in stat_types:
-            modified_item = item.lower().replace(' / ', '_per_').replace('/','').replace(' ', '_').replace('%', 'percent').replace('.0','')
-            modified_list.append(modified_item)
+        # First summary stat block
+        for stat_html in PLAYER_SUMMARY_SPEC.scan(regions['summary'])['breakdowns']:
+            breakdown = PLAYER_BREAKDOWN_SPEC.scan(stat_html)
+            stat_types.append(breakdown['label'].find('b').text)
+            stat_values_str.append(breakdown['value'].text)
 
+        # Second stat block, label and value are the two spans of each row
+        for row in PLAYER_STATISTICS_SPEC.scan(regions['statistics'])['rows']:
+            label_html = row.find('span')
+            stat_types.append(label_html.text)
+            stat_values_str.append(label_html.find_next_sibling('span').text)
 
         for item in stat_values_str:
             if item[-1] == '%':
@@ -101,8 +102,7 @@ def get_player_stats_block(player_stats_html):
             else:
                 stat_values.append(float(item))
 
-
-        stats_dict = dict(zip(modified_list, stat_values))
+        stats_dict = dict(zip([get_stat_field_name(item) for item in stat_types], stat_values))
 
         return stats_dict
     except:
@@ -110,51 +110,267 @@ def get_player_stats_block(player_stats_html):
         return None
 
 
-# Get player stats from X days before the match
-def get_player_stats_prior_to_match(match_html, player_stat_range, sleep_time=0.05):
+class _StatsNotFetched:
+    # Pickles as a reference to STATS_NOT_FETCHED so identity checks still work in other processes.  It cannot be written out as JSON.
+    def __repr__(self):
+        return 'STATS_NOT_FETCHED'
+
+    def __reduce__(self):
+        return 'STATS_NOT_FETCHED'
+
+# Stands in for the stats of a player whose page could not be fetched.  None is kept for pages fetched without stats.
+STATS_NOT_FETCHED = _StatsNotFetched()
+
+
+def fetch_player_stats_block(stats_url, sleep_time=0.05):
     """
-    Gets player stats from the day before to 'player_stat_range' days before the match.  Returns a nested dict with outer keys team_id, and inner keys player_id.
+    Fetches a player stats page and gets its stats blocks.
+    Returns None if the page has no stats, or STATS_NOT_FETCHED if the page could not be fetched (e.g. still throttled after all retries).
+    """
+    try:
+        player_stats_html = get_page_html(stats_url, sleep_time)
+    except FetchError as error:
+        print(f"ERROR: Player stats page not fetched! {error}")
+        return STATS_NOT_FETCHED
+    return get_player_stats_block(player_stats_html)
+
+
+def has_unfetched_stats(player_stats):
+    """
+    True if any player in a match's player_stats (team_id -> {player_id: stats}) is STATS_NOT_FETCHED.
+    """
+    return any(stats is STATS_NOT_FETCHED for team_player_stats in player_stats.values() for stats in team_player_stats.values())
+
+
+def drop_unfetched_matches(match_player_data):
+    """
+    Keeps the [match_id, player_stats] entries whose player stats pages were all fetched.  The others are reported and left out, so they are not saved and are scraped again on the next run.
+    """
+    complete = []
+    for match_id, player_stats in match_player_data:
+        if has_unfetched_stats(player_stats):
+            print(f"ERROR: Match {match_id} not saved, some player stats pages were not fetched.")
+        else:
+            complete.append([match_id, player_stats])
+    return complete
+
+
+# Player stats blocks kept in memory by the default memo.  Older ones are still in the html cache.
+MAX_MEMO_ENTRIES = 10000
+
+
+class PlayerStatsMemo:
+    """
+    Player stats already fetched, keyed by (player_id, start_date, end_date, maps).
+    Holds at most max_entries stats blocks and drops the least recently used, so a long backfill does not grow it without limit.
+    """
+
+    def __init__(self, max_entries=MAX_MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            stats = self._entries.get(key, default)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return stats
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def __setitem__(self, key, stats):
+        with self._lock:
+            self._entries[key] = stats
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+player_stats_memo = PlayerStatsMemo()
+
+def clear_player_stats_memo():
+    player_stats_memo.clear()
+
+
+# Get the stats date range for a match
+def get_player_stats_date_range(match_html, player_stat_range):
+    """
+    Returns (start_date, end_date) covering the day before to 'player_stat_range' days before the match.
     """
+    return get_stats_date_range(get_match_datetime(match_html), player_stat_range)
 
-    # Find start and end date for stats to scrape
-    match_date_dt = get_match_datetime(match_html)
 
+def get_stats_date_range(match_date_dt, player_stat_range):
+    """
+    Same as get_player_stats_date_range for a match datetime instead of a match page.
+    """
     start_date_dt = match_date_dt - relativedelta(days = player_stat_range)
     end_date_dt = match_date_dt - relativedelta(days=1)
 
     start_date = start_date_dt.strftime("%Y-%m-%d")
     end_date = end_date_dt.strftime("%Y-%m-%d")
 
-    # Get player rosters, clean output, then generate urls
-    rosters_od = get_match_rosters(match_html, include_nicknames=True)
-    team_ids = list(rosters_od.keys())
+    return start_date, end_date
+
+
+def get_player_stats_key(player_id, start_date, end_date, on_maps=None):
+    """
+    Key identifying one player stats page.  Two matches needing the same key share a single request.
+    """
+    return (str(player_id), start_date, end_date, normalize_maps(on_maps))
+
+
+def normalize_maps(on_maps):
+    """
+    Map filter as a sorted tuple of map names, or None for all maps.
+    """
+    if on_maps is None:
+        return None
+    if type(on_maps) == str:
+        return (on_maps,)
+    return tuple(sorted(on_maps))
+
+
+def get_stat_window(window, on_maps=None):
+    """
+    Normalizes a stats window to (player_stat_range, maps).  window is a number of days or a (player_stat_range, on_maps) pair.
+    """
+    if isinstance(window, (tuple, list)):
+        window, on_maps = window
+    return (int(window), normalize_maps(on_maps))
+
+
+def plan_player_stats_windows(match_pages, windows, match_windows=None):
+    """
+    Builds the player stats requests needed by a set of matches for several stats windows at once, deduplicated across matches and windows.
+    match_pages is an iterable of (match_id, match_html) and is consumed lazily.  Each match page and roster is read once for all windows.
+    windows is a list of windows as taken by get_stat_window.  match_windows optionally maps match_id to the windows needed for that match (default all).
+    Returns (requests, window_match_keys):
+        requests - OrderedDict of key -> player stats url, one entry per unique (player_id, start_date, end_date, maps)
+        window_match_keys - OrderedDict of window -> match_keys as returned by plan_player_stats_requests
+    """
+    windows = [get_stat_window(window) for window in windows]
+    requests = OrderedDict()
+    window_match_keys = OrderedDict((window, OrderedDict()) for window in windows)
+
+    for match_id, match_html in match_pages:
+        needed = windows
+        if match_windows is not None:
+            needed = [get_stat_window(window) for window in match_windows.get(match_id, windows)]
+        if not needed:
+            continue
 
-    team1_roster, team2_roster = rosters_od[team_ids[0]], rosters_od[team_ids[1]]
+        match_date_dt = get_match_datetime(match_html)
+        rosters_od = get_match_rosters(match_html, include_nicknames=True)
 
-    team1_player_stats_urls = []
-    for pid, nick in team1_roster:
-        team1_player_stats_urls.append(get_player_stats_page_url(nick, pid, start_date, end_date))
+        for window in needed:
+            player_stat_range, maps = window
+            start_date, end_date = get_stats_date_range(match_date_dt, player_stat_range)
 
-    team2_player_stats_urls = []
-    for pid, nick in team2_roster:
-        team2_player_stats_urls.append(get_player_stats_page_url(nick, pid, start_date, end_date))
+            team_keys = OrderedDict()
+            for team_id, roster in rosters_od.items():
+                team_keys[team_id] = []
+                for pid, nick in roster:
+                    key = get_player_stats_key(pid, start_date, end_date, maps)
+                    if key not in requests:
+                        requests[key] = get_player_stats_page_url(nick, pid, start_date, end_date, list(maps) if maps is not None else None)
+                    team_keys[team_id].append((pid, key))
 
-    team1_player_stats = {}
-    for i in range(len(team1_roster)):
-        player_stats_html = get_page_html(team1_player_stats_urls[i], sleep_time)
-        stats_block = get_player_stats_block(player_stats_html)
-        team1_player_stats[team1_roster[i][0]] = stats_block
+            window_match_keys[window][match_id] = team_keys
 
-    team2_player_stats = {}
-    for i in range(len(team2_roster)):
-        player_stats_html = get_page_html(team2_player_stats_urls[i], sleep_time)
-        stats_block = get_player_stats_block(player_stats_html)
-        team2_player_stats[team2_roster[i][0]] = stats_block
+    return requests, window_match_keys
 
-    teams = get_match_teams(match_html)
 
-    player_stats_prior_match = OrderedDict()
-    player_stats_prior_match[team_ids[0]] = team1_player_stats
-    player_stats_prior_match[team_ids[1]] = team2_player_stats
+def plan_player_stats_requests(match_pages, player_stat_range, on_maps=None):
+    """
+    Builds the player stats requests needed by a set of matches, deduplicated across matches.
+    match_pages is an iterable of (match_id, match_html) and is consumed lazily, so match pages can be fetched while planning.
+    Returns (requests, match_keys):
+        requests - OrderedDict of key -> player stats url, one entry per unique (player_id, start_date, end_date, maps)
+        match_keys - OrderedDict of match_id -> OrderedDict of team_id -> list of (player_id, key)
+    """
+    window = get_stat_window(player_stat_range, on_maps)
+    requests, window_match_keys = plan_player_stats_windows(match_pages, [window])
+    return requests, window_match_keys[window]
+
+
+def split_memoized_requests(requests, memo=player_stats_memo):
+    """
+    Splits planned requests into (stats_by_key, keys_to_fetch): the stats blocks already in memo, and the keys still to fetch.
+    """
+    stats_by_key = {}
+    keys_to_fetch = []
+    for key in requests:
+        stats_block = memo.get(key) if memo is not None else None
+        if stats_block is not None:
+            stats_by_key[key] = stats_block
+        else:
+            keys_to_fetch.append(key)
+    return stats_by_key, keys_to_fetch
+
+
+def memoize_fetched_stats(stats_by_key, keys_to_fetch, stats_blocks, memo=player_stats_memo):
+    """
+    Adds fetched stats blocks to stats_by_key, and to memo unless the page had no stats or was not fetched.  Returns stats_by_key.
+    """
+    for key, stats_block in zip(keys_to_fetch, stats_blocks):
+        stats_by_key[key] = stats_block
+        if memo is not None and stats_block is not None and stats_block is not STATS_NOT_FETCHED:
+            memo[key] = stats_block
+    return stats_by_key
+
+
+def fetch_player_stats_requests(requests, sleep_time=0.05, max_workers=1, memo=player_stats_memo):
+    """
+    Fetches each planned player stats page once and returns a dict of key -> stats block, None or STATS_NOT_FETCHED as from fetch_player_stats_block.
+    Keys already in memo are not fetched again.  Successful results are added to memo.
+    """
+    stats_by_key, keys_to_fetch = split_memoized_requests(requests, memo)
+    urls = [requests[key] for key in keys_to_fetch]
+    stats_blocks = map_concurrently(lambda url: fetch_player_stats_block(url, sleep_time), urls, max_workers=max_workers)
+    return memoize_fetched_stats(stats_by_key, keys_to_fetch, stats_blocks, memo)
+
+
+def assemble_player_stats(match_keys, stats_by_key):
+    """
+    Fans fetched stats back out to matches.  Returns OrderedDict of match_id -> OrderedDict of team_id -> {player_id: stats}.
+    """
+    player_stats_by_match = OrderedDict()
+    for match_id, team_keys in match_keys.items():
+        player_stats_prior_match = OrderedDict()
+        for team_id, player_keys in team_keys.items():
+            player_stats_prior_match[team_id] = {pid: stats_by_key.get(key) for pid, key in player_keys}
+        player_stats_by_match[match_id] = player_stats_prior_match
+    return player_stats_by_match
+
+
+# Get player stats from X days before the match
+def get_player_stats_prior_to_match(match_html, player_stat_range, sleep_time=0.05, max_workers=1):
+    """
+    Gets player stats from the day before to 'player_stat_range' days before the match.  Returns a nested dict with outer keys team_id, and inner keys player_id.
+    With max_workers > 1 the player pages are fetched concurrently under the global rate limit.
+    Raises FetchError if a player stats page could not be fetched.
+    """
+    requests, match_keys = plan_player_stats_requests([(None, match_html)], player_stat_range)
+    stats_by_key = fetch_player_stats_requests(requests, sleep_time, max_workers=max_workers)
 
-    return player_stats_prior_match
+    player_stats = assemble_player_stats(match_keys, stats_by_key)[None]
+    if has_unfetched_stats(player_stats):
+        raise FetchError("Player stats pages not fetched.")
+    return player_stats
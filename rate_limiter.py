@@ -0,0 +1,157 @@
+import random
+import asyncio
+import threading
+import time
+
+# Default request budget shared by every fetch
+REQUESTS_PER_SECOND = 5
+BURST_SIZE = 5
+
+# Adaptive rate control: lowest rate after repeated throttling, rate added after each run of healthy responses, factor applied on throttling
+MIN_REQUESTS_PER_SECOND = 0.2
+RATE_INCREASE = 0.25
+RATE_DECREASE = 0.5
+HEALTHY_RESPONSES_PER_INCREASE = 20
+
+# Retry backoff in seconds
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket.  Allows 'rate' requests per second on average with bursts of up to 'burst' requests.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=BURST_SIZE):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes 'tokens' tokens and returns 0 if they are available, otherwise returns the seconds to wait before trying again.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until 'tokens' tokens are available, then takes them.
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """
+        acquire for asyncio code.  Waits without blocking the event loop, sharing the budget with threaded callers.
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def set_rate(self, rate, burst=None):
+        """
+        Changes the rate (and optionally the burst size) without dropping tokens already earned.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            if burst is not None:
+                self.burst = burst
+                self._tokens = min(self._tokens, burst)
+
+    def pause(self, seconds):
+        """
+        Makes every caller wait at least 'seconds' before the next request, e.g. after the server asked us to slow down.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class AdaptiveRateController:
+    """
+    AIMD control of a TokenBucket's rate.
+    Each throttling response multiplies the rate by 'decrease' and pauses all requests.  Every 'window' healthy responses in a row add 'increase' requests per second, up to max_rate.
+    """
+
+    def __init__(self, bucket, max_rate=REQUESTS_PER_SECOND, min_rate=MIN_REQUESTS_PER_SECOND, increase=RATE_INCREASE, decrease=RATE_DECREASE, window=HEALTHY_RESPONSES_PER_INCREASE):
+        self.bucket = bucket
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.throttled = 0
+        self._healthy = 0
+        self._last_decrease = None
+        self._lock = threading.Lock()
+
+    def on_success(self):
+        with self._lock:
+            self._healthy += 1
+            if self._healthy < self.window:
+                return
+            self._healthy = 0
+            new_rate = min(self.max_rate, self.bucket.rate + self.increase)
+        if new_rate != self.bucket.rate:
+            self.bucket.set_rate(new_rate)
+
+    def on_throttle(self, retry_after=None):
+        """
+        Cuts the rate and pauses all requests for retry_after seconds if given, otherwise for one request interval at the new rate.
+        Throttling seen by several threads at once only cuts the rate once per second.
+        """
+        with self._lock:
+            self._healthy = 0
+            self.throttled += 1
+            now = time.monotonic()
+            new_rate = self.bucket.rate
+            if self._last_decrease is None or now - self._last_decrease >= 1.0:
+                new_rate = max(self.min_rate, self.bucket.rate * self.decrease)
+                self._last_decrease = now
+        self.bucket.set_rate(new_rate)
+        self.bucket.pause(retry_after if retry_after is not None else 1.0 / new_rate)
+
+
+def backoff_delay(attempt, retry_after=None, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Seconds to wait before retry number 'attempt' (0 based).  Exponential backoff with full jitter, never less than retry_after.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+rate_limiter = TokenBucket()
+rate_controller = AdaptiveRateController(rate_limiter)
+
+def set_rate_limit(requests_per_second, burst=None):
+    """
+    Sets the global request rate used by get_page_html and every concurrent fetch.
+    The adaptive controller may lower the rate when HLTV throttles us, but never raises it above this value.
+    """
+    rate_limiter.set_rate(requests_per_second, burst)
+    rate_controller.max_rate = requests_per_second
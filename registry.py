@@ -0,0 +1,217 @@
+import os
+import csv
+import time
+import atexit
+import threading
+import datetime as dt
+
+from utilities import update_csv_file
+
+PLAYERS_CSV = os.path.join('data', 'players.csv')
+TEAMS_CSV = os.path.join('data', 'teams.csv')
+
+# Every name seen for each ID, one row per (id, name)
+PLAYER_NAMES_CSV = os.path.join('data', 'player_names.csv')
+TEAM_NAMES_CSV = os.path.join('data', 'team_names.csv')
+
+# Dirty entries are written once this many are pending, or when the oldest has waited this many seconds
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 30.0
+
+
+def _format_seen_date(seen):
+    """
+    'yyyy-mm-dd' string for a date, datetime or date string.  None is today.
+    """
+    if seen is None:
+        seen = dt.date.today()
+    if isinstance(seen, str):
+        return seen[:10]
+    return seen.strftime('%Y-%m-%d')
+
+
+def normalize_name(name):
+    """
+    Name used for lookups.  Case and surrounding whitespace are ignored.
+    """
+    return name.strip().casefold()
+
+
+class Entity:
+    """
+    A player or team.  name is the name seen in the latest match, seen the date of that match, previous_names the older names, oldest first.
+    """
+    __slots__ = ('id', 'name', 'previous_names', 'seen')
+
+    def __init__(self, entity_id, name, previous_names=(), seen=None):
+        self.id = entity_id
+        self.name = name
+        self.previous_names = tuple(previous_names)
+        self.seen = seen
+
+    def names(self):
+        return self.previous_names + (self.name,)
+
+    def __repr__(self):
+        return f"Entity({self.id!r}, {self.name!r}, previous_names={self.previous_names!r})"
+
+
+class EntityRegistry:
+    """
+    In-memory registry of players or teams, indexed by ID and by normalized name (current and previous).
+    The ID csv (id, name) keeps the first name seen for each ID as before.  Renames are kept in a names csv (key, id, name, first_seen).
+    Names are ordered by the date of the match they were seen in, not the order matches are scraped, so a newest first backfill does not record old names as renames.
+    New IDs and renames are buffered and appended to both files in batches by flush.
+    """
+
+    def __init__(self, filename, header, names_filename, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.filename = filename
+        self.header = header
+        self.names_filename = names_filename
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._by_id = None
+        self._by_name = None
+        self._new_entities = []
+        self._new_names = []
+        self._dirty_since = None
+        self._lock = threading.RLock()
+
+    def _index_name(self, entity, name):
+        ids = self._by_name.setdefault(normalize_name(name), [])
+        if entity.id not in ids:
+            ids.append(entity.id)
+
+    def _load(self):
+        if self._by_id is not None:
+            return
+        self._by_id = {}
+        self._by_name = {}
+
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r', newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader, None)
+                for row in reader:
+                    if row:
+                        entity = Entity(row[0], row[1])
+                        self._by_id[entity.id] = entity
+                        self._index_name(entity, entity.name)
+
+        # The first_seen date of each names file row decides which name is current
+        if os.path.isfile(self.names_filename):
+            with open(self.names_filename, 'r', newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader, None)
+                for row in reader:
+                    if row:
+                        self._apply_name(row[1], row[2], row[3] if len(row) > 3 else None)
+
+    def _apply_name(self, entity_id, name, seen=None):
+        """
+        Records name for entity_id as seen on date seen ('yyyy-mm-dd').
+        Returns 'new' for an unknown ID, 'renamed' if the name replaces the current one, 'previous' if it is an older name not seen before, else None.
+        """
+        entity = self._by_id.get(entity_id)
+        if entity is None:
+            entity = Entity(entity_id, name, seen=seen)
+            self._by_id[entity_id] = entity
+            self._index_name(entity, name)
+            return 'new'
+        if name == entity.name:
+            if seen is not None and (entity.seen is None or seen > entity.seen):
+                entity.seen = seen
+            return None
+        if seen is None or entity.seen is None or seen >= entity.seen:
+            entity.previous_names = tuple(previous for previous in entity.previous_names if previous != name) + (entity.name,)
+            entity.name = name
+            entity.seen = seen
+            self._index_name(entity, name)
+            return 'renamed'
+        if name in entity.previous_names:
+            return None
+        entity.previous_names = (name,) + entity.previous_names
+        self._index_name(entity, name)
+        return 'previous'
+
+    def __contains__(self, entity_id):
+        with self._lock:
+            self._load()
+            return str(entity_id) in self._by_id
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._by_id)
+
+    def get(self, entity_id):
+        """
+        Entity for an ID, or None.
+        """
+        with self._lock:
+            self._load()
+            return self._by_id.get(str(entity_id))
+
+    def find(self, name):
+        """
+        Entities that are or were called name (any case).
+        """
+        with self._lock:
+            self._load()
+            return [self._by_id[entity_id] for entity_id in self._by_name.get(normalize_name(name), [])]
+
+    def observe(self, entity_id, name, seen=None):
+        """
+        Records that entity_id was seen with name in a match on date seen (date, datetime or 'yyyy-mm-dd', default today).
+        New IDs and new names are written on the next flush.
+        """
+        self.observe_many([(entity_id, name)], seen=seen)
+
+    def observe_many(self, pairs, quiet=True, seen=None):
+        """
+        observe for a list of (entity_id, name) seen on the same date.  Flushes if enough changes are pending.
+        """
+        with self._lock:
+            self._load()
+            seen = _format_seen_date(seen)
+            for entity_id, name in pairs:
+                entity_id = str(entity_id)
+                change = self._apply_name(entity_id, name, seen)
+                if change is None:
+                    continue
+                if change == 'new':
+                    self._new_entities.append([entity_id, name])
+                self._new_names.append([f"{entity_id}|{name}|{seen}", entity_id, name, seen])
+                if self._dirty_since is None:
+                    self._dirty_since = time.monotonic()
+
+            if self._dirty_since is not None:
+                pending = len(self._new_entities) + len(self._new_names)
+                if pending >= self.flush_size or time.monotonic() - self._dirty_since >= self.flush_interval:
+                    self.flush(quiet)
+
+    def flush(self, quiet=True):
+        """
+        Appends pending new IDs and renames to the csv files.
+        """
+        with self._lock:
+            if self._new_entities:
+                update_csv_file(self.filename, self._new_entities, self.header, quiet=quiet)
+            if self._new_names:
+                update_csv_file(self.names_filename, self._new_names, ['key', 'id', 'name', 'first_seen'], quiet=quiet)
+            self._new_entities = []
+            self._new_names = []
+            self._dirty_since = None
+
+
+player_registry = EntityRegistry(PLAYERS_CSV, ['id', 'nickname'], PLAYER_NAMES_CSV)
+team_registry = EntityRegistry(TEAMS_CSV, ['id', 'name'], TEAM_NAMES_CSV)
+
+def flush_registries(quiet=True):
+    """
+    Writes pending changes of the player and team registries.
+    """
+    player_registry.flush(quiet)
+    team_registry.flush(quiet)
+
+atexit.register(flush_registries)
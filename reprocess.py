@@ -0,0 +1,159 @@
+"""
+Rebuilds derived data from cached html without any network access.
+
+Usage:
+    python reprocess.py OUTPUT_DIR [--cache-dir DIR] [--workers N] [--chunk-size N]
+
+Every page in the html cache is parsed with the extractor for its page type, spread over a process pool in chunks.
+Output is one JSON lines file per page type in OUTPUT_DIR, plus failures.jsonl listing pages that could not be parsed.
+"""
+import os
+import json
+import time
+import argparse
+import dataclasses
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from html_cache import HtmlCache, CACHE_DIR, read_cache_entry
+from parsing import make_soup, get_page_type
+from match_parser import parse_match_page
+from player_stats import get_player_stats_block
+from scraper import parse_results_page
+from match_stats import get_map_scoreboard
+
+
+# Extractors per page type.  Each takes (url, page_html) and returns JSON serializable data.
+
+def extract_match(url, page_html):
+    record = dataclasses.asdict(parse_match_page(page_html))
+    if record['match_date_time'] is not None:
+        record['match_date_time'] = record['match_date_time'].isoformat()
+    return record
+
+def extract_player_stats(url, page_html):
+    stats = get_player_stats_block(page_html)
+    if stats is None:
+        raise ValueError("Player stats not found")
+    return stats
+
+def extract_results(url, page_html):
+    match_list, next_page_url = parse_results_page(page_html, url)
+    return {'matches': match_list, 'next_page_url': next_page_url}
+
+def extract_map_stats(url, page_html):
+    return get_map_scoreboard(page_html)
+
+REPROCESS_EXTRACTORS = {
+    'match': extract_match,
+    'player': extract_player_stats,
+    'results': extract_results,
+    'map_stats': extract_map_stats,
+}
+
+
+def reprocess_chunk(paths):
+    """
+    Parses a chunk of cache files.  Runs in a worker process.
+    Returns (outputs, failures, skipped) where outputs is a list of (page_type, url, data) and failures a list of (url or path, error).
+    """
+    outputs = []
+    failures = []
+    skipped = 0
+    for path in paths:
+        try:
+            url, html = read_cache_entry(path)
+        except (OSError, EOFError) as error:
+            failures.append((path, repr(error)))
+            continue
+
+        page_type = get_page_type(url)
+        extractor = REPROCESS_EXTRACTORS.get(page_type)
+        if extractor is None:
+            skipped += 1
+            continue
+
+        try:
+            outputs.append((page_type, url, extractor(url, make_soup(html, page_type=page_type))))
+        except Exception as error:
+            failures.append((url, repr(error)))
+    return outputs, failures, skipped
+
+
+def _chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def reprocess_cache(output_dir, cache_dir=CACHE_DIR, workers=None, chunk_size=200, report_every=10.0):
+    """
+    Reparses every cached page into output_dir using all cores.  Returns a summary dict with page counts and pages per second.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+
+    output_files = {page_type: open(os.path.join(output_dir, f"{page_type}.jsonl"), 'w', encoding='utf-8') for page_type in REPROCESS_EXTRACTORS}
+    failures_file = open(os.path.join(output_dir, 'failures.jsonl'), 'w', encoding='utf-8')
+
+    counts = {'parsed': 0, 'failed': 0, 'skipped': 0}
+    start = time.perf_counter()
+    last_report = start
+
+    def collect(future):
+        outputs, failures, skipped = future.result()
+        for page_type, url, data in outputs:
+            output_files[page_type].write(json.dumps({'url': url, 'data': data}) + '\n')
+        for url, error in failures:
+            failures_file.write(json.dumps({'url': url, 'error': error}) + '\n')
+        counts['parsed'] += len(outputs)
+        counts['failed'] += len(failures)
+        counts['skipped'] += skipped
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for chunk in _chunks(HtmlCache(cache_dir).iter_entry_paths(), chunk_size):
+                # Keep a couple of chunks queued per worker without listing the whole cache up front
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                in_flight.add(executor.submit(reprocess_chunk, chunk))
+
+                now = time.perf_counter()
+                if now - last_report >= report_every:
+                    total = sum(counts.values())
+                    print(f"{total} pages, {total / (now - start):.1f} pages/sec, {counts['failed']} failed")
+                    last_report = now
+
+            for future in in_flight:
+                collect(future)
+    finally:
+        for file in output_files.values():
+            file.close()
+        failures_file.close()
+
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    summary = dict(counts, pages=total, seconds=round(elapsed, 3), pages_per_sec=round(total / elapsed, 1) if elapsed else 0.0)
+    print(f"Reprocessed {total} pages in {elapsed:.1f}s ({summary['pages_per_sec']} pages/sec).  {counts['parsed']} parsed, {counts['failed']} failed, {counts['skipped']} skipped.")
+    return summary
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('output_dir')
+    arg_parser.add_argument('--cache-dir', default=CACHE_DIR)
+    arg_parser.add_argument('--workers', type=int, default=None)
+    arg_parser.add_argument('--chunk-size', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    reprocess_cache(args.output_dir, args.cache_dir, args.workers, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
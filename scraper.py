@@ -3,161 +3,499 @@ import datetime as dt
 from utilities import *
 from match_parser import *
 from player_stats import *
-# from match_stats import *
+from journal import MatchJournal
+from columnar import flatten_match_player_stats, PlayerStatsParquetWriter
+from pipeline import StatPipeline
+from registry import flush_registries
+from metrics import metrics, write_run_report
+from match_stats import *
+from extraction import RESULTS_PAGE_SPEC, RESULTS_HOLDER_SPEC, RESULT_SPEC
+
+MATCH_LIST_CSV = os.path.join('data', 'match_list.csv')
+
+@metrics.timed('extract', 'results')
+def parse_results_page(results_page_html, results_url):
+    """
+    Gets matches listed on one results page and the url of the next page (None on the last page).
+    List format: ['ID', 'DATE', 'TITLE', 'URL', 'TEAMS', 'WINNER', 'SCORE']
+    """
+    match_list = []
+
+    page = RESULTS_PAGE_SPEC.scan(results_page_html)
+
+    for match in RESULTS_HOLDER_SPEC.scan(page['results_holder'])['results']:
+        result = RESULT_SPEC.scan(match)
+        match_url = "https://www.hltv.org" + result['link']['href']
+        match_id, match_title = get_match_id_title(match_url)
+        match_date_unix = match['data-zonedgrouping-entry-unix']
+        match_date = dt.datetime.fromtimestamp(int(match_date_unix)/1000).strftime('%Y-%m-%d')
+
+        # Extract the scores from the HTML code
+        scores = result['scores']
+        try:
+            team1_score = int(scores[0].text)
+            team2_score = int(scores[1].text)
+        except:
+            team1_score, team2_score = None, None
+            print("Error at: ", match_url, ",  ", results_url)
+        score = (team1_score, team2_score)
+
+        # Determine the winner of the match
+        teams_html = result['teams']
+        team1_name = teams_html[0].text.strip()
+        team2_name = teams_html[1].text.strip()
+        teams = (team1_name, team2_name)
 
-def scrape_match_list(start_date, end_date, sleep_time = 0.05, update_csv=True):
+        if team1_score > team2_score:
+            winner = 'team1'
+        elif team2_score > team1_score:
+            winner = 'team2'
+        else:
+            winner = 'tie'
+
+        match_list.append([match_id, match_date, match_title, match_url, teams, winner, score])
+
+    try:
+        next_page_url = "https://www.hltv.org" + page['next_page']['href']
+    except:
+        next_page_url = None
+
+    return match_list, next_page_url
+
+
+def iter_results_pages(start_date, end_date, sleep_time = 0.05, known_ids = None):
     """
-    Gets list of all matches in date range.  List format: ['ID', 'DATE', 'TITLE', 'URL', 'TEAMS', 'WINNER', 'SCORE']
-    Saves to csv by default.
-    Does not check if matches within date range are already saved.
+    Follows the results pagination for one date range and yields the matches of each page as soon as it is parsed, in HLTV's order (newest first).
+    If known_ids is given, stops at the first match whose ID is in it.  Since results are newest first, everything after it is already known.
     """
+    results_url = f"https://www.hltv.org/results?startDate={start_date}&endDate={end_date}"
 
-    check_date_range(start_date, end_date)
+    while results_url is not None:
+        results_page_html = get_page_html(results_url, sleep_time = sleep_time)
+        page_matches, results_url = parse_results_page(results_page_html, results_url)
+
+        if known_ids is not None:
+            for i, match in enumerate(page_matches):
+                if match[0] in known_ids:
+                    page_matches = page_matches[:i]
+                    results_url = None
+                    break
+
+        yield page_matches
+
+
+def crawl_results_pages(start_date, end_date, sleep_time = 0.05, known_ids = None):
+    """
+    Follows the results pagination for one date range and returns all matches found, in HLTV's order (newest first).
+    If known_ids is given, stops at the first match whose ID is in it.
+    """
+    return [match for page_matches in iter_results_pages(start_date, end_date, sleep_time, known_ids) for match in page_matches]
+
+
+def split_date_range(start_date, end_date, shard_days):
+    """
+    Splits [start_date, end_date] into consecutive, non-overlapping ranges of at most shard_days days.  Returns list of (start, end) strings.
+    """
+    if not isinstance(shard_days, int) or shard_days < 1:
+        raise ValueError("shard_days must be an integer of at least 1")
 
     start_date_dt = dt.datetime.strptime(start_date, '%Y-%m-%d')
     end_date_dt = dt.datetime.strptime(end_date, '%Y-%m-%d')
+
+    shards = []
+    shard_start = start_date_dt
+    while shard_start <= end_date_dt:
+        shard_end = min(shard_start + dt.timedelta(days=shard_days - 1), end_date_dt)
+        shards.append((shard_start.strftime('%Y-%m-%d'), shard_end.strftime('%Y-%m-%d')))
+        shard_start = shard_end + dt.timedelta(days=1)
+    return shards
+
+
+def merge_match_lists(match_lists):
+    """
+    Merges match lists, keeping the first copy of each match ID.  Result is ordered newest first, like the results pages.
+    """
+    seen_ids = set()
+    merged = []
+    for match_list in match_lists:
+        for match in match_list:
+            if match[0] not in seen_ids:
+                seen_ids.add(match[0])
+                merged.append(match)
+
+    # Stable sort keeps HLTV's order for matches on the same date
+    merged.sort(key=lambda match: match[1], reverse=True)
+    return merged
+
+
+def warn_rating_change(start_date, end_date):
+    start_date_dt = dt.datetime.strptime(start_date, '%Y-%m-%d')
+    end_date_dt = dt.datetime.strptime(end_date, '%Y-%m-%d')
     feb_2016_dt = dt.datetime.strptime("2016-02-01", '%Y-%m-%d')
 
     if start_date_dt <= feb_2016_dt <= end_date_dt:
         print("Warning: 2016-02-01 is between the start and end dates. HLTV changed player rating systems on 2016-02-01, some player stats may not be consistently measured over this date range.")
 
-    results_url = f"https://www.hltv.org/results?startDate={start_date}&endDate={end_date}"
 
-    match_list = []
+def iter_matches(start_date, end_date, sleep_time = 0.05, update_csv=False):
+    """
+    Yields each match in date range as soon as its results page is parsed, newest first.  Same format as scrape_match_list.
+    Only one results page is held in memory, so e.g. scrape_stat_range(iter_matches(...), 30) starts scraping stats before the crawl finishes.
+    A match pushed onto the next page by newly added results is yielded once.
+    With update_csv, each page is appended to the match list csv before its matches are yielded.
+    """
 
-    next_page_exists = True
-    while next_page_exists:
+    check_date_range(start_date, end_date)
+    warn_rating_change(start_date, end_date)
 
-        results_page_html = get_page_html(results_url, sleep_time = sleep_time)
-        results_holder = results_page_html.find('div', {'class':'results-holder allres'})
-        match_list_htmls = results_holder.find_all('div', {'class':'result-con'})
+    seen_ids = set()
+    for page_matches in iter_results_pages(start_date, end_date, sleep_time):
+        page_matches = [match for match in page_matches if match[0] not in seen_ids]
+        seen_ids.update(match[0] for match in page_matches)
 
-        for match in match_list_htmls:
-            match_url = "https://www.hltv.org" + match.find('a', {'class':'a-reset'})['href']
-            match_id, match_title = get_match_id_title(match_url)
-            match_date_unix = match['data-zonedgrouping-entry-unix']
-            match_date = dt.datetime.fromtimestamp(int(match_date_unix)/1000).strftime('%Y-%m-%d')
+        if update_csv and page_matches:
+            update_csv_file(MATCH_LIST_CSV, page_matches, ['id', 'date', 'title', 'url', 'teams', 'winner', 'score'], quiet=True)
 
-            # Extract the scores from the HTML code
-            scores = match.find_all('span', {'class': ['score-lost', 'score-won', 'score-tie']})
-            try:
-                team1_score = int(scores[0].text)
-                team2_score = int(scores[1].text)
-            except:
-                team1_score, team2_score = None, None
-                print("Error at: ", match_url, ",  ", results_url)
-            score = (team1_score, team2_score)
-
-            # Determine the winner of the match
-            teams_html = match.find_all('div', {'class': 'team'})
-            team1_name = teams_html[0].text.strip()
-            team2_name = teams_html[1].text.strip()
-            teams = (team1_name, team2_name)
-
-            if team1_score > team2_score:
-                winner = 'team1'
-            elif team2_score > team1_score:
-                winner = 'team2'
-            else:
-                winner = 'tie'
-
-            match_list.append([match_id, match_date, match_title, match_url, teams, winner, score])
+        yield from page_matches
 
-        try:
-            next_page_url = "https://www.hltv.org" + results_page_html.find('a', {'class':'pagination-next'})['href']
-            results_url = next_page_url
-        except:
-            next_page_exists = False
+
+def scrape_match_list(start_date, end_date, sleep_time = 0.05, update_csv=True, shard_days=None, max_workers=1):
+    """
+    Gets list of all matches in date range.  List format: ['ID', 'DATE', 'TITLE', 'URL', 'TEAMS', 'WINNER', 'SCORE']
+    Saves to csv by default.
+    Does not check if matches within date range are already saved.
+    With shard_days set, the range is split into shards of that many days whose results pages are crawled concurrently by max_workers threads, under the global rate limit.
+    See iter_matches for a streaming version.
+    """
+
+    check_date_range(start_date, end_date)
+    warn_rating_change(start_date, end_date)
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError("max_workers must be an integer of at least 1")
+
+    if shard_days is None:
+        match_list = crawl_results_pages(start_date, end_date, sleep_time)
+    else:
+        shards = split_date_range(start_date, end_date, shard_days)
+        print(f"Crawling {len(shards)} date shards of up to {shard_days} days.")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            shard_match_lists = list(executor.map(lambda shard: crawl_results_pages(shard[0], shard[1], sleep_time), shards))
+        match_list = merge_match_lists(shard_match_lists)
 
     if update_csv:
-        update_csv_file('data\match_list.csv', match_list, ['id', 'date', 'title', 'url', 'teams', 'winner', 'score'])
+        update_csv_file(MATCH_LIST_CSV, match_list, ['id', 'date', 'title', 'url', 'teams', 'winner', 'score'])
 
     return match_list
 
 
-def scrape_stat_range(match_list, player_stat_range, return_output=False, sleep_time = 0.05, update_stats_csv = True, update_players_csv = True, update_teams_csv = True):
+def get_match_list_high_water_mark(match_list_csv = MATCH_LIST_CSV):
+    """
+    Returns (latest_date, latest_ids) for a stored match list, where latest_ids are the IDs saved on latest_date.  Returns (None, set()) if nothing is stored.
+    """
+    latest_date = None
+    latest_ids = set()
+
+    if not os.path.isfile(match_list_csv):
+        return latest_date, latest_ids
+
+    with open(match_list_csv, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            match_id, match_date = row[0], row[1]
+            if latest_date is None or match_date > latest_date:
+                latest_date = match_date
+                latest_ids = {match_id}
+            elif match_date == latest_date:
+                latest_ids.add(match_id)
+
+    return latest_date, latest_ids
+
+
+def sync_match_list(match_list_csv = MATCH_LIST_CSV, sleep_time = 0.05, update_csv = True):
+    """
+    Gets matches played since the last match stored in match_list_csv and appends them to it.
+    Only crawls results from the latest stored date to today, and stops paginating at the first match ID already stored.
+    Returns the list of new matches, newest first.
+    """
+    latest_date, _ = get_match_list_high_water_mark(match_list_csv)
+    if latest_date is None:
+        raise ValueError(f"No matches stored in '{match_list_csv}'.  Use scrape_match_list for the initial date range.")
+
+    known_ids = get_csv_store(match_list_csv, ['id', 'date', 'title', 'url', 'teams', 'winner', 'score']).ids()
+    today = dt.datetime.now().strftime('%Y-%m-%d')
+
+    print(f"Syncing matches from {latest_date} to {today}.")
+    new_matches = crawl_results_pages(latest_date, today, sleep_time, known_ids=known_ids)
+    print(f"{len(new_matches)} new matches found.")
+
+    if update_csv:
+        update_csv_file(match_list_csv, new_matches, ['id', 'date', 'title', 'url', 'teams', 'winner', 'score'])
+
+    return new_matches
+
+
+def scrape_player_stats_windows_for_matches(matches, windows, sleep_time = 0.05, max_workers = 1, match_windows = None, update_players_csv = False, update_teams_csv = False):
+    """
+    Scrapes player stats for several stats windows (see get_stat_window) prior to each match in matches.  Each match page is fetched once.
+    Every player stats request for the matches and windows is planned first so pages shared between matches or windows are only fetched once.
+    match_windows optionally maps match_id to the windows needed for that match.
+    update_players_csv / update_teams_csv add the rosters and teams of each match to the registries.
+    Matches whose page or any of whose player stats pages could not be fetched are left out, so they are not saved and are scraped again on the next run.
+    Returns OrderedDict of window -> list of [match_id, player_stats].
+    """
+    def match_pages():
+        for match in matches:
+            match_url = match[3]
+            print("-Processing: " + match_url)
+            try:
+                match_html = get_page_html(match_url)
+            except FetchError as error:
+                print(f"ERROR: Match page not fetched, skipping! {error}")
+                continue
+            if update_players_csv or update_teams_csv:
+                register_match_entities(parse_match_page(match_html), players=update_players_csv, teams=update_teams_csv)
+            yield match[0], match_html
+
+    requests, window_match_keys = plan_player_stats_windows(match_pages(), windows, match_windows)
+
+    total_player_slots = sum(len(player_keys) for match_keys in window_match_keys.values() for team_keys in match_keys.values() for player_keys in team_keys.values())
+    print(f"Fetching {len(requests)} unique player stats pages for {total_player_slots} player entries.")
+
+    stats_by_key = fetch_player_stats_requests(requests, sleep_time, max_workers=max_workers)
+
+    window_data = OrderedDict()
+    for window, match_keys in window_match_keys.items():
+        player_stats_by_match = assemble_player_stats(match_keys, stats_by_key)
+        window_data[window] = drop_unfetched_matches([[match_id, player_stats] for match_id, player_stats in player_stats_by_match.items()])
+    return window_data
+
+
+def scrape_player_stats_for_matches(matches, player_stat_range, sleep_time = 0.05, max_workers = 1, update_players_csv = False, update_teams_csv = False):
+    """
+    Scrapes player stats player_stat_range days prior to each match in matches.  Returns list of [match_id, player_stats].
+    Every player stats request for the matches is planned first so pages shared between matches are only fetched once.
+    """
+    window = get_stat_window(player_stat_range)
+    return scrape_player_stats_windows_for_matches(matches, [window], sleep_time, max_workers, update_players_csv=update_players_csv, update_teams_csv=update_teams_csv)[window]
+
+
+def get_stats_csv_filename(player_stat_range, on_maps = None):
+    """
+    Stats csv for a window, e.g. data/match_player_stats_prev_30.csv, or data/match_player_stats_prev_30_de_inferno.csv with on_maps=['de_inferno'].
+    """
+    player_stat_range, maps = get_stat_window(player_stat_range, on_maps)
+    maps_suffix = '' if maps is None else '_' + '_'.join(maps)
+    return os.path.join('data', f"match_player_stats_prev_{player_stat_range}{maps_suffix}.csv")
+
+
+def load_saved_match_ids(stats_csv, journal = None, update_stats_csv = True):
+    """
+    Set of match IDs already saved for a stats csv.  Matches committed to the journal but missing from the csv are written to the csv first.
+    """
+    saved_match_ids = get_csv_store(stats_csv, ['id', 'stats']).ids()
+
+    if journal is not None:
+        recovered = [[match_id, OrderedDict(data)] for match_id, data in journal.iter_records() if match_id not in saved_match_ids]
+        if recovered and update_stats_csv:
+            print(f"Recovering {len(recovered)} matches from {journal.filename}.")
+            update_csv_file(stats_csv, recovered, ['id', 'stats'])
+        saved_match_ids = saved_match_ids | journal.completed_ids()
+
+    return saved_match_ids
+
+
+def count_new_matches(match_list, saved_match_ids, stats_csv):
+    """
+    Prints how many matches of match_list are already saved in stats_csv and returns how many are new.
+    Returns None for iterables other than lists and tuples, which are read lazily and not counted up front.
+    """
+    if not isinstance(match_list, (list, tuple)):
+        print("Processing new matches as the match list is read.")
+        return None
+
+    total_saved_new_matches = sum(1 for match in match_list if match[0] in saved_match_ids)
+    total_new = len(match_list) - total_saved_new_matches
+
+    print(f"Input match list contains {len(match_list)} matches.")
+    if os.path.exists(stats_csv):
+        print(f"{total_saved_new_matches} of match list already saved in {stats_csv}.")
+    print(f"Processing {total_new} new matches.")
+    return total_new
+
+
+def select_new_matches(match_list, saved_match_ids, match_dates):
+    """
+    Yields the matches of match_list not in saved_match_ids, skipping duplicates.  The date of each yielded match is added to match_dates.
+    """
+    for match in match_list:
+        if match[0] in saved_match_ids or match[0] in match_dates:
+            continue
+        match_dates[match[0]] = match[1]
+        yield match
+
+
+def make_commit(stats_csv, player_stat_range, on_maps=None, journal=None, update_stats_csv=True, parquet_writer=None, match_dates=None, output=None):
+    """
+    Returns commit(chunk_data), which saves a chunk of [match_id, player_stats] for one stats window.
+    Chunks go to the journal if given, then the stats csv, then parquet_writer (rows dated from match_dates), and are appended to the output list if given.
+    """
+    def commit(chunk_data):
+        # Journal first, then csv, so a crash between the two is recovered on the next run
+        if journal is not None:
+            with metrics.timer('write', 'journal', len(chunk_data)):
+                for match_id, player_stats in chunk_data:
+                    journal.append(match_id, player_stats)
+        if update_stats_csv:
+            with metrics.timer('write', 'csv', len(chunk_data)):
+                update_csv_file(stats_csv, chunk_data, ['id', 'stats'])
+        if parquet_writer is not None:
+            with metrics.timer('write', 'parquet', len(chunk_data)):
+                parquet_writer.write(flatten_match_player_stats(chunk_data, match_dates, player_stat_range, on_maps))
+        if output is not None:
+            output.extend(chunk_data)
+
+    return commit
+
+
+def scrape_stat_range(match_list, player_stat_range, return_output=False, sleep_time = 0.05, update_stats_csv = True, update_players_csv = True, update_teams_csv = True, max_workers = 1, stream = False, chunk_size = 10, parquet_output = False, pipeline = False, parse_workers = None, metrics_report = None):
     """
     Scrapes player stats player_stat_range days prior to each match in match_list.
+    match_list can also be any iterable of match list rows, e.g. iter_matches(start_date, end_date).  It is then read lazily and committed chunk_size matches at a time as in stream mode, without the journal unless stream is set.
     Saves to csv by default.
+    max_workers sets how many player stats requests are kept in flight at once, all under the global rate limit (see rate_limiter.set_rate_limit).
+    update_players_csv / update_teams_csv add the players and teams of each match to data/players.csv and data/teams.csv through the registries (see registry.py).
+    stream=True commits matches chunk_size at a time to an append-only journal and the stats csv, so an interrupted run resumes where it stopped.
+    parquet_output=True also writes one row per (match, team, player) to the parquet dataset in columnar.PARQUET_DIR, buffered across chunks (see columnar.PlayerStatsParquetWriter).  The csv stays the record of which matches are done.
+    pipeline=True runs fetching (max_workers threads), parsing (parse_workers processes) and writing as overlapping stages, see pipeline.StatPipeline.  Implies stream.
+    metrics_report is a filename for the JSON run report (see metrics.py), covering fetch latency, retries, cache hits, parse and write times.
     Stats must be retrieved as ordered dict to keep team1/team2 consistent.
     """
 
     start_timer()
+    metrics.reset()
     print(f"Getting player stats for {player_stat_range} days prior to each match.")
     print()
 
-    stats_csv = f"data\match_player_stats_prev_{player_stat_range}.csv"
-
+    stats_csv = get_stats_csv_filename(player_stat_range)
 
-    # Pull list of match IDs from csv
-    matches_ids_from_file = []
-    if os.path.exists(stats_csv):
-        with open(stats_csv, 'r') as csvfile:
-            csvreader = csv.reader(csvfile)
-            next(csvreader)
-            for row in csvreader:
-                matches_ids_from_file.append(row[0])
-
-    # Pull list of player IDs from csv
-    if update_players_csv:
-        players_csv = "data\players.csv"
-        player_ids_from_file = []
-        if os.path.exists(players_csv):
-            with open(players_csv, 'r') as csvfile:
-                csvreader = csv.reader(csvfile)
-                next(csvreader)
-                for row in csvreader:
-                    player_ids_from_file.append(row[0])
-
-
-    # Pull list of team IDs from csv
-    if update_teams_csv:
-        teams_csv = "data\teams.csv"
-        team_ids_from_file = []
-        if os.path.exists(teams_csv):
-            with open(teams_csv, 'r') as csvfile:
-                csvreader = csv.reader(csvfile)
-                next(csvreader)
-                for row in csvreader:
-                    team_ids_from_file.append(row[0])
-
-
-
-    new_match_ids = [match[0] for match in match_list if match[0] not in matches_ids_from_file]
-    saved_new_match_ids = [match[0] for match in match_list if match[0] in matches_ids_from_file]
-    new_matches = [match for match in match_list if match[0] in new_match_ids]
-
-    total_matches = len(match_list)
-    total_new = len(new_match_ids)
-    total_saved_new_matches = len(saved_new_match_ids)
-
-    print(f"Input match list contains {total_matches} matches.")
+    stream = stream or pipeline
 
-    if os.path.exists(stats_csv):
-        print(f"{total_saved_new_matches} of match list already saved in {stats_csv}.")
+    # Pull list of match IDs from csv, recovering matches committed to the journal but not yet written to the csv
+    journal = MatchJournal(stats_csv + '.journal') if stream else None
+    matches_ids_from_file = load_saved_match_ids(stats_csv, journal, update_stats_csv)
 
-    print(f"Processing {total_new} new matches.")
 
+    # Lists are counted up front.  Any other iterable (e.g. iter_matches) is read lazily, chunk_size matches at a time.
+    total_new = count_new_matches(match_list, matches_ids_from_file, stats_csv)
+    match_dates = {}
+    new_matches = select_new_matches(match_list, matches_ids_from_file, match_dates)
 
     match_player_data = []
+    # Parquet rows are buffered across commits so each partition gets a few large files
+    parquet_writer = PlayerStatsParquetWriter() if parquet_output else None
+    commit = make_commit(stats_csv, player_stat_range, journal=journal, update_stats_csv=update_stats_csv, parquet_writer=parquet_writer, match_dates=match_dates, output=match_player_data if return_output else None)
+
+    try:
+        if pipeline:
+            record_fn = None
+            if update_players_csv or update_teams_csv:
+                record_fn = lambda record: register_match_entities(record, players=update_players_csv, teams=update_teams_csv)
+            stat_pipeline = StatPipeline(player_stat_range, commit, fetch_workers=max_workers, parse_workers=parse_workers, write_batch_size=chunk_size, sleep_time=sleep_time, record_fn=record_fn)
+            failed_match_ids = stat_pipeline.run(new_matches)
+            if failed_match_ids:
+                print(f"{len(failed_match_ids)} matches failed: {failed_match_ids}")
+
+        elif not stream and total_new is not None:
+            commit(scrape_player_stats_for_matches(list(new_matches), player_stat_range, sleep_time, max_workers, update_players_csv, update_teams_csv))
+
+        else:
+            committed = 0
+            for chunk in iter_chunks(new_matches, chunk_size):
+                commit(scrape_player_stats_for_matches(chunk, player_stat_range, sleep_time, max_workers, update_players_csv, update_teams_csv))
+                flush_registries()
+                committed += len(chunk)
+                print(f"Committed {committed} of {total_new if total_new is not None else 'unknown'} matches.")
+    finally:
+        if parquet_writer is not None:
+            with metrics.timer('write', 'parquet'):
+                parquet_writer.flush()
+
+    flush_registries(quiet=False)
+
+    if metrics_report is not None:
+        write_run_report(metrics_report)
 
-    for match in new_matches:
+    print()
+    end_timer()
 
-        match_url = match[3]
-        match_id = get_match_id_title(match_url)[0]
+    if return_output:
+        return match_player_data
+
+
+def scrape_stat_ranges(match_list, windows, return_output=False, sleep_time = 0.05, update_stats_csv = True, update_players_csv = True, update_teams_csv = True, max_workers = 1, chunk_size = 10, parquet_output = False, metrics_report = None):
+    """
+    Scrapes player stats for several windows in one pass, e.g. windows=[7, 30, 90] or [30, (30, ['de_inferno', 'de_nuke'])].
+    Each match page is fetched once and player stats requests are planned across all windows, sharing the cache and deduplication between them.
+    Each window is saved to its own stats csv (see get_stats_csv_filename), and only windows missing a match are scraped for it.
+    Matches are committed chunk_size at a time through each window's journal, so an interrupted run resumes where it stopped.
+    metrics_report is a filename for the JSON run report, as in scrape_stat_range.
+    Returns OrderedDict of window -> list of [match_id, player_stats] if return_output.
+    """
+
+    start_timer()
+    metrics.reset()
+    windows = list(OrderedDict.fromkeys(get_stat_window(window) for window in windows))
+    print(f"Getting player stats for {len(windows)} windows prior to each match: {', '.join(get_stats_csv_filename(*window) for window in windows)}")
+    print()
+
+    stats_csvs = {window: get_stats_csv_filename(*window) for window in windows}
+    journals = {window: MatchJournal(stats_csvs[window] + '.journal') for window in windows}
+    saved_match_ids = {window: load_saved_match_ids(stats_csvs[window], journals[window], update_stats_csv) for window in windows}
+
+    match_windows = OrderedDict()
+    for match in match_list:
+        needed = [window for window in windows if match[0] not in saved_match_ids[window]]
+        if needed:
+            match_windows[match[0]] = needed
+
+    new_matches = [match for match in match_list if match[0] in match_windows]
+    match_dates = {match[0]: match[1] for match in new_matches}
 
+    print(f"Input match list contains {len(match_list)} matches.")
+    for window in windows:
+        total_new = sum(window in needed for needed in match_windows.values())
+        print(f"{len(match_list) - total_new} of match list already saved in {stats_csvs[window]}, {total_new} new.")
+    print(f"Processing {len(new_matches)} matches.")
 
-        print("-Processing: " + match_url)
-        match_html = get_page_html(match_url)
+    window_output = OrderedDict((window, []) for window in windows)
+    parquet_writer = PlayerStatsParquetWriter() if parquet_output else None
+    commits = {window: make_commit(stats_csvs[window], *window, journal=journals[window], update_stats_csv=update_stats_csv, parquet_writer=parquet_writer, match_dates=match_dates, output=window_output[window] if return_output else None) for window in windows}
 
-        player_stats = get_player_stats_prior_to_match(match_html, player_stat_range, sleep_time)
-        match_player_data.append([match[0], player_stats])
+    try:
+        for i in range(0, len(new_matches), chunk_size):
+            window_data = scrape_player_stats_windows_for_matches(new_matches[i:i+chunk_size], windows, sleep_time, max_workers, match_windows, update_players_csv, update_teams_csv)
 
-    if update_stats_csv:
-        update_csv_file(stats_csv, match_player_data, ['id', 'stats'])
+            for window, chunk_data in window_data.items():
+                if chunk_data:
+                    commits[window](chunk_data)
+
+            flush_registries()
+            print(f"Committed {min(i + chunk_size, len(new_matches))} of {len(new_matches)} matches.")
+    finally:
+        if parquet_writer is not None:
+            with metrics.timer('write', 'parquet'):
+                parquet_writer.flush()
+
+    flush_registries(quiet=False)
+
+    if metrics_report is not None:
+        write_run_report(metrics_report)
 
     print()
     end_timer()
 
     if return_output:
-        return match_player_data
+        return window_output
@@ -0,0 +1,267 @@
+import csv
+import datetime as dt
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from player_stats import get_stats_date_range, normalize_maps
+
+# Columns of a per-map player stats row, as written by match_stats
+MAP_STAT_COLUMNS = ['player_id', 'date', 'map', 'rounds', 'kills', 'deaths', 'assists', 'headshots', 'adr', 'kast', 'rating']
+
+# Counted columns are summed, averaged columns are averaged weighted by rounds.  A missing value is stored as nan and left out of its sums.
+COUNT_COLUMNS = ['rounds', 'kills', 'deaths', 'assists', 'headshots']
+AVERAGE_COLUMNS = ['adr', 'kast', 'rating']
+
+# Name of the rating field in get_player_stats_block output ("Rating 2.0")
+RATING_FIELD = 'rating_2'
+
+# Keys are player_code * DAY_SPAN + day, so one sorted array covers every player's timeline
+DAY_SPAN = 1 << 20
+EPOCH = dt.date(1970, 1, 1)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for local stat aggregation.  Install it with 'pip install numpy'.")
+
+
+def to_day(date):
+    """
+    Days since 1970-01-01 for a 'yyyy-mm-dd' string, date or datetime.
+    """
+    if isinstance(date, str):
+        date = dt.datetime.strptime(date[:10], '%Y-%m-%d').date()
+    elif isinstance(date, dt.datetime):
+        date = date.date()
+    return (date - EPOCH).days
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return float('nan')
+    if isinstance(value, str) and value.endswith('%'):
+        return float(value[:-1]) / 100
+    return float(value)
+
+
+class _PrefixIndex:
+    """
+    Rows sorted by key with prefix sums of every stat column.  The sum of a column over rows lo:hi is prefix[hi] - prefix[lo].
+    """
+
+    def __init__(self, keys, columns):
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.prefix = {}
+
+        rounds = columns['rounds'][order]
+        self.prefix['maps'] = np.arange(len(order) + 1, dtype=np.float64)
+        for name in COUNT_COLUMNS:
+            values = columns[name][order]
+            self.prefix[name] = self._cumsum(np.where(np.isnan(values), 0.0, values))
+        for name in AVERAGE_COLUMNS:
+            values = columns[name][order]
+            present = ~np.isnan(values) & ~np.isnan(rounds)
+            self.prefix[name] = self._cumsum(np.where(present, values * rounds, 0.0))
+            self.prefix[name + '_rounds'] = self._cumsum(np.where(present, rounds, 0.0))
+        # Headshot percentage is only meaningful over maps where headshots were recorded
+        headshots = columns['headshots'][order]
+        kills = columns['kills'][order]
+        self.prefix['headshot_kills'] = self._cumsum(np.where(np.isnan(headshots) | np.isnan(kills), 0.0, kills))
+
+    @staticmethod
+    def _cumsum(values):
+        prefix = np.zeros(len(values) + 1, dtype=np.float64)
+        np.cumsum(values, out=prefix[1:])
+        return prefix
+
+    def sums(self, lo_keys, hi_keys):
+        """
+        Column sums over the rows with lo_key <= key <= hi_key, for arrays of bounds.
+        """
+        lo = np.searchsorted(self.keys, lo_keys, side='left')
+        hi = np.searchsorted(self.keys, hi_keys, side='right')
+        return {name: prefix[hi] - prefix[lo] for name, prefix in self.prefix.items()}
+
+
+class StatAggregator:
+    """
+    Per-map player stat rows held as time sorted numpy arrays.
+    Answers "stats from start_date to end_date" for many players at once with binary searches and prefix sums, giving the fields of get_player_stats_block that can be derived from map scoreboards.
+    Rows are added with add_rows (MAP_STAT_COLUMNS dicts) and indexed on the first query after a change.
+    """
+
+    def __init__(self, rows=None):
+        _require_numpy()
+        self._pending = []
+        self._columns = None
+        self._player_codes = {}
+        self._map_codes = {}
+        self._index = None
+        self._map_index = None
+        if rows is not None:
+            self.add_rows(rows)
+
+    def __len__(self):
+        existing = 0 if self._columns is None else len(self._columns['day'])
+        return existing + len(self._pending)
+
+    def add_rows(self, rows):
+        """
+        Adds per-map player stat rows.  Each row is a mapping or named tuple (e.g. match_stats.MapPlayerStats) with the keys in MAP_STAT_COLUMNS, date as 'yyyy-mm-dd', date or datetime.
+        """
+        for row in rows:
+            self._pending.append(row._asdict() if hasattr(row, '_asdict') else row)
+        if self._pending:
+            self._index = None
+            self._map_index = None
+
+    def _code(self, codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def _build(self):
+        if self._index is not None:
+            return
+
+        if self._pending:
+            new_columns = {
+                'player': np.array([self._code(self._player_codes, str(row['player_id'])) for row in self._pending], dtype=np.int64),
+                'map': np.array([self._code(self._map_codes, row['map']) for row in self._pending], dtype=np.int64),
+                'day': np.array([to_day(row['date']) for row in self._pending], dtype=np.int64),
+            }
+            for name in COUNT_COLUMNS + AVERAGE_COLUMNS:
+                new_columns[name] = np.array([_to_float(row.get(name)) for row in self._pending], dtype=np.float64)
+
+            if self._columns is None:
+                self._columns = new_columns
+            else:
+                self._columns = {name: np.concatenate([self._columns[name], new_columns[name]]) for name in self._columns}
+            self._pending = []
+
+        if self._columns is None:
+            self._columns = {name: np.zeros(0, dtype=np.int64 if name in ('player', 'map', 'day') else np.float64) for name in ['player', 'map', 'day'] + COUNT_COLUMNS + AVERAGE_COLUMNS}
+
+        columns = self._columns
+        self._index = _PrefixIndex(columns['player'] * DAY_SPAN + columns['day'], columns)
+        # Second index ordered by (player, map, day) for queries restricted to some maps
+        map_count = max(len(self._map_codes), 1)
+        self._map_index = _PrefixIndex((columns['player'] * map_count + columns['map']) * DAY_SPAN + columns['day'], columns)
+
+    def window_sums(self, player_ids, start_dates, end_dates, on_maps=None):
+        """
+        Raw column sums for each (player_id, start_date, end_date) triple, both dates inclusive.  Returns a dict of column -> numpy array.
+        """
+        self._build()
+
+        # Unknown players get a code with no rows
+        unknown = len(self._player_codes)
+        codes = np.array([self._player_codes.get(str(player_id), unknown) for player_id in player_ids], dtype=np.int64)
+        start_days = np.array([to_day(date) for date in start_dates], dtype=np.int64)
+        end_days = np.array([to_day(date) for date in end_dates], dtype=np.int64)
+
+        maps = normalize_maps(on_maps)
+        if maps is None:
+            return self._index.sums(codes * DAY_SPAN + start_days, codes * DAY_SPAN + end_days)
+
+        map_count = max(len(self._map_codes), 1)
+        totals = None
+        for map_name in maps:
+            map_code = self._map_codes.get(map_name)
+            if map_code is None:
+                continue
+            segment = (codes * map_count + map_code) * DAY_SPAN
+            sums = self._map_index.sums(segment + start_days, segment + end_days)
+            totals = sums if totals is None else {name: totals[name] + sums[name] for name in totals}
+        if totals is None:
+            zeros = np.zeros(len(codes), dtype=np.float64)
+            totals = {name: zeros for name in self._index.prefix}
+        return totals
+
+    def window_stats(self, player_ids, start_dates, end_dates, on_maps=None):
+        """
+        Stats for each (player_id, start_date, end_date) triple, in the field names of get_player_stats_block.
+        Returns a list with a dict per query, or None where the player has no maps in the window.
+        """
+        sums = self.window_sums(player_ids, start_dates, end_dates, on_maps)
+        fields = derive_stat_fields(sums)
+        stats = []
+        for i in range(len(player_ids)):
+            if sums['maps'][i] == 0:
+                stats.append(None)
+            else:
+                stats.append({name: float(values[i]) for name, values in fields.items() if not np.isnan(values[i])})
+        return stats
+
+    def player_window_stats(self, player_id, start_date, end_date, on_maps=None):
+        """
+        Stats for one player from start_date to end_date (inclusive), or None if they played no maps in the window.
+        """
+        return self.window_stats([player_id], [start_date], [end_date], on_maps)[0]
+
+    def stats_prior_to_match(self, rosters, match_date_dt, player_stat_range, on_maps=None):
+        """
+        Local version of get_player_stats_prior_to_match for match rosters (team_id -> list of player_id or (player_id, nickname)).
+        Uses the same window as the player stats pages, the day before to player_stat_range days before the match.
+        """
+        start_date, end_date = get_stats_date_range(match_date_dt, player_stat_range)
+
+        slots = []
+        for team_id, roster in rosters.items():
+            for player in roster:
+                player_id = player[0] if isinstance(player, (tuple, list)) else player
+                slots.append((team_id, str(player_id)))
+
+        stats = self.window_stats([player_id for _, player_id in slots], [start_date] * len(slots), [end_date] * len(slots), on_maps)
+
+        player_stats = OrderedDict((team_id, {}) for team_id in rosters)
+        for (team_id, player_id), player_window_stats in zip(slots, stats):
+            player_stats[team_id][player_id] = player_window_stats
+        return player_stats
+
+
+def derive_stat_fields(sums):
+    """
+    Turns window sums into get_player_stats_block fields.  Ratios with a zero denominator are nan.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rounds = sums['rounds']
+        fields = OrderedDict()
+        fields[RATING_FIELD] = sums['rating'] / sums['rating_rounds']
+        fields['dpr'] = sums['deaths'] / rounds
+        fields['kast'] = sums['kast'] / sums['kast_rounds']
+        fields['adr'] = sums['adr'] / sums['adr_rounds']
+        fields['kpr'] = sums['kills'] / rounds
+        fields['total_kills'] = sums['kills']
+        fields['headshot_percent'] = sums['headshots'] / sums['headshot_kills']
+        fields['total_deaths'] = sums['deaths']
+        fields['kd_ratio'] = sums['kills'] / sums['deaths']
+        fields['damage_per_round'] = fields['adr']
+        fields['maps_played'] = sums['maps']
+        fields['rounds_played'] = rounds
+        fields['kills_per_round'] = fields['kpr']
+        fields['assists_per_round'] = sums['assists'] / rounds
+        fields['deaths_per_round'] = fields['dpr']
+    return fields
+
+
+def load_map_stats_csv(filename):
+    """
+    Reads per-map player stat rows from a csv with MAP_STAT_COLUMNS (any case) in its header.
+    """
+    with open(filename, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        return [{key.lower(): value for key, value in row.items()} for row in reader]
+
+
+def build_stat_aggregator(filename):
+    """
+    StatAggregator over a per-map player stats csv.
+    """
+    return StatAggregator(load_map_stats_csv(filename))
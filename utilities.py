@@ -1,5 +1,6 @@
 import os
 import csv
+import threading
 import datetime as dt
 
 def start_timer():
@@ -14,52 +15,136 @@ def end_timer():
     runtime = end_time - start_time
     print('Runtime: ', runtime,'\n')
 
+class IndexedCsv:
+    """
+    Append-only csv file with an in-memory index of its first column (the unique ID).
+    The existing IDs are read once, so membership checks are O(1) and appends only write the new rows.
+    The index is reloaded if the file is changed by anything other than this object.
+    """
+
+    def __init__(self, filename, header=None):
+        self.filename = filename
+        self.header = [x.upper() for x in header] if header is not None else None
+        self._ids = None
+        self._file_state = None
+        self._lock = threading.Lock()
+
+    def _current_file_state(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _load(self):
+        self._ids = set()
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r', newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                existing_header = next(reader, None)
+                if existing_header is not None:
+                    # Check if header from existing data matches header for new data
+                    if self.header is None:
+                        self.header = existing_header
+                    elif existing_header != self.header:
+                        raise ValueError(f"Header in file '{self.filename}' does not match header for new data.")
+                for row in reader:
+                    if row:
+                        self._ids.add(row[0])
+        self._file_state = self._current_file_state()
+
+    def _sync(self):
+        if self._ids is None or self._current_file_state() != self._file_state:
+            self._load()
+
+    def __contains__(self, unique_id):
+        with self._lock:
+            self._sync()
+            return unique_id in self._ids
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._ids)
+
+    def ids(self):
+        """
+        Returns a copy of the set of IDs in the file.
+        """
+        with self._lock:
+            self._sync()
+            return set(self._ids)
+
+    def append(self, rows):
+        """
+        Appends rows whose ID is not already in the file, in one write.  Creates the file with its header row if needed.
+        Returns (rows_added, number of rows skipped because their ID already exists).
+        """
+        with self._lock:
+            self._sync()
+
+            if self._file_state is None:
+                if self.header is None:
+                    raise ValueError(f"Header needed to create file '{self.filename}'.")
+                with open(self.filename, 'w', newline='', encoding='utf-8') as file:
+                    csv.writer(file).writerow(self.header)
+
+            rows_added = []
+            skipped = 0
+            for row in rows:
+                if row[0] in self._ids:
+                    skipped += 1
+                    continue
+                self._ids.add(row[0])
+                rows_added.append(row)
+
+            if rows_added:
+                with open(self.filename, 'a', newline='', encoding='utf-8') as file:
+                    csv.writer(file).writerows(rows_added)
+
+            self._file_state = self._current_file_state()
+            return rows_added, skipped
+
+
+# Open indexed csv files, shared so each file's IDs are only read once per session
+_csv_stores = {}
+_csv_stores_lock = threading.Lock()
+
+def get_csv_store(filename, header=None):
+    """
+    Returns the shared IndexedCsv for filename.
+    """
+    key = os.path.abspath(filename)
+    with _csv_stores_lock:
+        store = _csv_stores.get(key)
+        if store is None:
+            store = IndexedCsv(filename, header)
+            _csv_stores[key] = store
+    if header is not None:
+        new_header = [x.upper() for x in header]
+        if store.header is None:
+            store.header = new_header
+        elif store.header != new_header:
+            raise ValueError(f"Header in file '{filename}' does not match header for new data.")
+    return store
+
+
 def update_csv_file(filename, new_data, input_header, quiet=False):
     """
     Updates csv 'filename' by appending nested list 'new_data'.  First row must be unique ID.  Forces uppercase headers.
     """
 
-    new_header = [x.upper() for x in input_header]
+    file_exists = os.path.isfile(filename)
+    store = get_csv_store(filename, input_header)
 
-    # Check if file exists
-    if not os.path.isfile(filename):
-        # Create file with header row
-        header = new_header
-        with open(filename, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(header)
-        if not quiet:
-            print(f"File '{filename}' created with header row.")
-
-    # Read in existing data from file
-    data = []
-    with open(filename, 'r', newline='', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            data.append(row)
-
-        # Check if header from existing data matches header for new data
-        existing_header = data[0]
-        if existing_header != new_header:
-            raise ValueError(f"Header in file '{filename}' does not match header for new data.")
+    data_added, skipped = store.append(new_data)
 
+    if not file_exists and not quiet:
+        print(f"File '{filename}' created with header row.")
 
-    # Check if new data already exists in file
-    new_ids = {row[0] for row in new_data}
-    existing_ids = {row[0] for row in data[1:]}
-    common_ids = new_ids & existing_ids
-    if common_ids:
+    if skipped:
         if not quiet:
-            print(f"{len(common_ids)} IDs already exist in file '{filename}'. Skipping ID's present.")
-
-    # Append new data to file
-    with open(filename, 'a', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        for row in new_data:
-            if row[0] not in existing_ids:
-                writer.writerow(row)
-
-    data_added = [row for row in new_data if row[0] not in existing_ids]
+            print(f"{skipped} IDs already exist in file '{filename}'. Skipping ID's present.")
 
     if not quiet:
         print(f"{len(data_added)} rows written to '{filename}'.")
@@ -70,12 +155,20 @@ def check_id_in_csv(csv_filename, unique_id):
         # print(f"File {csv_filename} does not exist.")
         return False
 
-    with open(csv_filename, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if row[0] == unique_id:
-                return True
-    return False
+    return unique_id in get_csv_store(csv_filename)
+
+def iter_chunks(iterable, size):
+    """
+    Yields lists of up to size items from any iterable, reading it lazily.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 def check_date_range(start_date, end_date):
     # check date format
@@ -0,0 +1,549 @@
+"""
+Work queue for sharing a large player stats backfill between machines.
+
+Usage:
+    python work_queue.py enqueue RANGE [--queue FILE] [--match-list CSV] [--start-date D] [--end-date D]
+    python work_queue.py serve [--queue FILE] [--host HOST] [--port N] [--token T]
+    python work_queue.py worker QUEUE [--range RANGE] [--batch-size N] [--max-workers N] [--worker-id ID] [--token T] [--wait]
+    python work_queue.py export RANGE [--queue FILE] [--parquet]
+    python work_queue.py status [--queue FILE]
+    python work_queue.py retry-failed [--queue FILE]
+
+The coordinator enqueues matches not yet in the stats csv as one task per (match ID, range) in a SQLite queue, and serves the queue over HTTP.
+Workers on any machine claim batches of tasks under a lease, scrape their player stats and report the results.  Leases are renewed while a batch is worked on.
+A lease that runs out (the worker died or lost its connection) puts the task back in the queue, up to MAX_ATTEMPTS claims.
+Results are stored once per (match ID, range), so a task finished by two workers is merged once.
+export appends finished matches to the stats csv (and optionally parquet), skipping match IDs already there, so it can be run any number of times.
+QUEUE for a worker is the queue file on the same machine or the coordinator's url, e.g. http://10.0.0.5:8765.
+serve listens on 127.0.0.1 by default.  To accept workers on other machines use e.g. --host 0.0.0.0, which requires --token.
+"""
+import os
+import csv
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import ipaddress
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from utilities import update_csv_file, get_csv_store
+from rate_limiter import backoff_delay
+from columnar import flatten_match_player_stats, PlayerStatsParquetWriter
+from scraper import MATCH_LIST_CSV, scrape_player_stats_for_matches, get_stats_csv_filename, load_saved_match_ids
+
+QUEUE_FILE = os.path.join('data', 'work_queue.sqlite')
+
+# Seconds a claimed task stays with its worker without a renewal
+LEASE_SECONDS = 600
+
+# Seconds between lease renewals while a worker is busy with a batch
+RENEW_INTERVAL = 60
+
+# Claims of a task before it is marked failed
+MAX_ATTEMPTS = 5
+
+# Matches claimed at once by a worker.  Player stats pages shared inside a batch are fetched once.
+BATCH_SIZE = 10
+
+PORT = 8765
+
+# Connection attempts before a worker gives up on the coordinator
+REMOTE_RETRIES = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    match_id TEXT NOT NULL,
+    stat_range INTEGER NOT NULL,
+    match TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    PRIMARY KEY (match_id, stat_range)
+);
+CREATE INDEX IF NOT EXISTS tasks_claimable ON tasks (status, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    match_id TEXT NOT NULL,
+    stat_range INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    worker TEXT,
+    completed REAL NOT NULL,
+    exported INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (match_id, stat_range)
+);
+"""
+
+
+class WorkQueue:
+    """
+    SQLite backed queue of (match ID, range) tasks and their results.  Thread safe, so one instance can serve many HTTP requests.
+    A task is 'pending', 'leased' (claimed by a worker until lease_expires), 'done' or 'failed'.
+    """
+
+    def __init__(self, filename=QUEUE_FILE, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.filename = filename
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def enqueue(self, matches, player_stat_range):
+        """
+        Adds a task for each match (match list row) and range.  Matches already queued for the range are left as they are.  Returns the number added.
+        """
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO tasks (match_id, stat_range, match) VALUES (?, ?, ?)",
+                [(str(match[0]), int(player_stat_range), json.dumps(list(match))) for match in matches])
+            return connection.total_changes - before
+
+    def claim(self, worker, player_stat_range=None, limit=BATCH_SIZE):
+        """
+        Leases up to limit pending or expired tasks to worker, oldest first.  Returns list of {'stat_range': range, 'match': match list row}.
+        Expired tasks that used up their attempts are marked failed instead.
+        """
+        now = time.time()
+        range_filter = "" if player_stat_range is None else " AND stat_range = ?"
+        range_args = () if player_stat_range is None else (int(player_stat_range),)
+
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = 'failed', last_error = 'lease expired' WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts))
+            rows = connection.execute(
+                "SELECT match_id, stat_range, match FROM tasks WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))" + range_filter + " ORDER BY rowid LIMIT ?",
+                (now,) + range_args + (limit,)).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE match_id = ? AND stat_range = ?",
+                [(worker, now + self.lease_seconds, match_id, stat_range) for match_id, stat_range, _ in rows])
+
+        return [{'stat_range': stat_range, 'match': json.loads(match)} for _, stat_range, match in rows]
+
+    def renew(self, worker, tasks):
+        """
+        Extends the leases worker still holds on tasks, a list of (match_id, stat_range).  Returns the number renewed.
+        """
+        expires = time.time() + self.lease_seconds
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "UPDATE tasks SET lease_expires = ? WHERE match_id = ? AND stat_range = ? AND status = 'leased' AND worker = ?",
+                [(expires, str(match_id), int(stat_range), worker) for match_id, stat_range in tasks])
+            return connection.total_changes - before
+
+    def complete(self, worker, results):
+        """
+        Stores results, a list of (match_id, stat_range, player_stats), and marks their tasks done.
+        The first result for a (match ID, range) is kept, so reports from a worker whose lease was reassigned are harmless.  Returns the number of new results.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO results (match_id, stat_range, data, worker, completed) VALUES (?, ?, ?, ?, ?)",
+                [(str(match_id), int(stat_range), json.dumps(data), worker, now) for match_id, stat_range, data in results])
+            added = connection.total_changes - before
+            connection.executemany(
+                "UPDATE tasks SET status = 'done', worker = ?, lease_expires = NULL WHERE match_id = ? AND stat_range = ?",
+                [(worker, str(match_id), int(stat_range)) for match_id, stat_range, _ in results])
+            return added
+
+    def fail(self, worker, tasks, error):
+        """
+        Returns tasks worker could not finish to the queue, or marks them failed once they used up their attempts.
+        """
+        with self._transaction() as connection:
+            connection.executemany(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, last_error = ?, lease_expires = NULL "
+                "WHERE match_id = ? AND stat_range = ? AND status = 'leased' AND worker = ?",
+                [(self.max_attempts, str(error), str(match_id), int(stat_range), worker) for match_id, stat_range in tasks])
+
+    def retry_failed(self, player_stat_range=None):
+        """
+        Puts failed tasks back in the queue with their attempts reset.  Returns the number of tasks.
+        """
+        range_filter = "" if player_stat_range is None else " AND stat_range = ?"
+        range_args = () if player_stat_range is None else (int(player_stat_range),)
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.execute("UPDATE tasks SET status = 'pending', attempts = 0, worker = NULL WHERE status = 'failed'" + range_filter, range_args)
+            return connection.total_changes - before
+
+    def status(self):
+        """
+        Task counts per range and status, expired leases, and result counts.
+        """
+        now = time.time()
+        with self._lock:
+            task_counts = self._connection.execute("SELECT stat_range, status, COUNT(*) FROM tasks GROUP BY stat_range, status").fetchall()
+            expired = self._connection.execute("SELECT COUNT(*) FROM tasks WHERE status = 'leased' AND lease_expires < ?", (now,)).fetchone()[0]
+            result_counts = self._connection.execute("SELECT stat_range, COUNT(*), SUM(exported) FROM results GROUP BY stat_range").fetchall()
+            workers = self._connection.execute("SELECT worker, COUNT(*) FROM tasks WHERE status = 'leased' AND lease_expires >= ? GROUP BY worker", (now,)).fetchall()
+
+        ranges = OrderedDict()
+        for stat_range, status, count in sorted(task_counts):
+            ranges.setdefault(str(stat_range), {})[status] = count
+        for stat_range, count, exported in result_counts:
+            ranges.setdefault(str(stat_range), {}).update({'results': count, 'exported': exported or 0})
+        return {'ranges': ranges, 'expired_leases': expired, 'active_workers': dict(workers)}
+
+    def unexported_results(self, player_stat_range, limit=500):
+        """
+        Up to limit results not yet exported, as list of (match_id, date, player_stats).
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT results.match_id, tasks.match, results.data FROM results JOIN tasks USING (match_id, stat_range) "
+                "WHERE results.stat_range = ? AND results.exported = 0 ORDER BY results.rowid LIMIT ?",
+                (int(player_stat_range), limit)).fetchall()
+        # Only the top level is an OrderedDict, like the stats cells written by scrape_stat_range
+        return [(match_id, json.loads(match)[1], OrderedDict(json.loads(data))) for match_id, match, data in rows]
+
+    def mark_exported(self, player_stat_range, match_ids):
+        with self._transaction() as connection:
+            connection.executemany(
+                "UPDATE results SET exported = 1 WHERE match_id = ? AND stat_range = ?",
+                [(str(match_id), int(player_stat_range)) for match_id in match_ids])
+
+
+class RemoteWorkQueue:
+    """
+    Client for a queue served by serve_queue, with the claim / renew / complete / fail / status methods of WorkQueue.
+    """
+
+    def __init__(self, url, token=None, retries=REMOTE_RETRIES):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.retries = retries
+        self._session = requests.Session()
+        if token is not None:
+            self._session.headers['X-Queue-Token'] = token
+
+    def _call(self, method, path, payload=None):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._session.request(method, self.url + path, json=payload, timeout=60)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            if response.status_code >= 500 and attempt < self.retries:
+                time.sleep(backoff_delay(attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def claim(self, worker, player_stat_range=None, limit=BATCH_SIZE):
+        return self._call('POST', '/claim', {'worker': worker, 'stat_range': player_stat_range, 'limit': limit})
+
+    def renew(self, worker, tasks):
+        return self._call('POST', '/renew', {'worker': worker, 'tasks': tasks})
+
+    def complete(self, worker, results):
+        return self._call('POST', '/complete', {'worker': worker, 'results': results})
+
+    def fail(self, worker, tasks, error):
+        return self._call('POST', '/fail', {'worker': worker, 'tasks': tasks, 'error': str(error)})
+
+    def status(self):
+        return self._call('GET', '/status')
+
+
+def _is_loopback_host(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve_queue(queue, host='127.0.0.1', port=PORT, token=None):
+    """
+    Returns a ThreadingHTTPServer exposing queue (a WorkQueue) to RemoteWorkQueue clients.  Call serve_forever() on it.
+    If token is set, requests must send it in the X-Queue-Token header.  A host other than loopback (e.g. 0.0.0.0 for other machines) needs a token.
+    """
+    if token is None and not _is_loopback_host(host):
+        raise ValueError(f"A token is needed to serve the queue on '{host}', otherwise anyone who can reach it can complete or fail tasks.")
+
+    handlers = {
+        '/claim': lambda body: queue.claim(body['worker'], body.get('stat_range'), body.get('limit', BATCH_SIZE)),
+        '/renew': lambda body: queue.renew(body['worker'], body['tasks']),
+        '/complete': lambda body: queue.complete(body['worker'], body['results']),
+        '/fail': lambda body: queue.fail(body['worker'], body['tasks'], body['error']),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self):
+            if token is not None and self.headers.get('X-Queue-Token') != token:
+                self._reply(403, {'error': 'bad token'})
+                return False
+            return True
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path != '/status':
+                return self._reply(404, {'error': 'not found'})
+            self._reply(200, queue.status())
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            if not self._authorized():
+                return
+            handler = handlers.get(self.path)
+            if handler is None:
+                return self._reply(404, {'error': 'not found'})
+            try:
+                self._reply(200, handler(json.loads(body)))
+            except (ValueError, KeyError, TypeError) as error:
+                self._reply(400, {'error': repr(error)})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def open_queue(queue, token=None):
+    """
+    WorkQueue for a queue file, RemoteWorkQueue for an http(s) url.
+    """
+    if queue.startswith('http://') or queue.startswith('https://'):
+        return RemoteWorkQueue(queue, token)
+    return WorkQueue(queue)
+
+
+@contextmanager
+def keep_leases(queue, worker, tasks, interval=RENEW_INTERVAL):
+    """
+    Renews worker's leases on tasks every interval seconds while the block runs.
+    """
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(interval):
+            try:
+                queue.renew(worker, tasks)
+            except Exception as error:
+                print(f"WARNING: Leases not renewed! {error!r}")
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def run_worker(queue, player_stat_range=None, worker_id=None, batch_size=BATCH_SIZE, sleep_time=0.05, max_workers=1, wait=False, poll_interval=30, renew_interval=RENEW_INTERVAL):
+    """
+    Claims batches of tasks from queue (WorkQueue or RemoteWorkQueue), scrapes their player stats and reports the results, until the queue is empty.
+    With wait=True the worker keeps polling every poll_interval seconds instead of stopping.  Only tasks for player_stat_range are claimed if it is given.
+    Matches whose page or player stats pages could not be fetched are returned to the queue.  Returns the number of matches completed.
+    """
+    worker_id = worker_id or default_worker_id()
+    completed = 0
+    print(f"Worker {worker_id} started.")
+
+    while True:
+        tasks = queue.claim(worker_id, player_stat_range, batch_size)
+        if not tasks:
+            if not wait:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        matches_by_range = OrderedDict()
+        for task in tasks:
+            matches_by_range.setdefault(task['stat_range'], []).append(task['match'])
+
+        for stat_range, matches in matches_by_range.items():
+            keys = [[match[0], stat_range] for match in matches]
+            try:
+                with keep_leases(queue, worker_id, keys, renew_interval):
+                    match_data = scrape_player_stats_for_matches(matches, stat_range, sleep_time, max_workers)
+            except Exception as error:
+                print(f"ERROR: Batch failed! {error!r}")
+                queue.fail(worker_id, keys, repr(error))
+                continue
+
+            queue.complete(worker_id, [[match_id, stat_range, player_stats] for match_id, player_stats in match_data])
+            completed += len(match_data)
+
+            done_ids = {match_id for match_id, _ in match_data}
+            missing = [key for key in keys if key[0] not in done_ids]
+            if missing:
+                queue.fail(worker_id, missing, "match or player stats pages not fetched")
+
+        print(f"Worker {worker_id} completed {completed} matches.")
+
+    return completed
+
+
+def export_results(queue, player_stat_range, update_stats_csv=True, parquet_output=False, chunk_size=500):
+    """
+    Appends finished results for player_stat_range to the stats csv, and to the parquet dataset with parquet_output.
+    Match IDs already in the stats csv are skipped, so exporting again never duplicates a match.  Returns the number of matches written.
+    """
+    stats_csv = get_stats_csv_filename(player_stat_range)
+    written = 0
+
+    with PlayerStatsParquetWriter() if parquet_output else nullcontext() as parquet_writer:
+        while True:
+            results = queue.unexported_results(player_stat_range, chunk_size)
+            if not results:
+                break
+
+            saved_ids = get_csv_store(stats_csv, ['id', 'stats']).ids()
+            new_results = [result for result in results if result[0] not in saved_ids]
+
+            chunk_data = [[match_id, player_stats] for match_id, _, player_stats in new_results]
+            if chunk_data and update_stats_csv:
+                update_csv_file(stats_csv, chunk_data, ['id', 'stats'], quiet=True)
+            if chunk_data and parquet_output:
+                match_dates = {match_id: date for match_id, date, _ in new_results}
+                parquet_writer.write(flatten_match_player_stats(chunk_data, match_dates, player_stat_range))
+
+            queue.mark_exported(player_stat_range, [match_id for match_id, _, _ in results])
+            written += len(chunk_data)
+
+    print(f"{written} matches exported to {stats_csv}.")
+    return written
+
+
+def load_match_list_csv(match_list_csv=MATCH_LIST_CSV, start_date=None, end_date=None):
+    """
+    Rows of the match list csv, optionally only those dated between start_date and end_date (inclusive).
+    """
+    with open(match_list_csv, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return [row for row in reader if row and (start_date is None or row[1] >= start_date) and (end_date is None or row[1] <= end_date)]
+
+
+def enqueue_match_list(queue, match_list, player_stat_range):
+    """
+    Queues the matches of match_list not yet saved in the stats csv for player_stat_range.  Returns the number of tasks added.
+    """
+    saved_ids = load_saved_match_ids(get_stats_csv_filename(player_stat_range))
+    new_matches = [match for match in match_list if match[0] not in saved_ids]
+    added = queue.enqueue(new_matches, player_stat_range)
+    print(f"{len(match_list)} matches, {len(match_list) - len(new_matches)} already saved, {added} queued.")
+    return added
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = commands.add_parser('enqueue')
+    enqueue_parser.add_argument('range', type=int)
+    enqueue_parser.add_argument('--queue', default=QUEUE_FILE)
+    enqueue_parser.add_argument('--match-list', default=MATCH_LIST_CSV)
+    enqueue_parser.add_argument('--start-date', default=None)
+    enqueue_parser.add_argument('--end-date', default=None)
+
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--queue', default=QUEUE_FILE)
+    serve_parser.add_argument('--host', default='127.0.0.1', help="Use 0.0.0.0 (with --token) to accept workers on other machines")
+    serve_parser.add_argument('--port', type=int, default=PORT)
+    serve_parser.add_argument('--token', default=None)
+    serve_parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('queue')
+    worker_parser.add_argument('--range', type=int, default=None)
+    worker_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    worker_parser.add_argument('--max-workers', type=int, default=1)
+    worker_parser.add_argument('--sleep-time', type=float, default=0.05)
+    worker_parser.add_argument('--worker-id', default=None)
+    worker_parser.add_argument('--token', default=None)
+    worker_parser.add_argument('--wait', action='store_true', help="Keep polling when the queue is empty")
+
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('range', type=int)
+    export_parser.add_argument('--queue', default=QUEUE_FILE)
+    export_parser.add_argument('--parquet', action='store_true')
+
+    status_parser = commands.add_parser('status')
+    status_parser.add_argument('--queue', default=QUEUE_FILE)
+
+    retry_parser = commands.add_parser('retry-failed')
+    retry_parser.add_argument('--queue', default=QUEUE_FILE)
+    retry_parser.add_argument('--range', type=int, default=None)
+
+    args = arg_parser.parse_args()
+
+    if args.command == 'enqueue':
+        enqueue_match_list(WorkQueue(args.queue), load_match_list_csv(args.match_list, args.start_date, args.end_date), args.range)
+
+    elif args.command == 'serve':
+        server = serve_queue(WorkQueue(args.queue, lease_seconds=args.lease_seconds), args.host, args.port, args.token)
+        print(f"Serving {args.queue} on port {server.server_address[1]}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+    elif args.command == 'worker':
+        queue = open_queue(args.queue, args.token)
+        run_worker(queue, args.range, args.worker_id, args.batch_size, args.sleep_time, args.max_workers, args.wait)
+
+    elif args.command == 'export':
+        export_results(WorkQueue(args.queue), args.range, parquet_output=args.parquet)
+
+    elif args.command == 'status':
+        print(json.dumps(WorkQueue(args.queue).status(), indent=2))
+
+    elif args.command == 'retry-failed':
+        print(f"{WorkQueue(args.queue).retry_failed(args.range)} failed tasks queued again.")
+
+
+if __name__ == '__main__':
+    main()